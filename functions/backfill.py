@@ -0,0 +1,74 @@
+# backfill.py
+# ✅ [일회성 색인 채우기] 트리거가 새 문서/변경분만 색인하는 기능을 배포할 때 기존 문서를 1번 채우는 관리용 스크립트
+# Cloud Functions 로 노출하지 않음 (인증 없는 엔드포인트가 되므로) - 서비스 계정 자격 증명으로 로컬에서 실행
+# 모두 여러 번 돌려도 결과가 같게 작성 (중간에 끊기면 처음부터 다시 돌리면 됨)
+#
+# 실행 (functions/ 에서, GOOGLE_APPLICATION_CREDENTIALS 설정 후):
+#   python backfill.py bedtime        # users → bedtime_buckets/{HHMM}/members (취침 알림 스케줄러용)
+#   python backfill.py report_queued  # session_state.report_queued 가 없는 옛 문서 (세션 종료 스윕용)
+
+import argparse
+
+from google.cloud import firestore as gcf
+
+import logs
+from notifications import backfill_bedtime_index
+
+PAGE_SIZE = 500  # WriteBatch 한도
+
+
+def backfill_report_queued(db: gcf.Client, page_size: int = PAGE_SIZE) -> dict:
+    """
+    report_queued 필드가 생기기 전에 만든 session_state 문서에 값을 채움
+    sweep_ended_sessions 는 where("report_queued", "==", False) 로 찾는데, Firestore 는 필드가 없는 문서를
+    이 조건에 넣지 않으므로 그대로 두면 이런 세션은 리포트 작업이 영영 등록되지 않음
+      sleep_reports/{sessionId} 가 이미 있으면 True (다시 만들지 않음), 없으면 False (다음 스윕이 등록)
+    """
+    states = db.collection("session_state")
+    reports = db.collection("sleep_reports")
+    stats = {"states": 0, "missing": 0, "queued_true": 0, "queued_false": 0}
+    cursor = None
+    while True:
+        query = states.order_by("__name__").limit(page_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        page = list(query.stream())
+        if not page:
+            break
+        cursor = page[-1]
+        stats["states"] += len(page)
+
+        legacy = [(doc, doc.to_dict() or {}) for doc in page]
+        legacy = [(doc, data) for doc, data in legacy if "report_queued" not in data and data.get("sessionId")]
+        if legacy:
+            refs = [reports.document(data["sessionId"]) for _, data in legacy]
+            has_report = {snap.id for snap in db.get_all(refs) if snap.exists}
+            batch = db.batch()
+            for doc, data in legacy:
+                queued = data["sessionId"] in has_report
+                batch.update(doc.reference, {"report_queued": queued})
+                stats["queued_true" if queued else "queued_false"] += 1
+            batch.commit()
+            stats["missing"] += len(legacy)
+        if len(page) < page_size:
+            break
+    return stats
+
+
+_JOBS = {
+    "bedtime": backfill_bedtime_index,
+    "report_queued": backfill_report_queued,
+}
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("job", choices=sorted(_JOBS))
+    args = parser.parse_args()
+
+    stats = _JOBS[args.job](gcf.Client())
+    logs.info("[색인 채우기 완료] %s %s", args.job, stats)
+
+
+if __name__ == "__main__":
+    main_cli()
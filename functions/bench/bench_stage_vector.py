@@ -0,0 +1,62 @@
+# bench_stage_vector.py
+# 스칼라 규칙(main.predict_stage_hybrid) vs 벡터 규칙(stage_vector) 처리량 비교
+# 두 규칙이 같은 단계를 내는지는 tests/test_stage_vector.py (pytest) 에서 확인
+#
+# 실행 (functions/ 에서):
+#   python bench/bench_stage_vector.py              # 10^6 샘플
+#   python bench/bench_stage_vector.py -n 200000 --seed 7
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import predict_stage_hybrid  # noqa: E402
+from stage_vector import predict_stage_hybrid_batch  # noqa: E402
+
+
+def make_inputs(n: int, seed: int) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return {
+        "hr": rng.uniform(40, 110, n),
+        "spo2": rng.uniform(85, 100, n),
+        "mic_avg": rng.uniform(0, 200, n),
+        "pressure_avg": rng.uniform(0, 3500, n),
+    }
+
+
+def bench(cols: dict[str, np.ndarray]) -> None:
+    args = (cols["hr"], cols["spo2"], cols["mic_avg"], cols["pressure_avg"])
+    rows = list(zip(*(a.tolist() for a in args)))
+    n = len(rows)
+
+    t0 = time.perf_counter()
+    for r in rows:
+        predict_stage_hybrid(*r)
+    scalar_sec = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    predict_stage_hybrid_batch(*args)
+    vector_sec = time.perf_counter() - t0
+
+    print(f"scalar : {scalar_sec:8.3f}s  ({n / scalar_sec:,.0f} samples/s)")
+    print(f"vector : {vector_sec:8.3f}s  ({n / vector_sec:,.0f} samples/s)")
+    print(f"speedup: x{scalar_sec / vector_sec:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=1_000_000, help="샘플 수 (기본 10^6)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    cols = make_inputs(args.n, args.seed)
+    bench(cols)
+
+
+if __name__ == "__main__":
+    main()
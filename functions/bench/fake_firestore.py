@@ -0,0 +1,268 @@
+# fake_firestore.py
+# 벤치마크/리플레이용 프로세스 내 Firestore 대역 - main.py 가 쓰는 만큼만 구현
+#   collection().document() / add(), DocumentReference.get/set/update/create/delete,
+#   WriteBatch, Transaction (@gcf.transactional 과 호환), SERVER_TIMESTAMP 치환, merge 의 DELETE_FIELD
+#   쿼리: where(==, <, <=, >, >=) / order_by / limit / start_after(스냅샷) / stream - 스케줄러 리플레이용
+#         필드가 없는 문서는 그 필드의 필터/정렬에서 빠짐 (Firestore 와 같음), 색인 검사는 하지 않음
+# 읽기/쓰기/트랜잭션 수를 세어서 샘플당 비용을 계산할 수 있게 함
+
+import copy
+import itertools
+import operator
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore as gcf
+
+
+class MemSnapshot:
+    def __init__(self, ref: "MemDocRef", data: dict | None):
+        self.reference = ref
+        self.id = ref.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> dict | None:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field: str):
+        return (self._data or {}).get(field)
+
+
+class MemDocRef:
+    def __init__(self, client: "MemFirestore", path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str) -> "MemCollection":
+        return MemCollection(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None, **_) -> MemSnapshot:
+        self._client.stats["reads"] += 1
+        return MemSnapshot(self, self._client._docs.get(self.path))
+
+    def set(self, data: dict, merge: bool = False):
+        self._client._apply([("set", self, data, merge)])
+
+    def update(self, data: dict):
+        self._client._apply([("update", self, data, False)])
+
+    def create(self, data: dict):
+        self._client._apply([("create", self, data, False)])
+
+    def delete(self):
+        self._client._apply([("delete", self, None, False)])
+
+
+_OPS = {"==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+_MISSING = object()
+
+
+def _field(data: dict, path: str, doc_id: str):
+    if path == "__name__":
+        return doc_id
+    value = data
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+class MemQuery:
+    def __init__(self, collection: "MemCollection", filters=(), orders=(), limit=None, after=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._after = after
+
+    def _with(self, **kw) -> "MemQuery":
+        args = {"filters": self._filters, "orders": self._orders, "limit": self._limit, "after": self._after, **kw}
+        return MemQuery(self._collection, **args)
+
+    def where(self, field: str, op: str, value) -> "MemQuery":
+        return self._with(filters=self._filters + ((field, _OPS[op], value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "MemQuery":
+        return self._with(orders=self._orders + ((field, direction == "DESCENDING"),))
+
+    def limit(self, n: int) -> "MemQuery":
+        return self._with(limit=n)
+
+    def start_after(self, snapshot: MemSnapshot) -> "MemQuery":
+        return self._with(after=snapshot)
+
+    def _key(self, snap: MemSnapshot) -> tuple:
+        # 정렬 필드 값 + 문서 ID (값이 같으면 ID 순 - Firestore 와 같음)
+        data = snap._data or {}
+        return tuple(_field(data, f, snap.id) for f, _ in self._orders) + (snap.id,)
+
+    def stream(self):
+        if any(desc for _, desc in self._orders):
+            raise NotImplementedError("MemQuery 는 오름차순 정렬만 지원")  # main.py 스케줄러는 오름차순만 씀
+        fields = {f for f, _, _ in self._filters} | {f for f, _ in self._orders}
+        snaps = [
+            s for s in self._collection.docs()
+            if all(_field(s._data, f, s.id) is not _MISSING for f in fields)
+            and all(op(_field(s._data, f, s.id), v) for f, op, v in self._filters)
+        ]
+        snaps.sort(key=self._key)
+        if self._after is not None:
+            after = self._key(self._after)
+            snaps = [s for s in snaps if self._key(s) > after]
+        if self._limit is not None:
+            snaps = snaps[:self._limit]
+        self._collection._client.stats["reads"] += max(1, len(snaps))
+        return iter([MemSnapshot(s.reference, copy.deepcopy(s._data)) for s in snaps])
+
+
+class MemCollection:
+    def __init__(self, client: "MemFirestore", path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id: str | None = None) -> MemDocRef:
+        return MemDocRef(self._client, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def where(self, field: str, op: str, value) -> MemQuery:
+        return MemQuery(self).where(field, op, value)
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> MemQuery:
+        return MemQuery(self).order_by(field, direction)
+
+    def limit(self, n: int) -> MemQuery:
+        return MemQuery(self).limit(n)
+
+    def add(self, data: dict):
+        ref = self.document()
+        ref.create(data)
+        return self._client.now(), ref
+
+    def docs(self) -> list[MemSnapshot]:
+        """테스트/리포트용 - 컬렉션 안의 문서 전체 (읽기 수에 포함하지 않음)"""
+        prefix = self.path + "/"
+        with self._client._lock:
+            items = list(self._client._docs.items())
+        return [
+            MemSnapshot(MemDocRef(self._client, path), data)
+            for path, data in items
+            if path.startswith(prefix) and "/" not in path[len(prefix):]
+        ]
+
+
+class MemWriteBatch:
+    def __init__(self, client: "MemFirestore"):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, data, merge=False): self._ops.append(("set", ref, data, merge))
+    def update(self, ref, data): self._ops.append(("update", ref, data, False))
+    def create(self, ref, data): self._ops.append(("create", ref, data, False))
+    def delete(self, ref): self._ops.append(("delete", ref, None, False))
+
+    def commit(self):
+        self._client.stats["batches"] += 1
+        self._client._apply(self._ops)
+        self._ops = []
+
+
+class MemTransaction(MemWriteBatch):
+    """@gcf.transactional 이 호출하는 내부 메서드만 흉내 (단일 스레드 리플레이라 충돌 없음)"""
+    _max_attempts = 5
+    _read_only = False
+
+    def __init__(self, client: "MemFirestore"):
+        super().__init__(client)
+        self._id = None
+
+    def _clean_up(self):
+        self._ops = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = next(self._client._tx_ids)
+
+    def _commit(self):
+        self._client.stats["transactions"] += 1
+        self._client._apply(self._ops)
+        self._clean_up()
+        return []
+
+    def _rollback(self):
+        self._clean_up()
+
+
+class MemFirestore:
+    """gcf.Client 대역. now: SERVER_TIMESTAMP 로 쓸 시각을 돌려주는 함수 (리플레이 시계)"""
+
+    def __init__(self, now=None):
+        self.now = now or (lambda: datetime.now(timezone.utc))
+        self._docs: dict[str, dict] = {}
+        self._tx_ids = itertools.count(1)
+        self._lock = threading.Lock()  # process_report_jobs 처럼 워커 스레드에서 쓰는 경로용
+        self.stats = {"reads": 0, "writes": 0, "transactions": 0, "batches": 0}
+
+    def collection(self, name: str) -> MemCollection:
+        return MemCollection(self, name)
+
+    def transaction(self, **_) -> MemTransaction:
+        return MemTransaction(self)
+
+    def batch(self) -> MemWriteBatch:
+        return MemWriteBatch(self)
+
+    def get_all(self, refs, transaction=None):
+        for ref in refs:
+            yield ref.get()
+
+    # ---------- 내부 ----------
+    def _resolve(self, value):
+        if value is gcf.SERVER_TIMESTAMP:
+            return self.now()
+        if isinstance(value, dict):
+            return {k: self._resolve(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._resolve(v) for v in value]
+        return value
+
+    def _apply(self, ops):
+        with self._lock:
+            self._apply_locked(ops)
+
+    def _apply_locked(self, ops):
+        # create 충돌은 커밋 전체를 실패시킴 (Firestore 와 같음)
+        for op, ref, _, _ in ops:
+            if op == "create" and ref.path in self._docs:
+                raise gexc.AlreadyExists(f"Document already exists: {ref.path}")
+        for op, ref, data, merge in ops:
+            self.stats["writes"] += 1
+            if op == "delete":
+                self._docs.pop(ref.path, None)
+                continue
+            data = self._resolve(copy.deepcopy(data))
+            if op == "update":
+                if ref.path not in self._docs:
+                    raise gexc.NotFound(f"No document to update: {ref.path}")
+                self._docs[ref.path].update(data)
+            elif op == "set" and merge and ref.path in self._docs:
+                _deep_merge(self._docs[ref.path], data)
+            else:
+                self._docs[ref.path] = data
+
+
+def _deep_merge(dst: dict, src: dict):
+    for k, v in src.items():
+        if v is gcf.DELETE_FIELD:
+            dst.pop(k, None)
+        elif isinstance(v, dict) and isinstance(dst.get(k), dict):
+            _deep_merge(dst[k], v)
+        else:
+            dst[k] = v
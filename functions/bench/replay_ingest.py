@@ -0,0 +1,320 @@
+# replay_ingest.py
+# 수면 1회분(8시간 × 1Hz × N명) raw_data 를 실제 on_new_data 코드로 재생하는 오프라인 벤치마크
+# Firestore 는 bench/fake_firestore.py 의 메모리 대역, 시계는 샘플 시각을 따라가는 가상 시계
+#
+# 출력: 샘플당 지연 백분위, 파이썬 CPU 시간, 샘플당 읽기/쓰기/트랜잭션 수, 단계 전환 수
+# 기준선 저장/비교로 _update_session_state, predict_stage_hybrid, 알림 로직 변경 전후를 비교
+# 수집이 끝나면 스케줄러(세션 종료 스윕 → 리포트 작업 큐 → 만료 명령 정리 → 취침 알림)와 on_user_written 을
+# 1번씩 돌려서 함수별 opstats 요약을 같이 출력 - 요약이 안 나온 함수가 있으면 종료 코드 1
+#
+# 실행 (functions/ 에서):
+#   python bench/replay_ingest.py                                  # 합성 데이터 4명 × 8시간
+#   python bench/replay_ingest.py --users 10 --hours 2 --seed 7
+#   python bench/replay_ingest.py --backend memory                 # storage.MemoryRepository (Firestore 호출 패턴 대신 로직만 측정)
+#   python bench/replay_ingest.py --format chunk                   # 샘플을 60초 raw_chunks 문서로 묶어서 on_new_chunk 로 재생
+#   python bench/replay_ingest.py --input night.jsonl              # 기록된 raw_data (한 줄에 문서 1개, ts 는 epoch 초/ms 또는 ISO)
+#   python bench/replay_ingest.py --save-baseline bench/baseline_ingest.json
+#   python bench/replay_ingest.py --compare bench/baseline_ingest.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from chunks import pack_samples  # noqa: E402
+from command_dedup import CommandDedupCache  # noqa: E402
+from decoder import to_utc  # noqa: E402
+from fake_firestore import MemFirestore, MemSnapshot  # noqa: E402
+import logs  # noqa: E402
+from report_jobs import REPORT_JOB_ENQUEUE_JITTER_SEC  # noqa: E402
+from session_cache import SessionStateCache  # noqa: E402
+from storage import MemoryRepository  # noqa: E402
+
+NIGHT_START = datetime(2026, 1, 1, 14, 0, tzinfo=timezone.utc)  # 23:00 KST
+ARRIVAL_DELAY_SEC = 0.3  # 기기 업로드 → 트리거 실행까지의 지연 (가상 시계)
+
+# 90분 수면 주기 (분, 단계) - 합성 데이터용
+_CYCLE = [(20, "Light"), (25, "Deep"), (20, "Light"), (20, "REM"), (5, "Awake")]
+_SIGNAL = {  # 단계별 (hr, pressure_avg, mic_avg) 평균
+    "Light": (66, 1500, 40),
+    "Deep": (55, 1500, 20),
+    "REM": (78, 800, 15),
+    "Awake": (92, 1800, 60),
+}
+
+
+def synthetic_night(user_idx: int, hours: float, rng: np.random.Generator) -> list[dict]:
+    """1Hz 샘플 - 주기별 단계 + 노이즈 + 가끔 무호흡(SpO2 하락)/코골이/뒤척임"""
+    n = int(hours * 3600)
+    stage_by_min = []
+    while len(stage_by_min) < n / 60 + 1:
+        for minutes, stage in _CYCLE:
+            stage_by_min.extend([stage] * minutes)
+    stages = [stage_by_min[i // 60] for i in range(n)]
+    base = np.array([_SIGNAL[s] for s in stages], dtype=np.float64)
+
+    hr = base[:, 0] + rng.normal(0, 3, n)
+    pressure = base[:, 1] + rng.normal(0, 120, n)
+    mic = np.abs(base[:, 2] + rng.normal(0, 8, n))
+    spo2 = np.clip(97 + rng.normal(0, 0.8, n), 90.5, 100)
+
+    for _ in range(int(hours * 4)):  # 무호흡 20초
+        i = rng.integers(0, max(1, n - 20))
+        spo2[i:i + 20] = rng.uniform(86, 90, min(20, n - i))
+    for _ in range(int(hours * 2)):  # 코골이 3분
+        i = rng.integers(0, max(1, n - 180))
+        mic[i:i + 180] = rng.uniform(155, 190, min(180, n - i))
+    for _ in range(int(hours * 3)):  # 뒤척임 10초
+        i = rng.integers(0, max(1, n - 10))
+        pressure[i:i + 10] = rng.uniform(3050, 3400, min(10, n - i))
+
+    user_id, session_id = f"user{user_idx:03d}", f"night{user_idx:03d}"
+    return [
+        {
+            "userId": user_id, "sessionId": session_id,
+            "ts": NIGHT_START + timedelta(seconds=i, milliseconds=int(user_idx * 37 % 1000)),
+            "hr": round(float(hr[i]), 1), "spo2": round(float(spo2[i]), 1),
+            "mic_avg": round(float(mic[i]), 1), "pressure_avg": round(float(pressure[i]), 1),
+            "auto_control_active": True,
+        }
+        for i in range(n)
+    ]
+
+
+def load_recorded(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        docs = [json.loads(line) for line in f if line.strip()]
+    for d in docs:
+        d["ts"] = to_utc(d.get("ts")) or datetime.now(timezone.utc)
+    return docs
+
+
+class _Clock:
+    def __init__(self, t: datetime):
+        self.t = t
+
+    def __call__(self) -> datetime:
+        return self.t
+
+
+class _Event:
+    def __init__(self, snap, params: dict | None = None):
+        self.data = snap
+        self.params = params or {}
+
+
+class _Change:
+    def __init__(self, before, after):
+        self.before, self.after = before, after
+
+
+class _ScheduledEvent:
+    def __init__(self, schedule_time: datetime):
+        self.schedule_time = schedule_time
+
+
+SCHEDULED = ("sweep_ended_sessions", "process_report_jobs", "sweep_expired_commands", "send_bedtime_reminders")
+_SUMMARY_KEYS = ("reads", "writes", "commits", "transactions", "queries", "query_docs", "ops")
+
+
+def _opstats_summary(handler, event) -> dict | None:
+    """handler(event) 1번 실행 → 그 호출의 opstats 요약 (출력이 없었으면 None)"""
+    out = io.StringIO()
+    fmt, logs.LOG_FORMAT = logs.LOG_FORMAT, "json"
+    try:
+        with contextlib.redirect_stdout(out):
+            handler(event)
+    finally:
+        logs.LOG_FORMAT = fmt
+    for line in out.getvalue().splitlines():
+        try:
+            record = json.loads(line).get("opstats")
+        except (ValueError, AttributeError):
+            continue
+        if record:
+            return {k: record[k] for k in _SUMMARY_KEYS}
+    return None
+
+
+def replay_schedulers(db: MemFirestore, clock: _Clock) -> dict:
+    """
+    수집 뒤 스케줄러를 실제 배포 순서대로 1번씩 - 시계는 세션 종료 기준 + 작업 등록 지터만큼 넘김
+    on_user_written 은 취침 시각/토큰이 있는 사용자 문서 생성 이벤트로 (bedtime_buckets 색인 쓰기)
+    --backend memory 면 세션 상태가 MemoryRepository 에 있어서 스케줄러 조회는 빈 결과 (쿼리 읽기만 남음)
+    반환: 함수별 opstats 요약 (요약이 안 나왔으면 None)
+    """
+    users = db.collection("users")
+    profile = {"bedtime": "07:00", "fcmToken": "replay-token"}  # 알림 슬롯 0600 - 아래 발송 시각과 겹치지 않음
+    result = {"on_user_written": _opstats_summary(
+        main.on_user_written.__wrapped__,
+        _Event(_Change(MemSnapshot(users.document("user000"), None), MemSnapshot(users.document("user000"), profile)),
+               params={"userId": "user000"}),
+    )}
+    clock.t += timedelta(seconds=main.SESSION_END_IDLE_SEC + 60)
+    for name in SCHEDULED:
+        if name == "process_report_jobs":
+            clock.t += timedelta(seconds=REPORT_JOB_ENQUEUE_JITTER_SEC + 60)
+        result[name] = _opstats_summary(getattr(main, name).__wrapped__, _ScheduledEvent(clock.t))
+    return result
+
+
+def _chunk_arrivals(samples: list[dict]) -> list[tuple[datetime, dict]]:
+    """세션별로 60초 청크를 만들고 (마지막 슬롯 시각, 청크) 를 도착 순서대로"""
+    by_session: dict[tuple, list[dict]] = {}
+    for d in samples:
+        by_session.setdefault((d["userId"], d["sessionId"]), []).append(d)
+    chunks = [c for docs in by_session.values() for c in pack_samples(docs)]
+    return sorted(((c["end_ts"], c) for c in chunks), key=lambda a: a[0])
+
+
+def replay(samples: list[dict], backend: str = "firestore", fmt: str = "raw") -> dict:
+    """
+    도착 순서대로 on_new_data (fmt="chunk" 면 on_new_chunk) 실행 - 실제 코드 경로 그대로, 저장소/시계만 교체
+    backend: "firestore" = FirestoreRepository + 메모리 Firestore 대역, "memory" = MemoryRepository
+    """
+    samples = sorted(samples, key=lambda d: d["ts"])
+    if fmt == "chunk":
+        arrivals, collection, handler = _chunk_arrivals(samples), "raw_chunks", main.on_new_chunk.__wrapped__
+    else:
+        arrivals, collection, handler = [(d["ts"], d) for d in samples], "raw_data", main.on_new_data.__wrapped__
+    clock = _Clock(samples[0]["ts"])
+    db = MemFirestore(now=clock)
+    repo = MemoryRepository(now=clock) if backend == "memory" else None
+    raw = db.collection(collection)
+
+    saved = main._db, main._repo, main.now_utc, main._session_cache, main._command_dedup
+    main._db, main._repo, main.now_utc, main._session_cache, main._command_dedup = db, repo, clock, SessionStateCache(), CommandDedupCache()
+    latencies = np.empty(len(arrivals), dtype=np.float64)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            cpu0 = time.process_time()
+            for i, (ts, doc) in enumerate(arrivals):
+                clock.t = ts + timedelta(seconds=ARRIVAL_DELAY_SEC)
+                event = _Event(MemSnapshot(raw.document(), doc))
+                t0 = time.perf_counter()
+                handler(event)
+                latencies[i] = time.perf_counter() - t0
+            cpu_sec = time.process_time() - cpu0
+        cache_stats = dict(main._session_cache.stats)
+        dedup_stats = dict(main._command_dedup.stats)
+        if repo is not None:
+            stats = dict(repo.stats)
+            counts = {name: len(repo.collections.get(name, {})) for name in ("processed_data", "commands", "pressure_alerts")}
+        else:
+            stats = dict(db.stats)
+            counts = {name: len(db.collection(name).docs()) for name in ("processed_data", "commands", "pressure_alerts")}
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            schedulers = replay_schedulers(db, clock)
+    finally:
+        main._db, main._repo, main.now_utc, main._session_cache, main._command_dedup = saved
+
+    n = len(samples)
+    lat_ms = latencies * 1000
+    return {
+        "samples": n,
+        "sessions": len({(d["userId"], d["sessionId"]) for d in samples}),
+        "ingest_docs": len(arrivals),  # 기기가 쓰는 문서 수 (샘플 또는 청크)
+        "latency_ms": {
+            "p50": round(float(np.percentile(lat_ms, 50)), 4),
+            "p90": round(float(np.percentile(lat_ms, 90)), 4),
+            "p99": round(float(np.percentile(lat_ms, 99)), 4),
+            "max": round(float(lat_ms.max()), 4),
+            "mean": round(float(lat_ms.mean()), 4),
+        },
+        "cpu_sec": round(cpu_sec, 3),
+        "cpu_us_per_sample": round(cpu_sec / n * 1e6, 2),
+        "per_sample": {
+            "reads": round(stats["reads"] / n, 4),
+            "writes": round(stats["writes"] / n, 4),
+            "transactions": round(stats["transactions"] / n, 4),
+        },
+        "totals": {
+            **stats,
+            "transitions": counts["processed_data"],
+            "commands": counts["commands"],
+            "pressure_alerts": counts["pressure_alerts"],
+        },
+        "session_cache": cache_stats,
+        "command_dedup": dedup_stats,
+        "schedulers": schedulers,
+    }
+
+
+def _flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict): out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)): out[key] = v
+    return out
+
+
+def print_report(result: dict, baseline: dict | None = None) -> None:
+    cur = _flatten(result["metrics"])
+    base = _flatten(baseline["metrics"]) if baseline else {}
+    print(f"config: {result['config']}")
+    for key, value in cur.items():
+        line = f"  {key:<32} {value:>14,.4f}" if isinstance(value, float) else f"  {key:<32} {value:>14,}"
+        if key in base:
+            b = base[key]
+            delta = (value - b) / b * 100 if b else 0.0
+            line += f"   (기준 {b:,} → {delta:+.1f}%)"
+        print(line)
+    if baseline and baseline.get("config") != result["config"]:
+        print("⚠️ 기준선과 설정이 다릅니다 - 수치 비교는 참고만 하세요")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--hours", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", choices=("firestore", "memory"), default="firestore")
+    parser.add_argument("--format", choices=("raw", "chunk"), default="raw")
+    parser.add_argument("--input", help="기록된 raw_data JSONL (지정하면 합성 데이터 대신 사용)")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    args = parser.parse_args()
+
+    if args.input:
+        samples = load_recorded(args.input)
+        config = {"input": os.path.basename(args.input), "backend": args.backend, "format": args.format}
+    else:
+        rng = np.random.default_rng(args.seed)
+        samples = [s for u in range(args.users) for s in synthetic_night(u, args.hours, rng)]
+        config = {"users": args.users, "hours": args.hours, "seed": args.seed, "backend": args.backend, "format": args.format}
+
+    result = {
+        "config": config,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "metrics": replay(samples, args.backend, args.format),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"💾 기준선 저장: {args.save_baseline}")
+
+    silent = [name for name, summary in result["metrics"]["schedulers"].items() if not summary]
+    if silent:
+        print(f"❌ opstats 요약이 없는 함수: {', '.join(silent)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,94 @@
+# replay_stabilizer.py
+# 단계 안정화 설정별로 같은 밤들을 재생해서 밤(세션)마다 안정 단계 전환 수 / 명령 수 / Firestore 쓰기 수를 비교
+# 재생은 replay_ingest.replay 그대로 (on_new_data 실제 코드 경로), 설정만 main.STABILIZER 로 바꿔 끼움
+#
+# 실행 (functions/ 에서):
+#   python bench/replay_stabilizer.py                                   # legacy(기준) vs smoothed, 합성 4명 × 8시간
+#   python bench/replay_stabilizer.py --after '{"preset": "smoothed", "confirm_sec": 20}'
+#   python bench/replay_stabilizer.py --before smoothed --after '{"preset": "smoothed", "vote": "median"}'
+#   python bench/replay_stabilizer.py --input night.jsonl --json report.json
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from replay_ingest import load_recorded, replay, synthetic_night  # noqa: E402
+from stabilizer import parse_config  # noqa: E402
+
+_COLUMNS = ("transitions", "commands", "writes")
+
+
+def replay_nights(samples: list[dict], config, fmt: str = "raw") -> dict[str, dict]:
+    """세션별로 따로 재생 → {세션: {"transitions", "commands", "writes"}}"""
+    by_session: dict[str, list[dict]] = {}
+    for d in samples:
+        by_session.setdefault(f"{d['userId']}/{d['sessionId']}", []).append(d)
+    saved = main.STABILIZER
+    main.STABILIZER = config
+    try:
+        out = {}
+        for key in sorted(by_session):
+            metrics = replay(by_session[key], "firestore", fmt)
+            totals = metrics["totals"]
+            out[key] = {"transitions": totals["transitions"], "commands": totals["commands"], "writes": totals["writes"]}
+        return out
+    finally:
+        main.STABILIZER = saved
+
+
+def _pct(before: float, after: float) -> str:
+    return f"{(after - before) / before * 100:+.1f}%" if before else "-"
+
+
+def print_report(before: dict[str, dict], after: dict[str, dict]) -> None:
+    header = f"{'night':<24}" + "".join(f"{c + ' (전→후)':>28}" for c in _COLUMNS)
+    print(header)
+    print("-" * len(header))
+    rows = list(before) + ["합계"]
+    total_b = {c: sum(n[c] for n in before.values()) for c in _COLUMNS}
+    total_a = {c: sum(n[c] for n in after.values()) for c in _COLUMNS}
+    for key in rows:
+        b, a = (total_b, total_a) if key == "합계" else (before[key], after[key])
+        print(f"{key:<24}" + "".join(f"{f'{b[c]:,} → {a[c]:,} ({_pct(b[c], a[c])})':>28}" for c in _COLUMNS))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--before", default="legacy", help="기준 설정 (프리셋 이름 또는 JSON)")
+    parser.add_argument("--after", default="smoothed", help="비교할 설정 (프리셋 이름 또는 JSON)")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--hours", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--format", choices=("raw", "chunk"), default="raw")
+    parser.add_argument("--input", help="기록된 raw_data JSONL (지정하면 합성 데이터 대신 사용)")
+    parser.add_argument("--json", metavar="PATH", help="결과를 JSON 으로도 저장")
+    args = parser.parse_args()
+
+    if args.input:
+        samples = load_recorded(args.input)
+    else:
+        rng = np.random.default_rng(args.seed)
+        samples = [s for u in range(args.users) for s in synthetic_night(u, args.hours, rng)]
+
+    before_cfg, after_cfg = parse_config(args.before), parse_config(args.after)
+    print(f"before: {before_cfg.as_dict()}")
+    print(f"after : {after_cfg.as_dict()}")
+    before = replay_nights(samples, before_cfg, args.format)
+    after = replay_nights(samples, after_cfg, args.format)
+    print_report(before, after)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"before": {"config": before_cfg.as_dict(), "nights": before},
+                       "after": {"config": after_cfg.as_dict(), "nights": after}}, f, ensure_ascii=False, indent=2)
+        print(f"💾 저장: {args.json}")
+
+
+if __name__ == "__main__":
+    main_cli()
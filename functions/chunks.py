@@ -0,0 +1,234 @@
+# chunks.py
+# ✅ [raw 청크 포맷] 한 세션의 일정 시간 구간 샘플을 문서 1개에 - 열마다 리틀엔디언 고정 크기 배열로 묶어서 저장
+# 샘플마다 raw_data 문서 1개(필드 8~14개, 필드마다 색인 항목) → 구간(기본 60초)마다 raw_chunks 문서 1개
+#
+# 문서 (raw_chunks/{userId}__{sessionId}__{start_ms})
+#   v           : 포맷 버전 (CHUNK_FORMAT_VERSION)
+#   userId, sessionId
+#   start_ts    : 첫 슬롯 시각, end_ts: 마지막 슬롯 시각 (조회/정렬용)
+#   interval_ms : 슬롯 간격 - i 번째 샘플 시각 = start_ts + i × interval_ms
+#   count       : 슬롯 수
+#   cols        : data 안의 열 순서 (이름은 COLUMN_TYPES 에 있어야 함)
+#   data        : 열들을 cols 순서로 이어 붙인 bytes (열 하나 = count × 원소 크기)
+#
+# flags 열 (uint8): FLAG_PRESENT (샘플 있음 - 빈 슬롯은 0, 실수 열은 NaN), FLAG_AUTO_CONTROL, FLAG_SNORING
+# 읽기는 np.frombuffer 로 data 를 복사 없이 열 배열로 봄 (읽기 전용 뷰)
+# data 는 색인에서 제외 (firestore.indexes.json fieldOverrides) - 문서 1개당 색인 항목은 메타 필드 몇 개뿐
+# 문서 ID 가 구간 시작 시각으로 정해지므로 앱이 재전송해도 create() 가 AlreadyExists 로 막힘
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from decoder import DecodeError, SampleBatch, decode_sample, epoch_seconds, to_utc
+
+CHUNK_COLLECTION = "raw_chunks"
+CHUNK_FORMAT_VERSION = 1
+CHUNK_DEFAULT_INTERVAL_MS = 1000
+CHUNK_DEFAULT_WINDOW_SEC = 60
+CHUNK_MAX_SAMPLES = 3600  # 열 12개 × 4바이트 × 3600 ≈ 170KB (문서 한도 1MiB)
+
+FLAG_PRESENT, FLAG_AUTO_CONTROL, FLAG_SNORING = 1, 2, 4
+
+# 열 이름 → dtype (리틀엔디언). 순서 = 인코딩 순서 (4바이트 열을 앞에, flags 는 마지막)
+COLUMN_TYPES = {
+    "hr": "<f4",
+    "spo2": "<f4",
+    "mic_avg": "<f4",
+    "pressure_avg": "<f4",
+    "pressure_1_avg_10s": "<f4",
+    "pressure_2_avg_10s": "<f4",
+    "pressure_3_avg_10s": "<f4",
+    "mic_1_avg_10s": "<f4",
+    "mic_2_avg_10s": "<f4",
+    "pillow_battery": "<f4",
+    "watch_battery": "<f4",
+    "flags": "<u1",
+}
+REQUIRED_COLUMNS = ("hr", "spo2", "mic_avg", "pressure_avg", "flags")
+_EXTRA_COLUMNS = tuple(c for c in COLUMN_TYPES if c not in REQUIRED_COLUMNS)
+
+
+def chunk_id(user_id: str, session_id: str, start: datetime) -> str:
+    return f"{user_id}__{session_id}__{int(round(epoch_seconds(start) * 1000))}"
+
+
+# ---------- 인코딩 ----------
+
+def encode_chunk(user_id: str, session_id: str, start: datetime, interval_ms: int, columns: dict) -> dict:
+    """열 배열(dict) → raw_chunks 문서. REQUIRED_COLUMNS 는 필수, 나머지 COLUMN_TYPES 열은 있으면 포함"""
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ValueError(f"missing chunk columns: {missing}")
+    unknown = [c for c in columns if c not in COLUMN_TYPES]
+    if unknown:
+        raise ValueError(f"unknown chunk columns: {unknown}")
+    count = len(columns["flags"])
+    if not 0 < count <= CHUNK_MAX_SAMPLES:
+        raise ValueError(f"chunk must hold 1..{CHUNK_MAX_SAMPLES} slots, got {count}")
+
+    cols = [c for c in COLUMN_TYPES if c in columns]
+    parts = []
+    for c in cols:
+        arr = np.ascontiguousarray(columns[c], dtype=COLUMN_TYPES[c])
+        if arr.shape != (count,):
+            raise ValueError(f"column {c} has shape {arr.shape}, expected ({count},)")
+        parts.append(arr.tobytes())
+    start = to_utc(start)
+    return {
+        "v": CHUNK_FORMAT_VERSION,
+        "userId": user_id,
+        "sessionId": session_id,
+        "start_ts": start,
+        "end_ts": start + timedelta(milliseconds=interval_ms * (count - 1)),
+        "interval_ms": int(interval_ms),
+        "count": count,
+        "cols": cols,
+        "data": b"".join(parts),
+    }
+
+
+def pack_samples(docs: list[dict], *, interval_ms: int = CHUNK_DEFAULT_INTERVAL_MS,
+                 window_sec: int = CHUNK_DEFAULT_WINDOW_SEC) -> list[dict]:
+    """
+    raw_data 형태 문서 목록(한 세션, 순서 무관) → window_sec 구간별 raw_chunks 문서 목록 (시각순)
+    샘플은 가장 가까운 슬롯에 들어가고, 같은 슬롯에 둘 이상이면 나중 샘플이 이김
+    """
+    if not docs:
+        return []
+    window_ms = window_sec * 1000
+    if window_ms % interval_ms or window_ms // interval_ms > CHUNK_MAX_SAMPLES:
+        raise ValueError("window_sec must be a multiple of interval_ms and hold at most CHUNK_MAX_SAMPLES slots")
+    slots = window_ms // interval_ms
+
+    samples = [decode_sample(d) for d in docs]
+    user_id, session_id = samples[0].user_id, samples[0].session_id
+    if any(s.user_id != user_id or s.session_id != session_id for s in samples):
+        raise DecodeError("all samples must belong to one session")
+    extras = [c for c in _EXTRA_COLUMNS if any(d.get(c) is not None for d in docs)]
+
+    windows: dict[int, dict] = {}
+    for doc, s in zip(docs, samples):
+        ts_ms = int(round(epoch_seconds(s.source_ts) * 1000))
+        start_ms = ts_ms - ts_ms % window_ms
+        slot = min(slots - 1, int(round((ts_ms - start_ms) / interval_ms)))
+        cols = windows.get(start_ms)
+        if cols is None:
+            cols = windows[start_ms] = {c: np.full(slots, np.nan, dtype=np.float32) for c in ("hr", "spo2", "mic_avg", "pressure_avg", *extras)}
+            cols["flags"] = np.zeros(slots, dtype=np.uint8)
+        cols["hr"][slot], cols["spo2"][slot], cols["mic_avg"][slot], cols["pressure_avg"][slot] = s.hr, s.spo2, s.mic_avg, s.pressure_avg
+        for c in extras:
+            value = doc.get(c)
+            if value is not None:
+                cols[c][slot] = float(value)
+        cols["flags"][slot] = FLAG_PRESENT | (FLAG_AUTO_CONTROL if s.auto_control_active else 0) | (FLAG_SNORING if doc.get("is_snoring") else 0)
+
+    out = []
+    for start_ms in sorted(windows):
+        cols = windows[start_ms]
+        count = int(np.flatnonzero(cols["flags"])[-1]) + 1  # 뒤쪽 빈 슬롯은 잘라냄
+        start = to_utc(start_ms / 1000.0)
+        out.append(encode_chunk(user_id, session_id, start, interval_ms, {c: a[:count] for c, a in cols.items()}))
+    return out
+
+
+# ---------- 디코딩 ----------
+
+class Chunk:
+    """raw_chunks 문서 1개 - columns 는 data 위의 읽기 전용 뷰 (복사 없음)"""
+    __slots__ = ("user_id", "session_id", "start_ts", "interval_ms", "count", "columns")
+
+    def __init__(self, user_id: str, session_id: str, start_ts: datetime, interval_ms: int, count: int, columns: dict[str, np.ndarray]):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.start_ts = start_ts
+        self.interval_ms = interval_ms
+        self.count = count
+        self.columns = columns
+
+    @property
+    def present(self) -> np.ndarray:
+        return (self.columns["flags"] & FLAG_PRESENT) != 0
+
+    def ts_epoch(self) -> np.ndarray:
+        """슬롯별 시각 (epoch 초)"""
+        return epoch_seconds(self.start_ts) + np.arange(self.count, dtype=np.float64) * (self.interval_ms / 1000.0)
+
+
+def read_chunk(doc: dict) -> Chunk:
+    """raw_chunks 문서 → Chunk (형식이 맞지 않으면 DecodeError)"""
+    if doc.get("v") != CHUNK_FORMAT_VERSION:
+        raise DecodeError(f"unsupported chunk version: {doc.get('v')}")
+    count, interval_ms, cols = doc.get("count"), doc.get("interval_ms"), doc.get("cols") or []
+    start = to_utc(doc.get("start_ts"))
+    if not isinstance(count, int) or not 0 < count <= CHUNK_MAX_SAMPLES or not isinstance(interval_ms, int) or interval_ms <= 0 or start is None:
+        raise DecodeError("invalid chunk header")
+    unknown = [c for c in cols if c not in COLUMN_TYPES]
+    if unknown or any(c not in cols for c in REQUIRED_COLUMNS):
+        raise DecodeError(f"invalid chunk columns: {cols}")
+
+    try:
+        buf = memoryview(doc.get("data")).cast("B")
+    except TypeError:
+        raise DecodeError("chunk has no bytes data") from None
+    expected = sum(np.dtype(COLUMN_TYPES[c]).itemsize for c in cols) * count
+    if buf.nbytes != expected:
+        raise DecodeError(f"chunk data is {buf.nbytes} bytes, expected {expected}")
+
+    columns, offset = {}, 0
+    for c in cols:
+        dtype = np.dtype(COLUMN_TYPES[c])
+        columns[c] = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+        offset += dtype.itemsize * count
+    return Chunk(doc.get("userId"), doc.get("sessionId"), start, interval_ms, count, columns)
+
+
+def chunk_to_batch(chunk: Chunk) -> SampleBatch:
+    """빈 슬롯을 뺀 SampleBatch (빈 슬롯이 없으면 열은 data 위의 뷰 그대로)"""
+    flags = chunk.columns["flags"]
+    present = (flags & FLAG_PRESENT) != 0
+    rows = None if present.all() else np.flatnonzero(present)
+    if rows is not None and not len(rows):
+        raise DecodeError("chunk has no samples")
+
+    def col(name):
+        a = chunk.columns[name]
+        return a if rows is None else a[rows]
+
+    ts_epoch = chunk.ts_epoch() if rows is None else chunk.ts_epoch()[rows]
+    start = chunk.start_ts
+    step = chunk.interval_ms
+    slots = range(chunk.count) if rows is None else rows.tolist()
+    source_ts = [start + timedelta(milliseconds=step * i) for i in slots]
+    auto = (col("flags") & FLAG_AUTO_CONTROL) != 0
+    return SampleBatch(chunk.user_id, chunk.session_id, col("hr"), col("spo2"), col("mic_avg"), col("pressure_avg"),
+                       auto, source_ts, ts_epoch)
+
+
+# ---------- 세션 전체 읽기 (학습/분석용) ----------
+
+def iter_session_chunks(db, user_id: str, session_id: str):
+    """세션의 청크를 start_ts 순서로 (문서마다 Chunk 하나, 열은 복사 없는 뷰)"""
+    query = db.collection(CHUNK_COLLECTION)\
+        .where("userId", "==", user_id)\
+        .where("sessionId", "==", session_id)\
+        .order_by("start_ts")
+    for snap in query.stream():
+        yield read_chunk(snap.to_dict() or {})
+
+
+def read_session_columns(db, user_id: str, session_id: str, columns=("hr", "spo2", "mic_avg", "pressure_avg")) -> dict[str, np.ndarray]:
+    """
+    세션 전체를 열 배열로 (빈 슬롯 제외) - {"ts": epoch 초, "flags", 요청한 열...}
+    청크에 없는 선택 열은 NaN
+    """
+    parts: dict[str, list] = {c: [] for c in ("ts", "flags", *columns)}
+    for chunk in iter_session_chunks(db, user_id, session_id):
+        present = chunk.present
+        parts["ts"].append(chunk.ts_epoch()[present])
+        parts["flags"].append(chunk.columns["flags"][present])
+        for c in columns:
+            a = chunk.columns.get(c)
+            parts[c].append(a[present] if a is not None else np.full(int(present.sum()), np.nan, dtype=np.float32))
+    return {c: (np.concatenate(v) if v else np.empty(0, dtype=np.float64 if c == "ts" else COLUMN_TYPES.get(c, "<f4")))
+            for c, v in parts.items()}
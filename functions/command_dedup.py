@@ -0,0 +1,65 @@
+# command_dedup.py
+# ✅ [명령 중복 캐시] warm 인스턴스가 최근에 낸 명령 dedupKey 를 기억 - 같은 키는 Firestore 에 가지 않고 바로 건너뜀
+# create() 의 AlreadyExists 로 중복을 막으면 중복 1건마다 RPC 왕복 + 실패한 쓰기 1회가 들고,
+# 트리거 재전송이 몰리면 그대로 곱해지므로 인스턴스 메모리에서 먼저 거름
+#
+# 키는 시간 창(COMMAND_DEDUP_WINDOW_SEC) 동안만 유효 + LRU 로 개수 제한
+# 명령 문서와 수신함 반영이 모두 끝난 뒤에만 기억 - 어느 한쪽이 실패한 키는 다음 재전송에서 다시 시도
+# 다른 인스턴스가 만든 중복은 여전히 create() 의 AlreadyExists 로 막힘 (그때 키를 기억해 두고 다음부터 건너뜀)
+#
+# stats
+#   skipped    : 캐시에서 걸러낸 중복 (Firestore 호출 없음)
+#   created    : 새로 만든 명령
+#   duplicates : Firestore 에서 AlreadyExists 로 확인된 중복
+#   errors     : 그 외 실패 (권한, 네트워크, 할당량 ...)
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+COMMAND_DEDUP_WINDOW_SEC = 10 * 60
+COMMAND_DEDUP_MAX_ENTRIES = 10_000
+
+
+class CommandDedupCache:
+    """dedupKey → 처음 본 시각, 오래된 것부터 만료/축출"""
+
+    def __init__(self, window_sec: float = COMMAND_DEDUP_WINDOW_SEC, max_entries: int = COMMAND_DEDUP_MAX_ENTRIES):
+        self.window_sec = window_sec
+        self.max_entries = max_entries
+        self._keys: OrderedDict[str, datetime] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"skipped": 0, "created": 0, "duplicates": 0, "errors": 0}
+
+    def _expire(self, now: datetime) -> None:
+        while self._keys:
+            key, seen = next(iter(self._keys.items()))
+            if (now - seen).total_seconds() <= self.window_sec:
+                break
+            self._keys.popitem(last=False)
+
+    def seen(self, key: str, now: datetime) -> bool:
+        """창 안에서 이미 본 키면 True (skipped 로 셈)"""
+        with self._lock:
+            self._expire(now)
+            if key not in self._keys:
+                return False
+            self.stats["skipped"] += 1
+            return True
+
+    def remember(self, key: str, now: datetime, outcome: str) -> None:
+        """명령 + 수신함 쓰기가 끝난 키 기록 - outcome: "created" | "duplicates" (둘 다 이후 같은 키는 건너뜀)"""
+        with self._lock:
+            self.stats[outcome] += 1
+            self._keys[key] = now
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_entries:
+                self._keys.popitem(last=False)
+
+    def failed(self) -> None:
+        """중복이 아닌 실패 - 키는 기억하지 않음 (다음 시도에서 다시 만들 수 있게)"""
+        with self._lock:
+            self.stats["errors"] += 1
+
+    def __len__(self) -> int:
+        return len(self._keys)
@@ -0,0 +1,63 @@
+# command_inbox.py
+# ✅ [명령 수신함] 기기(베개)마다 문서 1개 - 구동부(셀)별 최신 명령 + 단조 증가 순번 + 감사용 이력 링
+# commands 컬렉션 전체를 구독하면 빠른 전환 뒤에 이미 의미 없어진 SET_HEIGHT 가 줄줄이 남으므로
+# 기기는 이 문서 하나만 보고, 셀마다 가장 최근 명령만 실행 (이전 것은 덮어써져 사라짐)
+#
+# 문서 (command_inbox/{userId}) - 지금은 사용자당 베개 1개라서 사용자 ID 가 곧 기기 키
+#   userId, sessionId : 마지막 명령의 세션
+#   seq       : 명령을 받을 때마다 +1 (문서 안에서 단조 증가)
+#   cells     : {구동부 키: {seq, id, type, payload, stage, sessionId, issued_at, expires_at}}
+#                구동부 키 = SET_HEIGHT 는 "cell<cellIndex>", 그 외는 명령 type
+#   history   : 최근 INBOX_HISTORY_SIZE 개 [{seq, id, key, type, stage, issued_at, replaced}] (오래된 것부터)
+#                replaced = 덮어쓴 이전 명령의 seq (기기가 아직 실행하지 않았을 수 있음)
+#   applied   : {구동부 키: 마지막으로 실행한 seq} - 기기(앱)가 씀, 서버는 건드리지 않음
+#
+# 기기 쪽 규칙: cells 의 각 항목을 seq > applied[키] 이고 expires_at 이 지나지 않았을 때만 실행, 실행 후 applied[키] = seq
+# 서버 쪽 규칙: 같은 구동부에 issued_at 이 더 늦은 명령이 이미 있으면 덮어쓰지 않음 (트리거 재전송 / 순서 뒤바뀜)
+#              같은 id 가 이미 cells 나 history 에 있으면 아무것도 쓰지 않음
+
+from datetime import datetime, timedelta
+
+from decoder import to_utc
+
+COMMAND_INBOX = "command_inbox"
+INBOX_HISTORY_SIZE = 20  # 기기가 구독하는 문서에 같이 실리므로 작게 (오래된 감사 기록은 commands 컬렉션에)
+
+
+def actuator_key(command_type: str, payload: dict | None) -> str:
+    if command_type == "SET_HEIGHT" and (payload or {}).get("cellIndex") is not None:
+        return f"cell{int(payload['cellIndex'])}"
+    return command_type
+
+
+def post(inbox: dict | None, *, command_id: str, user_id: str, session_id: str, command_type: str, payload: dict,
+         stage: str, issued_at: datetime, ttl_sec: float, now: datetime):
+    """
+    수신함 트랜잭션 함수 (저장소의 fn(st) -> (result, write) 형태)
+    result: "posted" | "duplicate" | "stale"
+    """
+    exists, inbox = inbox is not None, inbox or {}
+    cells = dict(inbox.get("cells") or {})
+    history = list(inbox.get("history") or [])
+    key = actuator_key(command_type, payload)
+    current = cells.get(key)
+
+    if (current or {}).get("id") == command_id or any(h.get("id") == command_id for h in history):
+        return "duplicate", None
+    if current is not None and (to_utc(current.get("issued_at")) or issued_at) > issued_at:
+        return "stale", None
+
+    seq = int(inbox.get("seq", 0)) + 1
+    cells[key] = {
+        "seq": seq, "id": command_id, "type": command_type, "payload": payload, "stage": stage, "sessionId": session_id,
+        "issued_at": issued_at, "expires_at": issued_at + timedelta(seconds=ttl_sec),
+    }
+    history.append({
+        "seq": seq, "id": command_id, "key": key, "type": command_type, "stage": stage, "issued_at": issued_at,
+        "replaced": (current or {}).get("seq"),
+    })
+    updates = {
+        "userId": user_id, "sessionId": session_id, "seq": seq, "cells": cells,
+        "history": history[-INBOX_HISTORY_SIZE:], "updated_at": now,
+    }
+    return "posted", ("update" if exists else "set", updates)
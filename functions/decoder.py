@@ -0,0 +1,188 @@
+# decoder.py
+# ✅ [raw_data 디코더] 문서 → Sample(__slots__) 1개 또는 SampleBatch(열 단위 NumPy 배열)
+# 필드 별칭(mic_level, pressure_level ...)과 기본값을 표 하나로 모으고, 시각 변환은 to_utc() 한 곳에서만 함
+# on_new_data / ingest_batch / 점수 / 통계 / 롤업 / 리플레이가 모두 이 모듈을 씀
+#
+# to_utc() 가 받는 시각 형식 (전부 tz=UTC datetime 으로)
+#   datetime (Firestore DatetimeWithNanoseconds 포함, tz 없으면 UTC 로 간주)
+#   epoch 초 / 밀리초 (1e12 보다 크면 밀리초), ISO 문자열 ("Z" 허용)
+#   {"seconds", "nanos"} / {"_seconds", "_nanoseconds"} dict (JSON 으로 넘어온 Timestamp)
+#   to_datetime() / ToDatetime() 가 있는 객체 (구버전 Timestamp, protobuf Timestamp)
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+_UTC = timezone.utc
+_EPOCH = datetime(1970, 1, 1, tzinfo=_UTC)
+_EPOCH_MS_THRESHOLD = 1e12  # 이보다 크면 밀리초 (2001-09-09 이후의 초 단위 값과 겹치지 않음)
+
+DEFAULT_USER_ID = "demoUser"
+DEFAULT_SESSION_ID = "demoSession"
+
+# 속성 → (문서 필드 후보 (앞에서부터 먼저 찾음), 기본값) - 값이 None 이면 없는 것으로 봄
+FIELD_ALIASES = {
+    "hr": (("hr",), 0.0),
+    "spo2": (("spo2",), 98.0),
+    "mic_avg": (("mic_avg", "mic_level"), 0.0),
+    "pressure_avg": (("pressure_avg", "pressure_level"), 0.0),
+}
+_NUMERIC_FIELDS = ("hr", "spo2", "mic_avg", "pressure_avg")  # _numbers() 반환 순서
+
+
+class DecodeError(ValueError):
+    """숫자 필드를 숫자로 바꿀 수 없거나, 배치에 세션이 섞여 있음"""
+
+
+def _utcnow() -> datetime:
+    return datetime.now(_UTC)
+
+
+# ---------- 시각 ----------
+
+def to_utc(ts, default: datetime | None = None) -> datetime | None:
+    """지원하는 시각 형식 → tz=UTC datetime (None 이거나 해석할 수 없으면 default)"""
+    if isinstance(ts, datetime):
+        tz = ts.tzinfo
+        if tz is _UTC: return ts
+        if tz is None: return ts.replace(tzinfo=_UTC)
+        return ts.astimezone(_UTC)
+    if ts is None:
+        return default
+    try:
+        if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+            return datetime.fromtimestamp(ts / 1000.0 if ts > _EPOCH_MS_THRESHOLD else ts, _UTC)
+        if isinstance(ts, str):
+            return to_utc(datetime.fromisoformat(ts[:-1] + "+00:00" if ts.endswith("Z") else ts), default)
+        if isinstance(ts, dict):
+            seconds = ts.get("seconds", ts.get("_seconds"))
+            if seconds is None: return default
+            nanos = ts.get("nanos", ts.get("_nanoseconds")) or 0
+            return _EPOCH + timedelta(seconds=int(seconds), microseconds=int(nanos) // 1000)
+        to_datetime = getattr(ts, "to_datetime", None) or getattr(ts, "ToDatetime", None)
+        if to_datetime is not None:
+            return to_utc(to_datetime(), default)
+    except (TypeError, ValueError, OverflowError, OSError):
+        pass
+    return default
+
+
+def epoch_seconds(ts: datetime) -> float:
+    return (ts - _EPOCH).total_seconds()
+
+
+# ---------- 샘플 1개 ----------
+
+class Sample:
+    """raw_data 문서 1개 (숫자는 float, 시각은 UTC)"""
+    __slots__ = ("user_id", "session_id", "hr", "spo2", "mic_avg", "pressure_avg", "auto_control_active", "source_ts")
+
+    def __init__(self, user_id: str, session_id: str, hr: float, spo2: float, mic_avg: float, pressure_avg: float,
+                 auto_control_active: bool, source_ts: datetime):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.hr = hr
+        self.spo2 = spo2
+        self.mic_avg = mic_avg
+        self.pressure_avg = pressure_avg
+        self.auto_control_active = auto_control_active
+        self.source_ts = source_ts
+
+    def __repr__(self) -> str:
+        return f"Sample({', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)})"
+
+
+# _numbers() 가 도는 표 - (문서 필드 후보, 기본값) 을 반환 순서대로 미리 펼쳐 둠
+_NUMBER_READERS = tuple((keys, float(default)) for keys, default in (FIELD_ALIASES[name] for name in _NUMERIC_FIELDS))
+
+
+def _numbers(doc: dict) -> tuple[float, float, float, float]:
+    """(hr, spo2, mic_avg, pressure_avg) - 별칭은 앞에서부터 찾고, 없으면 기본값"""
+    get = doc.get
+    out = []
+    try:
+        for keys, default in _NUMBER_READERS:
+            v = None
+            for key in keys:
+                v = get(key)
+                if v is not None: break
+            out.append(default if v is None else float(v))
+    except (TypeError, ValueError) as e:
+        raise DecodeError(f"invalid numeric field: {e}") from e
+    return tuple(out)
+
+
+def decode_sample(doc: dict, now=_utcnow) -> Sample:
+    """raw_data 문서 → Sample (ts 가 없거나 해석할 수 없으면 now())"""
+    hr, spo2, mic_avg, pressure_avg = _numbers(doc)
+    ts = doc.get("ts")
+    if type(ts) is not datetime or ts.tzinfo is not _UTC:  # Firestore Timestamp 가 아닌 경우만 변환
+        ts = to_utc(ts) or now()
+    return Sample(
+        doc.get("userId") or DEFAULT_USER_ID,
+        doc.get("sessionId") or DEFAULT_SESSION_ID,
+        hr, spo2, mic_avg, pressure_avg,
+        bool(doc.get("auto_control_active", False)),
+        ts,
+    )
+
+
+# ---------- 배치 (열 단위) ----------
+
+class SampleBatch:
+    """한 세션의 샘플 N개 - 열마다 배열 1개, source_ts 오름차순"""
+    __slots__ = ("user_id", "session_id", "hr", "spo2", "mic_avg", "pressure_avg", "auto_control_active", "source_ts", "ts_epoch")
+
+    def __init__(self, user_id: str, session_id: str, hr: np.ndarray, spo2: np.ndarray, mic_avg: np.ndarray,
+                 pressure_avg: np.ndarray, auto_control_active: np.ndarray, source_ts: list[datetime], ts_epoch: np.ndarray):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.hr = hr
+        self.spo2 = spo2
+        self.mic_avg = mic_avg
+        self.pressure_avg = pressure_avg
+        self.auto_control_active = auto_control_active
+        self.source_ts = source_ts
+        self.ts_epoch = ts_epoch
+
+    def __len__(self) -> int:
+        return len(self.source_ts)
+
+    def sample(self, i: int) -> Sample:
+        return Sample(self.user_id, self.session_id, float(self.hr[i]), float(self.spo2[i]), float(self.mic_avg[i]),
+                      float(self.pressure_avg[i]), bool(self.auto_control_active[i]), self.source_ts[i])
+
+
+def decode_batch(docs: list[dict], *, user_id: str | None = None, session_id: str | None = None, now=_utcnow) -> SampleBatch:
+    """
+    같은 세션의 raw_data 문서 목록 → SampleBatch (시각순 정렬, 같은 시각은 입력 순서 유지)
+    user_id / session_id 를 주면 모든 문서에 적용, 아니면 문서 값 → 첫 문서 값 → 기본값 순
+    """
+    if not docs:
+        raise DecodeError("no samples")
+    first_user = user_id or docs[0].get("userId") or DEFAULT_USER_ID
+    first_session = session_id or docs[0].get("sessionId") or DEFAULT_SESSION_ID
+
+    n = len(docs)
+    rows, flags, stamps = [], [], []
+    fallback = None
+    for doc in docs:
+        if (user_id or doc.get("userId") or first_user) != first_user or \
+                (session_id or doc.get("sessionId") or first_session) != first_session:
+            raise DecodeError("all samples must belong to one session")
+        rows.append(_numbers(doc))
+        flags.append(bool(doc.get("auto_control_active", False)))
+        ts = to_utc(doc.get("ts"))
+        if ts is None:
+            ts = fallback = fallback or now()
+        stamps.append(ts)
+
+    values = np.array(rows, dtype=np.float64).T
+    auto = np.array(flags, dtype=bool)
+    ts_epoch = np.fromiter((epoch_seconds(t) for t in stamps), dtype=np.float64, count=n)
+    order = np.argsort(ts_epoch, kind="stable")
+    if np.any(order[1:] < order[:-1]):
+        values, auto, ts_epoch = values[:, order], auto[order], ts_epoch[order]
+        stamps = [stamps[i] for i in order]
+    hr, spo2, mic_avg, pressure_avg = values
+    return SampleBatch(first_user, first_session, hr, spo2, mic_avg, pressure_avg, auto, stamps, ts_epoch)
@@ -0,0 +1,165 @@
+# hypnogram.py
+# ✅ [하이프노그램] 세션마다 안정 단계 구간을 런렝스(단계 코드, 시작 오프셋, 길이)로 문서 1개에 모아 둠
+# 차트/점수 계산이 processed_data N개를 changed_at 순으로 조회하는 대신 문서 1개만 읽도록
+#
+# 문서 (hypnograms/{userId}__{sessionId})
+#   v           : 포맷 버전 (HYPNOGRAM_FORMAT_VERSION)
+#   userId, sessionId
+#   start_ts    : 오프셋 기준 시각 (= session_state.score_acc.first_ts, 첫 안정 단계 시각)
+#   runs        : {"<순번>": [단계 코드, 시작 오프셋(초), 길이(초)]} - 닫힌 구간만 (다음 전환 때 길이가 정해짐)
+#   open        : [단계 코드, 시작 오프셋] - 지금 이어지는 단계 (길이 미정)
+#   pages       : 페이지 수 (넘침 페이지가 생겼을 때만 씀, 없으면 1)
+# 넘침 페이지 (hypnograms/{key}/hypnogram_pages/{페이지 번호}) : runs 만 - 순번 // HYPNOGRAM_RUNS_PER_DOC 번째 페이지
+#
+# 쓰기: 전환마다 set(merge=True) 1회 - 순번을 키로 쓰므로 트리거가 재시도돼도 같은 값이 다시 써질 뿐
+# 순번은 session_state.score_acc.runs (닫힌 구간 수, 세션 상태 트랜잭션 안에서 셈)
+# 단계 코드는 stage_vector.STAGES 순서, 목록에 없는 단계는 UNKNOWN_CODE
+# runs / open 은 색인에서 제외 (firestore.indexes.json fieldOverrides)
+
+import math
+from datetime import datetime
+
+from decoder import to_utc
+from stage_vector import STAGE_CODE, STAGES
+
+HYPNOGRAM_COLLECTION = "hypnograms"
+HYPNOGRAM_PAGE_COLLECTION = "hypnogram_pages"
+HYPNOGRAM_FORMAT_VERSION = 1
+HYPNOGRAM_RUNS_PER_DOC = 2000  # 최소 유지 30초 기준 16시간 이상 - 보통의 밤은 페이지 1개
+UNKNOWN_CODE = -1
+
+
+def stage_code(stage: str | None) -> int:
+    return STAGE_CODE.get(stage, UNKNOWN_CODE)
+
+
+def stage_name(code: int) -> str:
+    return STAGES[code] if 0 <= code < len(STAGES) else "Unknown"
+
+
+def offset_sec(ts: datetime, origin: datetime) -> float:
+    return round((ts - origin).total_seconds(), 3)
+
+
+def closed_run(stage: str | None, since: datetime, until: datetime, origin: datetime) -> list:
+    """직전 안정 단계 구간 [코드, 시작 오프셋, 길이]"""
+    start = offset_sec(since, origin)
+    return [stage_code(stage), start, round(offset_sec(until, origin) - start, 3)]
+
+
+# ---------- 쓰기 ----------
+
+def append_pages(user_id: str, session_id: str, origin: datetime, runs: list[tuple[int, list]],
+                 open_run: list | None) -> dict[int, dict]:
+    """
+    새로 닫힌 구간 [(순번, run)] + 열린 구간 → {페이지 번호: merge 로 쓸 필드}
+    0번 페이지(머리 문서)는 항상 포함 (열린 구간 / 메타 갱신)
+    """
+    pages: dict[int, dict] = {}
+    for index, run in runs:
+        pages.setdefault(index // HYPNOGRAM_RUNS_PER_DOC, {"runs": {}})["runs"][str(index)] = run
+    head = pages.setdefault(0, {})
+    head.update({"v": HYPNOGRAM_FORMAT_VERSION, "userId": user_id, "sessionId": session_id, "start_ts": origin})
+    if open_run is not None:
+        head["open"] = open_run
+    last_page = max(pages)
+    if last_page > 0:
+        head["pages"] = last_page + 1
+        for page in pages:
+            if page > 0:
+                pages[page].update({"userId": user_id, "sessionId": session_id, "page": page})
+    return pages
+
+
+# ---------- 읽기 ----------
+
+class Hypnogram:
+    """세션 1개의 닫힌 구간 목록 (시작 오프셋 오름차순) + 열린 구간"""
+    __slots__ = ("user_id", "session_id", "start_ts", "runs", "open")
+
+    def __init__(self, user_id: str, session_id: str, start_ts: datetime | None, runs: list[list], open_run: list | None):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.start_ts = start_ts
+        self.runs = runs
+        self.open = open_run
+
+    def until(self, ts: datetime) -> list[list]:
+        """열린 구간을 ts 까지로 닫은 구간 목록 (ts 가 열린 구간 시작 이전이면 닫힌 구간만)"""
+        if self.open is None or self.start_ts is None:
+            return list(self.runs)
+        code, start = self.open
+        end = offset_sec(ts, self.start_ts)
+        return self.runs + [[code, start, round(end - start, 3)]] if end > start else list(self.runs)
+
+
+def read_hypnogram(head: dict, pages: list[dict] = ()) -> Hypnogram:
+    """머리 문서 + 넘침 페이지 문서들 → Hypnogram"""
+    runs = {}
+    for doc in (head, *pages):
+        for key, run in (doc.get("runs") or {}).items():
+            runs[int(key)] = [int(run[0]), float(run[1]), float(run[2])]
+    open_run = head.get("open")
+    return Hypnogram(
+        head.get("userId"), head.get("sessionId"), to_utc(head.get("start_ts")),
+        [runs[k] for k in sorted(runs)],
+        [int(open_run[0]), float(open_run[1])] if open_run else None,
+    )
+
+
+def resample(runs: list[list], resolution_sec: float | None) -> list[list]:
+    """
+    resolution_sec 간격 구간(epoch)마다 가장 오래 머문 단계 하나로 → 같은 단계가 이어지면 합침
+    resolution_sec 가 없거나 0 이하면 저장된 구간 그대로 (이웃한 같은 단계만 합침)
+    """
+    if not runs:
+        return []
+    if not resolution_sec or resolution_sec <= 0:
+        return _merge([list(r) for r in runs])
+
+    origin = runs[0][1]
+    end = runs[-1][1] + runs[-1][2]
+    n = max(1, math.ceil((end - origin) / resolution_sec - 1e-9))
+    occupancy = [dict() for _ in range(n)]
+    for code, start, duration in runs:
+        s, e = start - origin, start - origin + duration
+        for k in range(int(s // resolution_sec), min(n, math.ceil(e / resolution_sec))):
+            overlap = min(e, (k + 1) * resolution_sec) - max(s, k * resolution_sec)
+            if overlap > 0:
+                occupancy[k][code] = occupancy[k].get(code, 0.0) + overlap
+
+    out = []
+    for k, time_by_code in enumerate(occupancy):
+        if not time_by_code:
+            continue
+        code = max(time_by_code, key=lambda c: (time_by_code[c], -c))  # 동률이면 코드가 작은 단계
+        start = round(origin + k * resolution_sec, 3)
+        out.append([code, start, round(min(resolution_sec, end - start), 3)])
+    return _merge(out)
+
+
+def _merge(runs: list[list]) -> list[list]:
+    out: list[list] = []
+    for run in runs:
+        if out and out[-1][0] == run[0] and abs(out[-1][1] + out[-1][2] - run[1]) < 1e-6:
+            out[-1][2] = round(out[-1][2] + run[2], 3)
+        else:
+            out.append(run)
+    return out
+
+
+def sleep_totals(hyp: Hypnogram) -> dict | None:
+    """
+    닫힌 구간으로 점수용 합계 (processed_data 재집계와 같은 의미 - 마지막 단계는 길이 없음)
+    {"total_duration_sec", "stage_durations": {단계 이름: 초}, "apnea_event_count"}
+    """
+    if not hyp.runs and hyp.open is None:
+        return None
+    durations: dict[str, float] = {}
+    apnea = 0
+    for code, _, duration in hyp.runs:
+        name = stage_name(code)
+        durations[name] = durations.get(name, 0) + duration
+        apnea += name == "Apnea"
+    total = hyp.runs[-1][1] + hyp.runs[-1][2] - hyp.runs[0][1] if hyp.runs else 0.0
+    return {"total_duration_sec": total, "stage_durations": durations, "apnea_event_count": apnea}
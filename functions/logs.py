@@ -0,0 +1,285 @@
+# logs.py
+# ✅ [로그 계층] print 대신 레벨 + 세션별 속도 제한 + 샘플링 + 세션 요약
+# 샘플마다 여러 줄씩 찍던 수집 경로 로그를 줄이고, 필요할 때만 특정 사용자/세션을 자세히 보기 위함
+#
+# 출력: Cloud Logging 이 파싱하는 JSON 한 줄 {"severity", "message", "userId", "sessionId", ...}
+#        LOG_FORMAT=text 면 "[LEVEL] message" (로컬/에뮬레이터용)
+#
+# 레벨 결정 순서
+#   1) 실행 중 덮어쓰기 (config/logging 문서, LOG_OVERRIDE_REFRESH_SEC 마다 다시 읽음)
+#        { "level": "INFO",                                  # 전체 기본 레벨 (없으면 LOG_LEVEL 환경변수)
+#          "users":    { "<uid>": "DEBUG" },                 # 사용자별
+#          "sessions": { "<sessionId>": {"level": "DEBUG", "until": <timestamp>} } }  # 세션별 (until 지나면 무시)
+#      사용자/세션 덮어쓰기가 걸린 줄은 샘플링/속도 제한 없이 전부 출력
+#   2) LOG_LEVEL 환경변수 (기본 INFO)
+#
+# 속도 제한: 세션마다 토큰 버킷 (LOG_SESSION_BURST 줄 + 초당 LOG_SESSION_REFILL_PER_SEC 줄), ERROR 는 제한 없음
+#           버려진 줄 수는 세션 요약에 suppressed 로 남음
+# 세션 요약: session_event() 로 센 값(샘플/전환/알림 ...)을 LOG_SUMMARY_INTERVAL_SEC 마다 한 줄로 출력
+#           요약은 인스턴스별 부분 합계 (instance 필드) - 조용해진 세션도 다음 요약 주기에 남은 값을 내보냄
+
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from session_cache import INSTANCE_ID
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+_LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+_SEVERITY = {v: k for k, v in _LEVELS.items()}
+
+LOG_LEVEL = _LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), INFO)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SESSION_BURST = 20
+LOG_SESSION_REFILL_PER_SEC = 0.1          # 버스트를 다 쓰면 10초에 1줄
+LOG_SUMMARY_INTERVAL_SEC = 5 * 60
+LOG_SESSION_MAX_ENTRIES = 10_000
+LOG_OVERRIDE_REFRESH_SEC = 60
+
+
+def parse_level(value) -> int | None:
+    if isinstance(value, int): return value
+    if isinstance(value, str): return _LEVELS.get(value.upper())
+    return None
+
+
+# ---------- 실행 중 레벨 덮어쓰기 ----------
+
+class _Overrides:
+    __slots__ = ("level", "users", "sessions")
+
+    def __init__(self, level: int | None = None, users: dict | None = None, sessions: dict | None = None):
+        self.level = level
+        self.users: dict[str, tuple[int, float | None]] = users or {}
+        self.sessions: dict[str, tuple[int, float | None]] = sessions or {}
+
+
+def _parse_entries(entries) -> dict[str, tuple[int, float | None]]:
+    """{"id": "DEBUG"} 또는 {"id": {"level": "DEBUG", "until": ts}} → {"id": (레벨, until epoch 초)}"""
+    out = {}
+    for key, value in (entries or {}).items():
+        until = None
+        if isinstance(value, dict):
+            until = value.get("until")
+            if isinstance(until, datetime):
+                until = (until if until.tzinfo else until.replace(tzinfo=timezone.utc)).timestamp()
+            elif not isinstance(until, (int, float)):
+                until = None
+            value = value.get("level")
+        level = parse_level(value)
+        if level is not None:
+            out[str(key)] = (level, until)
+    return out
+
+
+def parse_overrides(doc: dict | None) -> _Overrides:
+    doc = doc or {}
+    return _Overrides(parse_level(doc.get("level")), _parse_entries(doc.get("users")), _parse_entries(doc.get("sessions")))
+
+
+_overrides = _Overrides()
+_override_loader = None
+_override_loaded_at = float("-inf")
+_override_lock = threading.Lock()
+
+
+def set_override_loader(loader, *, refresh_now: bool = False) -> None:
+    """loader() -> 덮어쓰기 문서 dict 또는 None. 로그를 쓸 때 LOG_OVERRIDE_REFRESH_SEC 가 지났으면 다시 부름"""
+    global _override_loader, _override_loaded_at
+    _override_loader = loader
+    _override_loaded_at = float("-inf")
+    if refresh_now:
+        _refresh_overrides(time.monotonic())
+
+
+def set_overrides(doc: dict | None) -> None:
+    """덮어쓰기를 바로 적용 (loader 없이 쓸 때 / 로컬 실행)"""
+    global _overrides
+    _overrides = parse_overrides(doc)
+
+
+def _refresh_overrides(mono: float) -> None:
+    global _overrides, _override_loaded_at
+    if not _override_lock.acquire(blocking=False):
+        return  # 다른 스레드가 읽는 중 (또는 loader 안에서 다시 불림) - 이전 값 사용
+    try:
+        _override_loaded_at = mono  # 실패해도 주기가 지날 때까지 다시 시도하지 않음
+        try:
+            _overrides = parse_overrides(_override_loader())
+        except Exception as e:
+            _write(WARNING, f"[로그 설정 읽기 실패] {type(e).__name__}: {e}", None, None, {})
+    finally:
+        _override_lock.release()
+
+
+def _active(entry: tuple[int, float | None] | None) -> int | None:
+    if entry is None: return None
+    level, until = entry
+    return level if until is None or until > time.time() else None
+
+
+def level_for(user: str | None = None, session: str | None = None) -> tuple[int, bool]:
+    """(이 사용자/세션에 적용되는 레벨, 사용자/세션 덮어쓰기가 걸렸는지)"""
+    if _override_loader is not None:
+        mono = time.monotonic()
+        if mono - _override_loaded_at >= LOG_OVERRIDE_REFRESH_SEC:
+            _refresh_overrides(mono)
+    ov = _overrides
+    if ov.sessions or ov.users:
+        level = _active(ov.sessions.get(session)) if session else None
+        if level is None and user:
+            level = _active(ov.users.get(user))
+        if level is not None:
+            return level, True
+    return (ov.level if ov.level is not None else LOG_LEVEL), False
+
+
+def enabled(level: int, user: str | None = None, session: str | None = None) -> bool:
+    return level >= level_for(user, session)[0]
+
+
+# ---------- 세션별 속도 제한 + 요약 ----------
+
+class _SessionLog:
+    __slots__ = ("tokens", "refilled", "suppressed", "window", "totals", "window_start", "window_due", "last_event")
+
+    def __init__(self, mono: float):
+        self.tokens = float(LOG_SESSION_BURST)
+        self.refilled = mono
+        self.suppressed = 0
+        self.window: dict[str, int] = {}
+        self.totals: dict[str, int] = {}
+        self.window_start: datetime | None = None
+        self.window_due: datetime | None = None
+        self.last_event: datetime | None = None
+
+
+_lock = threading.Lock()
+_sessions: OrderedDict[tuple, _SessionLog] = OrderedDict()
+_next_sweep: datetime | None = None
+_SUMMARY_INTERVAL = timedelta(seconds=LOG_SUMMARY_INTERVAL_SEC)
+
+
+def _session_log(key: tuple, mono: float) -> _SessionLog:
+    s = _sessions.get(key)
+    if s is None:
+        s = _sessions[key] = _SessionLog(mono)
+        while len(_sessions) > LOG_SESSION_MAX_ENTRIES:
+            _sessions.popitem(last=False)
+    else:
+        _sessions.move_to_end(key)
+    return s
+
+
+def _take_token(key: tuple) -> bool:
+    mono = time.monotonic()
+    with _lock:
+        s = _session_log(key, mono)
+        s.tokens = min(float(LOG_SESSION_BURST), s.tokens + (mono - s.refilled) * LOG_SESSION_REFILL_PER_SEC)
+        s.refilled = mono
+        if s.tokens >= 1.0:
+            s.tokens -= 1.0
+            return True
+        s.suppressed += 1
+        return False
+
+
+def _summary_record(s: _SessionLog, now: datetime) -> dict:
+    record = {
+        "window_sec": round((now - s.window_start).total_seconds(), 1) if s.window_start else 0.0,
+        **s.window,
+        "suppressed": s.suppressed,
+        "totals": dict(s.totals),
+        "instance": INSTANCE_ID,
+    }
+    s.window = {}
+    s.suppressed = 0
+    s.window_start = s.window_due = None
+    return record
+
+
+def session_event(user: str | None, session: str | None, now: datetime, **counts: int) -> None:
+    """
+    세션 카운터 증가 (samples=1, transitions=..., alerts=...) - 요약 주기가 지났으면 요약 한 줄 출력
+    같은 호출에서 요약 주기가 지나도록 조용했던 다른 세션의 남은 값도 내보냄
+    """
+    global _next_sweep
+    due = []
+    with _lock:
+        s = _session_log((user, session), time.monotonic())
+        window, totals = s.window, s.totals
+        for k, v in counts.items():
+            if v:
+                window[k] = window.get(k, 0) + v
+                totals[k] = totals.get(k, 0) + v
+        if s.window_due is None:
+            s.window_start, s.window_due = now, now + _SUMMARY_INTERVAL
+        s.last_event = now
+        if now >= s.window_due:
+            due.append((user, session, _summary_record(s, now)))
+
+        if _next_sweep is None or now >= _next_sweep:
+            _next_sweep = now + _SUMMARY_INTERVAL
+            idle_before = now - _SUMMARY_INTERVAL
+            for (u, sid), other in _sessions.items():  # 오래된 것부터 (LRU 순서)
+                if other.last_event is None:
+                    continue  # 요약 카운터 없이 로그만 쓴 세션
+                if other.last_event > idle_before:
+                    break
+                if other.window or other.suppressed:
+                    due.append((u, sid, _summary_record(other, now)))
+
+    for u, sid, record in due:
+        if enabled(INFO, u, sid):
+            _write(INFO, f"📊 [세션 요약] {sid}", u, sid, {"summary": record})
+
+
+def session_summary(user: str | None, session: str | None) -> dict | None:
+    """지금까지 이 인스턴스에서 센 값 (출력하지 않음)"""
+    with _lock:
+        s = _sessions.get((user, session))
+        if s is None: return None
+        return {**s.window, "suppressed": s.suppressed, "totals": dict(s.totals)}
+
+
+# ---------- 출력 ----------
+
+def _write(level: int, message: str, user: str | None, session: str | None, fields: dict) -> None:
+    if LOG_FORMAT == "text":
+        print(f"[{_SEVERITY.get(level, level)}] {message}")
+        return
+    record = {"severity": _SEVERITY.get(level, "DEFAULT"), "message": message}
+    if user is not None: record["userId"] = user
+    if session is not None: record["sessionId"] = session
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def log(level: int, message: str, *args, user: str | None = None, session: str | None = None,
+        sample: float | None = None, **fields) -> bool:
+    """
+    message % args 는 실제로 출력할 때만 만듦 (수집 경로에서는 f-string 대신 args 로 넘길 것)
+    sample: 0~1, 이 비율만큼만 출력 (덮어쓰기가 걸린 사용자/세션은 전부 출력)
+    session 을 주면 세션별 속도 제한 적용 (ERROR 는 제외)
+    반환: 실제로 출력했으면 True
+    """
+    threshold, overridden = level_for(user, session)
+    if level < threshold:
+        return False
+    if not overridden and level < ERROR:
+        if sample is not None and random.random() >= sample:
+            return False
+        if session is not None and not _take_token((user, session)):
+            return False
+    _write(level, message % args if args else message, user, session, fields)
+    return True
+
+
+def debug(message: str, *args, **kwargs) -> bool: return log(DEBUG, message, *args, **kwargs)
+def info(message: str, *args, **kwargs) -> bool: return log(INFO, message, *args, **kwargs)
+def warning(message: str, *args, **kwargs) -> bool: return log(WARNING, message, *args, **kwargs)
+def error(message: str, *args, **kwargs) -> bool: return log(ERROR, message, *args, **kwargs)
@@ -2,34 +2,129 @@
 # ✅ [하이브리드 엔진] 안전 규칙(Rule) + AI 판단(Tree) + 무호흡 제어 통합 버전
 
 import json
+import os
 import hashlib
+import threading
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 
 import firebase_admin
-from firebase_functions import firestore_fn, options, https_fn
-from firebase_admin import firestore
+import numpy as np
+from firebase_functions import firestore_fn, options, https_fn, scheduler_fn
+from google.api_core import exceptions as gexc
+from google.auth.exceptions import RefreshError
 from google.cloud import firestore as gcf
+from chunks import CHUNK_COLLECTION, chunk_to_batch, read_chunk
+import command_inbox
+from command_dedup import CommandDedupCache
+from decoder import DecodeError, SampleBatch, decode_batch, decode_sample, epoch_seconds, to_utc
+from hypnogram import append_pages, closed_run, offset_sec, read_hypnogram, resample, sleep_totals, stage_code
+from report_jobs import FirestoreJobStore, enqueue_report_job, run_report_jobs
+from rollups import RollupBackfill, load_rollup_reports, write_report_with_rollup
+from session_cache import INSTANCE_ID, SessionStateCache
+from stabilizer import load_config as load_stabilizer_config, step as stabilize
+from storage import FirestoreRepository, Repository
+from stage_tree import get_stage_tree
+from stage_vector import STAGES, predict_stage_hybrid_batch, stage_names
+from trends import MonthlyTrendAggregator
+import logs
+from opstats import commit as commit_batch, instrumented, record as record_op, stream as stream_query, tag_session
 from notifications import (
-    send_sleep_report_notification,
-    send_sleep_efficiency_notification,
-    send_snoring_notification,
+    BEDTIME_TIMEZONE,
+    current_bedtime_slot,
+    fan_out_bedtime_reminders,
+    get_user_profile,
+    invalidate_user_profile,
+    send_report_notifications,
+    update_bedtime_index,
 )
 
 # ---------- lazy init ----------
+# warm 인스턴스에서는 프로세스 전체가 클라이언트 1개를 재사용 (채널/인증 설정 비용을 호출마다 내지 않도록)
 _app_inited = False
+_db: gcf.Client | None = None
+_db_lock = threading.Lock()
+_db_stats = {"cold_creates": 0, "reuses": 0, "rebuilds": 0, "last_rebuild_reason": None}
+
+# 이 예외가 나면 채널이 망가진 것으로 보고 다음 get_db()에서 클라이언트를 새로 만듦
+_FATAL_DB_ERRORS = (gexc.ServiceUnavailable, gexc.Unauthenticated, RefreshError)
 
 def get_db() -> gcf.Client:
-    global _app_inited
-    if not _app_inited:
-        try:
-            firebase_admin.get_app()
-        except ValueError:
-            firebase_admin.initialize_app()
-        _app_inited = True
-    return gcf.Client()
+    global _app_inited, _db
+    db = _db
+    if db is not None:
+        with _db_lock:
+            _db_stats["reuses"] += 1
+        return db
+
+    with _db_lock:
+        if _db is None:
+            if not _app_inited:
+                try:
+                    firebase_admin.get_app()
+                except ValueError:
+                    firebase_admin.initialize_app()
+                _app_inited = True
+            _db = gcf.Client()
+            _db_stats["cold_creates"] += 1
+            logs.info("[DB 클라이언트 생성] %s", get_db_stats())
+        else:
+            _db_stats["reuses"] += 1
+        return _db
+
+def is_fatal_db_error(e: BaseException) -> bool:
+    if isinstance(e, _FATAL_DB_ERRORS): return True
+    # 닫힌 gRPC 채널은 ValueError("Cannot invoke RPC on closed channel!")로 올라옴
+    return isinstance(e, (ValueError, RuntimeError)) and "closed channel" in str(e)
+
+def report_db_error(e: BaseException) -> bool:
+    """치명적인 채널 오류면 공유 클라이언트를 버리고 True 반환 (다음 호출에서 재생성)"""
+    global _db
+    if not is_fatal_db_error(e): return False
+    with _db_lock:
+        if _db is not None:
+            _db = None
+            _db_stats["rebuilds"] += 1
+            _db_stats["last_rebuild_reason"] = f"{type(e).__name__}: {e}"[:200]
+    logs.warning("[DB 클라이언트 재생성 예약] %s: %s", type(e).__name__, e)
+    return True
+
+def get_db_stats() -> dict:
+    return dict(_db_stats)
+
+# ---------- 로그 레벨 덮어쓰기 ----------
+# config/logging 문서를 고치면 재배포 없이 특정 사용자/세션만 DEBUG 로 볼 수 있음 (형식은 logs.py 참고)
+LOG_OVERRIDE_DOC = ("config", "logging")
+
+def _load_log_overrides() -> dict | None:
+    started = time.perf_counter()
+    snap = get_db().collection(LOG_OVERRIDE_DOC[0]).document(LOG_OVERRIDE_DOC[1]).get()
+    record_op(started, reads=1, docs=("/".join(LOG_OVERRIDE_DOC),))
+    return snap.to_dict() if snap.exists else None
+
+logs.set_override_loader(_load_log_overrides)
+
+# ---------- 저장소 ----------
+# 수집/점수 경로는 storage.Repository 로만 접근 - 오프라인 실행에서는 _repo 에 MemoryRepository 를 넣어서 사용
+# get_db() 를 직접 쓰는 나머지 경로는 storage.py 머리말에 목록으로 정리
+_repo: Repository | None = None
+_firestore_repo: FirestoreRepository | None = None
+
+def get_repo() -> Repository:
+    global _firestore_repo
+    if _repo is not None:
+        return _repo
+    db = get_db()
+    repo = _firestore_repo
+    if repo is None or repo.db is not db:  # 클라이언트가 재생성되면 같이 교체
+        repo = _firestore_repo = FirestoreRepository(db)
+    return repo
 
 # ---------- utility ----------
-DEFAULT_MIN_STAGE_DURATION_SEC = 30
+# 단계 안정화 설정 (STAGE_STABILIZER 환경변수, 기본 "legacy" = 단계 무관 30초 유지)
+STABILIZER = load_stabilizer_config()
 
 def now_utc() -> datetime:
     return datetime.now(timezone.utc)
@@ -39,32 +134,11 @@ def now_utc() -> datetime:
 # =========================================================
 def predict_stage_ai(hr: float, spo2: float, mic_avg: float, pressure_avg: float) -> str:
     """
-    JupyterLab에서 학습된 의사결정 나무 모델 (max_depth=5)
+    JupyterLab에서 학습된 의사결정 나무 모델
     규칙으로 잡히지 않는 섬세한 단계(Deep/Light/REM/Snoring)를 구분합니다.
     """
-    # (이전에 학습된 로직 삽입 - 나중에 Jupyter 다시 돌리면 여기만 바꿔끼우세요)
-    if hr <= 59.5:
-        return "Deep"
-    else:
-        if pressure_avg <= 499.5:
-            if spo2 <= 95.9:
-                return "Snoring" # 낮은 SpO2 + 낮은 압력은 보통 코골이/무호흡 전조
-            else:
-                if mic_avg <= 47.0:
-                    return "REM"
-                else:
-                    return "Snoring"
-        else: # pressure > 499.5
-            if pressure_avg <= 1504.0:
-                if mic_avg <= 45.5:
-                    return "Light"
-                else:
-                    return "Snoring"
-            else: 
-                if pressure_avg <= 3010.5:
-                    return "Awake" # 뒤척임 구간
-                else:
-                    return "Awake" # 기상 구간
+    # 트리는 stage_tree.json 에서 인스턴스당 1회 로드 (Jupyter 다시 돌리면 JSON만 교체하세요)
+    return get_stage_tree().predict(hr, spo2, mic_avg, pressure_avg)
 
 # =========================================================
 # 🛡️ 2. 하이브리드 엔진 (Safety Rule + AI)
@@ -110,8 +184,8 @@ def stage_confidence(stage: str) -> float:
         return 0.99
     return 0.85
 
-def min_duration_sec_for(prev_stable_stage: str | None) -> int:
-    return DEFAULT_MIN_STAGE_DURATION_SEC
+def min_duration_sec_for(prev_stable_stage: str | None) -> float:
+    return STABILIZER.dwell_for(prev_stable_stage)
 
 # =========================================================
 # 🎮 3. 명령 정책 (Command Policy)
@@ -160,166 +234,641 @@ def command_policy(stage: str) -> dict | None:
     return None
 
 # ---------- transactional session-state update ----------
-@gcf.transactional
-def _update_session_state(tx: gcf.Transaction, state_ref: gcf.DocumentReference, *, user_id: str, session_id: str, raw_stage: str, source_ts: datetime, now: datetime):
-    snap = state_ref.get(transaction=tx)
-    if not snap.exists:
+_session_cache = SessionStateCache()
+
+def _accumulate_stage(acc: dict, prev_stage: str | None, since: datetime | None, now: datetime) -> dict:
+    """
+    안정 단계 전이 시점에 직전 단계의 지속 시간을 누적 (calculate_sleep_score 용 러닝 합계)
+    processed_data 전체를 다시 훑는 것과 같은 값: 구간 길이 = 다음 전이 시각 - 이번 전이 시각
+    runs / last_run: 닫힌 구간 수와 방금 닫힌 구간 [코드, 시작 오프셋, 길이] (하이프노그램 순번/내용)
+    """
+    durations = dict(acc.get("stage_durations") or {})
+    runs, last_run = int(acc.get("runs", 0)), acc.get("last_run")
+    if since is not None and prev_stage is not None:
+        durations[prev_stage] = durations.get(prev_stage, 0) + (now - since).total_seconds()
+        first_ts = to_utc(acc.get("first_ts"))
+        if first_ts is not None:
+            runs, last_run = runs + 1, closed_run(prev_stage, since, now, first_ts)
+    return {
+        **acc,
+        "stage_durations": durations,
+        "apnea_count": int(acc.get("apnea_count", 0)) + (1 if prev_stage == "Apnea" else 0),
+        "last_ts": now,
+        "runs": runs,
+        "last_run": last_run,
+    }
+
+def _step_session_state(st: dict | None, *, user_id: str, session_id: str, raw_stage: str, source_ts: datetime, now: datetime):
+    """
+    세션 상태 한 스텝 전이 (순수 함수, Firestore 접근 없음) - 안정 단계 판단은 stabilizer.step (STABILIZER 설정)
+    시계는 두 가지 - on_new_data / ingest_batch / on_new_chunk 모두 같은 규칙
+      단계 타임라인 (last_change_ts, changed_at, 유지/확인 시간, score_acc) : 샘플 시각 source_ts
+        (순서가 뒤바뀐 샘플은 마지막 전환 시각보다 앞으로 가지 않게 맞춤)
+      생존 신호 (updated_at - 세션 종료 스윕 기준) : 처리 시각 now
+    반환: (stage_changed, stable_stage, changed_at, updates) - st가 None이면 updates는 새 문서 전체
+    """
+    if st is None:
         new_state = {
             "userId": user_id, "sessionId": session_id, "stage": raw_stage, "raw_stage": raw_stage,
-            "last_change_ts": now, "updated_at": now, "last_source_ts": source_ts,
+            "last_change_ts": source_ts, "updated_at": now, "last_source_ts": source_ts,
+            "score_acc": {"first_ts": source_ts, "last_ts": source_ts, "stage_durations": {}, "apnea_count": 0},
+            "report_queued": False,
         }
-        tx.set(state_ref, new_state)
-        return True, raw_stage, now
+        stab, _ = stabilize(STABILIZER, None, raw_stage, None, raw_stage, source_ts)
+        if stab is not None: new_state["stab"] = stab
+        return True, raw_stage, source_ts, new_state
 
-    st = snap.to_dict() or {}
     stable_stage = st.get("stage")
-    last_change_ts = st.get("last_change_ts")
+    last_change_ts = to_utc(st.get("last_change_ts"))
+    updates = {"raw_stage": raw_stage, "updated_at": now, "last_source_ts": source_ts}
 
-    if isinstance(last_change_ts, datetime): pass
-    elif last_change_ts is not None and hasattr(last_change_ts, "to_datetime"):
-        last_change_ts = last_change_ts.to_datetime().astimezone(timezone.utc)
-    else: last_change_ts = None
+    if raw_stage == stable_stage and STABILIZER.stateless:
+        return False, stable_stage, last_change_ts, updates
 
-    elapsed = (now - last_change_ts).total_seconds() if last_change_ts else 10**9
+    ts = max(source_ts, last_change_ts) if last_change_ts is not None else source_ts
+    stab, target = stabilize(STABILIZER, st.get("stab"), stable_stage, last_change_ts, raw_stage, ts)
+    if stab is not None: updates["stab"] = stab
+    if target is None:
+        return False, stable_stage, last_change_ts, updates
 
-    if raw_stage == stable_stage:
-        tx.update(state_ref, {"raw_stage": raw_stage, "updated_at": now, "last_source_ts": source_ts})
-        return False, stable_stage, last_change_ts
+    updates.update({"stage": target, "last_change_ts": ts})
+    # 세션 시작부터 누적 중인 문서만 이어서 누적 (중간부터 세면 점수가 틀어지므로)
+    if st.get("score_acc") is not None:
+        updates["score_acc"] = _accumulate_stage(st["score_acc"], stable_stage, last_change_ts, ts)
+    return True, target, ts, updates
 
-    if elapsed >= min_duration_sec_for(stable_stage):
-        tx.update(state_ref, {
-            "stage": raw_stage, "raw_stage": raw_stage, "last_change_ts": now,
-            "updated_at": now, "last_source_ts": source_ts,
-        })
-        return True, raw_stage, now
-    else:
-        tx.update(state_ref, {"raw_stage": raw_stage, "updated_at": now, "last_source_ts": source_ts})
-        return False, stable_stage, last_change_ts
+def _state_version(st: dict | None) -> int:
+    return int((st or {}).get("version", 0))
+
+def _update_session_state(repo: Repository, state_key: str, *, user_id: str, session_id: str, raw_stage: str, source_ts: datetime, now: datetime,
+                          expected_version: int | None = None, pending: dict | None = None):
+    """
+    반환: (stage_changed, stable_stage, changed_at, new_state, version, conflict)
+    expected_version: 캐시가 마지막으로 쓴 version - 문서와 다르면 다른 인스턴스가 쓴 것 (conflict)
+    pending: 캐시 상태 (아직 안 내려쓴 안정화 창 포함) - conflict 가 아니면 문서 대신 이 값으로 계산
+    """
+    def _apply(st: dict | None):
+        version = _state_version(st) + 1
+        conflict = expected_version is not None and _state_version(st) != expected_version
+        base = pending if pending is not None and st is not None and not conflict else st
+        stage_changed, stable_stage, changed_at, updates = _step_session_state(
+            base, user_id=user_id, session_id=session_id, raw_stage=raw_stage, source_ts=source_ts, now=now,
+        )
+        updates = {**updates, "version": version, "owner": INSTANCE_ID}
+        new_state = updates if base is None else {**base, **updates}
+        return (stage_changed, stable_stage, changed_at, new_state, version, conflict), ("set" if st is None else "update", updates)
+
+    return repo.transact_session_state(state_key, _apply)
+
+def _update_session_state_batch(repo: Repository, state_key: str, *, user_id: str, session_id: str, steps: list[tuple[str, datetime]],
+                                now: datetime, expected_version: int | None = None, pending: dict | None = None):
+    """
+    배치 버전: 상태 문서를 한 번 읽고, (raw_stage, source_ts) 목록을 순서대로 접은 뒤 한 번만 씀
+    시계 규칙은 _step_session_state 와 같음 (단계 타임라인 = source_ts, updated_at = now)
+    expected_version / pending: _update_session_state 와 같음 (캐시가 흡수한 아직 안 내려쓴 상태부터 이어서)
+    반환: ([(index, stable_stage, changed_at), ...] - 안정 단계가 바뀐 샘플만,
+           [(순번, run), ...] - 이번 배치에서 닫힌 하이프노그램 구간, new_state, version, conflict)
+    """
+    def _apply(doc: dict | None):
+        is_new = doc is None
+        version = _state_version(doc) + 1
+        conflict = expected_version is not None and _state_version(doc) != expected_version
+        st = pending if pending is not None and doc is not None and not conflict else doc
+        transitions, closed = [], []
+
+        for i, (raw_stage, source_ts) in enumerate(steps):
+            stage_changed, stable_stage, changed_at, updates = _step_session_state(
+                st, user_id=user_id, session_id=session_id, raw_stage=raw_stage, source_ts=source_ts, now=now,
+            )
+            st = updates if st is None else {**st, **updates}
+            if stage_changed:
+                transitions.append((i, stable_stage, changed_at))
+                closed.extend(_closed_runs(st))
+
+        if st is None: return (transitions, closed, None, version, conflict), None
+        st = {**st, "version": version, "owner": INSTANCE_ID}
+        if is_new: write = ("set", st)
+        else: write = ("update", {k: st[k] for k in ("stage", "raw_stage", "last_change_ts", "updated_at", "last_source_ts", "version", "owner", "score_acc", "stab") if k in st})
+        return (transitions, closed, st, version, conflict), write
+
+    return repo.transact_session_state(state_key, _apply)
+
+def _closed_runs(st: dict) -> list[tuple[int, list]]:
+    """방금 전환한 상태의 score_acc 에서 이번 전환으로 닫힌 구간 [(순번, run)] (첫 단계 / 누적 없는 세션은 빈 목록)"""
+    acc = st.get("score_acc") or {}
+    runs = int(acc.get("runs", 0))
+    return [(runs - 1, acc["last_run"])] if runs and acc.get("last_run") is not None else []
+
+def _append_hypnogram(repo: Repository, state_key: str, st: dict, closed: list[tuple[int, list]]) -> None:
+    """전환 직후 상태로 하이프노그램 갱신 - 닫힌 구간 추가 + 열린 구간 교체 (세션 시작부터 누적 중인 세션만)"""
+    origin = to_utc((st.get("score_acc") or {}).get("first_ts"))
+    if origin is None: return
+    open_run = [stage_code(st.get("stage")), offset_sec(to_utc(st.get("last_change_ts"), origin), origin)]
+    repo.append_hypnogram(state_key, append_pages(st.get("userId"), st.get("sessionId"), origin, closed, open_run))
 
-def create_command_for_stage(db: gcf.Client, user_id: str, session_id: str, stable_stage: str, changed_at: datetime):
+_command_dedup = CommandDedupCache()
+
+def create_command_for_stage(repo: Repository, user_id: str, session_id: str, stable_stage: str, changed_at: datetime,
+                             source_ts: datetime, event_id: str | None = None) -> bool:
+    """
+    전환 1건 → commands 문서 + 기기 수신함 반영
+    dedupKey 는 재전송해도 같은 입력(샘플 시각 source_ts, 있으면 raw 문서 ID event_id, 단계)으로 만듦 -
+    changed_at 은 처리 시각(now)이라 트리거가 재전송되면 값이 바뀌므로 키에 넣지 않음
+    """
     policy = command_policy(stable_stage)
-    if not policy: return
+    if not policy: return False
 
-    core = json.dumps({"u": user_id, "s": session_id, "stg": stable_stage, "t": int(changed_at.timestamp())}, sort_keys=True).encode()
+    core = json.dumps({"u": user_id, "s": session_id, "stg": stable_stage, "src": round(epoch_seconds(source_ts) * 1000),
+                       "ev": event_id}, sort_keys=True).encode()
     dkey = hashlib.sha1(core).hexdigest()[:12]
-    cmd_ref = db.collection("commands").document(dkey)
+
+    # 이 인스턴스가 최근에 끝까지 처리한 키면 Firestore 에 가지 않음 (트리거 재전송)
+    now = now_utc()
+    if _command_dedup.seen(dkey, now):
+        logs.debug("[명령 중복 - 캐시] %s", dkey, user=user_id, session=session_id)
+        return False
 
     try:
-        cmd_ref.create({
+        created = repo.create_command(dkey, {
             "userId": user_id, "sessionId": session_id, "type": policy["type"],
             "payload": policy.get("payload", {}), "status": "PENDING", "ttlSec": policy["ttlSec"],
             "ts": gcf.SERVER_TIMESTAMP, "dedupKey": dkey,
         })
-        print(f"[명령 생성 성공] {policy['type']} (for {stable_stage})")
-    except Exception: pass
+    except Exception as e:
+        _command_dedup.failed()
+        logs.error("[명령 생성 실패] %s %s: %s", dkey, type(e).__name__, e, user=user_id, session=session_id)
+        logs.session_event(user_id, session_id, now, command_errors=1)
+        report_db_error(e)
+        return False
+
+    if created:
+        logs.info("[명령 생성 성공] %s (for %s)", policy["type"], stable_stage, user=user_id, session=session_id)
+    else:
+        logs.debug("[명령 중복 - 이미 있음] %s", dkey, user=user_id, session=session_id)
+        logs.session_event(user_id, session_id, now, command_duplicates=1)
+
+    # 이미 있던 명령도 수신함에는 다시 반영 시도 - 지난번에 수신함 쓰기만 실패했을 수 있음 (같은 id 면 수신함이 무시)
+    try:
+        _post_to_inbox(repo, user_id, session_id, stable_stage, changed_at, policy, dkey)
+    except Exception as e:
+        _command_dedup.failed()
+        logs.error("[수신함 반영 실패] %s %s: %s", dkey, type(e).__name__, e, user=user_id, session=session_id)
+        logs.session_event(user_id, session_id, now, command_errors=1)
+        report_db_error(e)
+        return created
+
+    # 두 쓰기가 모두 끝난 뒤에만 기억 - 실패한 키는 다음 재전송에서 다시 시도
+    _command_dedup.remember(dkey, now, "created" if created else "duplicates")
+    return created
+
+def _post_to_inbox(repo: Repository, user_id: str, session_id: str, stable_stage: str, changed_at: datetime, policy: dict, dkey: str) -> str:
+    """기기 수신함에 구동부별 최신 명령으로 반영 (같은 구동부의 실행 전 명령은 덮어씀) - 반환: posted | duplicate | stale"""
+    outcome = repo.transact_command_inbox(user_id, lambda inbox: command_inbox.post(
+        inbox, command_id=dkey, user_id=user_id, session_id=session_id, command_type=policy["type"],
+        payload=policy.get("payload", {}), stage=stable_stage, issued_at=changed_at, ttl_sec=policy["ttlSec"], now=now_utc(),
+    ))
+    if outcome != "posted":
+        logs.debug("[수신함 생략] %s %s (%s)", policy["type"], dkey, outcome, user=user_id, session=session_id)
+    return outcome
+
+INGEST_LOG_SAMPLE_RATE = 0.01  # on_new_data 의 샘플별 [Ok] 줄을 INFO 에서 남기는 비율
+
+# ---------- 압력 알림 (조회 없는 30초 디바운스) ----------
+PRESSURE_ALERT_THRESHOLD = 3000
+PRESSURE_ALERT_DEBOUNCE_SEC = 30
+
+def _create_pressure_alert(repo: Repository, state_key: str, user_id: str, session_id: str, pressure_avg: float, ts: datetime, *, doc_ts=gcf.SERVER_TIMESTAMP) -> bool:
+    """
+    1) 이 인스턴스가 기억하는 마지막 알림 시각으로 30초 디바운스 → 쓰기/조회 없음 (ts = 샘플 시각, 수집 경로 공통)
+    2) 인스턴스 간 중복은 30초 창 번호로 만든 고정 문서 ID + create() 로 막음 → 창당 최대 1건
+    반환: 알림을 새로 만들었으면 True
+    """
+    last = _session_cache.last_alert(state_key)
+    if last is not None and (ts - last).total_seconds() < PRESSURE_ALERT_DEBOUNCE_SEC:
+        return False
+
+    window = int(ts.timestamp()) // PRESSURE_ALERT_DEBOUNCE_SEC
+    created = repo.create_pressure_alert(f"{state_key}__{window}", {
+        "userId": user_id,
+        "sessionId": session_id,
+        "pressure_avg": pressure_avg,
+        "ts": doc_ts,
+        "handled": False
+    })
+    _session_cache.mark_alert(state_key, ts)
+    return created
 
 # ---------- Gen2 options + Firestore trigger ----------
 options.set_global_options(region="asia-northeast3")
 
 @firestore_fn.on_document_created(document="raw_data/{docId}", region="asia-northeast3")
+@instrumented("on_new_data")
 def on_new_data(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]):
-    db = get_db()
+    t0 = time.perf_counter()
+    db_cold = _db is None
+    repo = get_repo()
     if event.data is None: return
 
     data = event.data.to_dict() or {}
     
-    # 1. 데이터 파싱
-    hr = float(data.get("hr", 0.0))
-    spo2 = float(data.get("spo2", 98.0))
-    mic_avg = float(data.get("mic_avg", data.get("mic_level", 0.0)))
-    pressure_avg = float(data.get("pressure_avg", data.get("pressure_level", 0.0)))
-    
-    user_id = data.get("userId", "demoUser")
-    session_id = data.get("sessionId", "demoSession")
-    is_auto_control_on = data.get("auto_control_active", False)
-
-    # Time parsing logic
-    source_ts_raw = data.get("ts")
-    if source_ts_raw is None: source_ts = now_utc()
-    elif isinstance(source_ts_raw, datetime): source_ts = source_ts_raw.astimezone(timezone.utc)
-    else:
-        try:
-            try: from google.cloud.firestore_v1 import Timestamp as FsTimestamp
-            except: FsTimestamp = None
-            if FsTimestamp and isinstance(source_ts_raw, FsTimestamp): source_ts = source_ts_raw.to_datetime().astimezone(timezone.utc)
-            elif isinstance(source_ts_raw, dict) and "seconds" in source_ts_raw: source_ts = datetime.fromtimestamp(source_ts_raw["seconds"], tz=timezone.utc)
-            elif isinstance(source_ts_raw, (int, float)): source_ts = datetime.fromtimestamp(source_ts_raw / (1000.0 if source_ts_raw > 1e12 else 1.0), tz=timezone.utc)
-            elif isinstance(source_ts_raw, str): source_ts = datetime.fromisoformat(source_ts_raw.replace('Z', '+00:00'))
-            else: source_ts = now_utc()
-        except: source_ts = now_utc()
+    # 1. 데이터 파싱 (별칭 필드 / 시각 형식은 decoder 가 처리)
+    try:
+        sample = decode_sample(data, now=now_utc)
+    except DecodeError as e:
+        logs.warning("[raw_data 형식 오류] %s %s", event.data.id, e, user=data.get("userId"), session=data.get("sessionId"))
+        return
+    hr, spo2, mic_avg, pressure_avg = sample.hr, sample.spo2, sample.mic_avg, sample.pressure_avg
+    user_id, session_id = sample.user_id, sample.session_id
+    is_auto_control_on = sample.auto_control_active
+    source_ts = sample.source_ts
 
     # ✅ 2. 하이브리드 판단 로직 호출!
     raw_stage = predict_stage_hybrid(hr, spo2, mic_avg, pressure_avg)
 
     now = now_utc()
-    state_ref = db.collection("session_state").document(f"{user_id}__{session_id}")
+    state_key = f"{user_id}__{session_id}"
+    tag_session(state_key)
 
-    try:
-        tx = db.transaction()
-        stage_changed, stable_stage, changed_at = _update_session_state(
-            tx, state_ref, user_id=user_id, session_id=session_id,
+    # 캐시된 상태로 먼저 판단 → 단계 변화가 없고 하트비트 전이면 트랜잭션 생략 (write-behind)
+    cached = _session_cache.get(state_key, now)
+    state_write = "skip"
+    if cached is not None:
+        stage_changed, stable_stage, changed_at, updates = _step_session_state(
+            cached.state, user_id=user_id, session_id=session_id,
             raw_stage=raw_stage, source_ts=source_ts, now=now,
         )
-    except Exception as e:
-        print(f"[Transaction Error] {e}")
-        return
+        if stage_changed or not _session_cache.absorb(state_key, updates, now):
+            cached_version, pending = cached.version, cached.state
+            cached = None
+    else:
+        cached_version = pending = None
+
+    if cached is None:
+        state_write = "write"
+        try:
+            stage_changed, stable_stage, changed_at, new_state, version, conflict = _update_session_state(
+                repo, state_key, user_id=user_id, session_id=session_id,
+                raw_stage=raw_stage, source_ts=source_ts, now=now, expected_version=cached_version, pending=pending,
+            )
+        except Exception as e:
+            logs.error("[Transaction Error] %s", e, user=user_id, session=session_id)
+            logs.session_event(user_id, session_id, now, samples=1, errors=1)
+            report_db_error(e)
+            _session_cache.drop(state_key)
+            return
+        _session_cache.put(state_key, new_state, version, now, conflict=conflict)
 
     # 3. 상태 변경 시 처리
+    command_created = False
     if stage_changed:
-        db.collection("processed_data").add({
+        repo.add_processed_stages([{
             "userId": user_id, "sessionId": session_id, "stage": stable_stage,
             "raw_stage": raw_stage, "confidence": stage_confidence(stable_stage),
             "ts": gcf.SERVER_TIMESTAMP, "changed_at": changed_at, "source_ts": source_ts,
-        })
+        }])
+        _append_hypnogram(repo, state_key, new_state, _closed_runs(new_state))
         
         if is_auto_control_on:
-            create_command_for_stage(db, user_id, session_id, stable_stage, changed_at)
+            command_created = create_command_for_stage(repo, user_id, session_id, stable_stage, changed_at, source_ts, event.data.id)
         else:
-            print(f"[알림] 상태 변경됨({stable_stage}) 그러나 자동 제어 OFF")
+            logs.debug("[알림] 상태 변경됨(%s) 그러나 자동 제어 OFF", stable_stage, user=user_id, session=session_id)
 
-    print(f"[Ok] {session_id} -> {stable_stage} (Changed: {stage_changed})")
+    # 샘플마다 찍던 줄은 INGEST_LOG_SAMPLE_RATE 만큼만 - 나머지는 세션 요약으로
+    logs.info("[Ok] %s -> %s (Changed: %s) [state=%s db=%s %.1fms]",
+              session_id, stable_stage, stage_changed, state_write, "cold" if db_cold else "warm", (time.perf_counter() - t0) * 1000,
+              user=user_id, session=session_id, sample=INGEST_LOG_SAMPLE_RATE)
     
     # ========================================
     # 🎪 압력 감지 로직 (✅ 중복 방지 추가!)
     # ========================================
-    print(f"🔍 [압력 센서] pressure_avg = {pressure_avg}")
+    logs.debug("🔍 [압력 센서] pressure_avg = %s", pressure_avg, user=user_id, session=session_id)
     
     # ✅ 압력이 높으면
-    if pressure_avg > 3000:
-        print(f"🚨 [압력 높음 감지!] {pressure_avg}")
-        
-        # ✅ 최근 30초 이내에 알림이 있었는지 확인 (중복 방지!)
-        thirty_seconds_ago = now - timedelta(seconds=30)
-        
-        recent_alerts = list(db.collection("pressure_alerts")\
-            .where("userId", "==", user_id)\
-            .where("sessionId", "==", session_id)\
-            .where("ts", ">=", thirty_seconds_ago)\
-            .limit(1)\
-            .stream())
-        
-        # 최근 알림이 있으면 무시
-        if len(recent_alerts) > 0:
-            print("⏭️ [스킵] 최근 30초 이내에 알림이 이미 있음")
-            return
-        
-        # ✅ 알림 생성 (30초 이내에 없을 때만!)
-        db.collection("pressure_alerts").add({
-            "userId": user_id,
-            "sessionId": session_id,
-            "pressure_avg": pressure_avg,
-            "ts": gcf.SERVER_TIMESTAMP,
-            "handled": False
-        })
-        print("✅ [알림 생성] 압력 높음 알림 생성!")
+    alert_created = False
+    if pressure_avg > PRESSURE_ALERT_THRESHOLD:
+        logs.debug("🚨 [압력 높음 감지!] %s", pressure_avg, user=user_id, session=session_id)
+        
+        # ✅ 최근 30초 이내에 알림이 있었으면 스킵 (조회 없이 디바운스)
+        alert_created = _create_pressure_alert(repo, state_key, user_id, session_id, pressure_avg, source_ts)
+        if alert_created:
+            logs.info("✅ [알림 생성] 압력 높음 알림 생성!", user=user_id, session=session_id)
+        else:
+            logs.debug("⏭️ [스킵] 최근 30초 이내에 알림이 이미 있음", user=user_id, session=session_id)
+
+    logs.session_event(
+        user_id, session_id, now, samples=1, transitions=int(stage_changed), state_writes=int(state_write == "write"),
+        commands=int(command_created), pressure_high=int(pressure_avg > PRESSURE_ALERT_THRESHOLD), alerts=int(alert_created),
+    )
+
+# ========================================
+# 📦 배치 수집: 샘플 N개를 한 번의 호출로 처리
+# ========================================
+MAX_BATCH_SAMPLES = 500  # Firestore WriteBatch 한도
+
+@https_fn.on_call()
+@instrumented("ingest_batch")
+def ingest_batch(req: https_fn.CallableRequest):
+    """
+    한 세션의 시간순 샘플 묶음(30~60초 분량)을 한 번에 처리
+    on_new_data와 같은 processed_data / commands / pressure_alerts 를 만들되,
+    세션 상태 트랜잭션은 배치당 1회만 수행합니다.
+
+    요청 파라미터:
+    - samples: raw_data 문서와 같은 형태의 dict 목록 (필수, 최대 500개)
+    - user_id / session_id: 생략 시 첫 샘플의 userId / sessionId 사용
+    """
+    repo = get_repo()
+    docs = req.data.get("samples") or []
+    if not isinstance(docs, list) or not docs:
+        raise https_fn.HttpsError("invalid-argument", "samples is required")
+    if len(docs) > MAX_BATCH_SAMPLES:
+        raise https_fn.HttpsError("invalid-argument", f"at most {MAX_BATCH_SAMPLES} samples per batch")
+
+    try:
+        batch = decode_batch(docs, user_id=req.data.get("user_id"), session_id=req.data.get("session_id"), now=now_utc)
+    except DecodeError as e:
+        raise https_fn.HttpsError("invalid-argument", str(e))
+    try:
+        return _ingest_sample_batch(repo, batch)
+    except Exception as e:
+        raise https_fn.HttpsError("internal", f"Batch ingestion failed: {str(e)}")
+
+def _ingest_sample_batch(repo: Repository, batch: SampleBatch) -> dict:
+    """
+    한 세션의 시간순 SampleBatch 처리 (ingest_batch / on_new_chunk 공용)
+    세션 상태 트랜잭션 1회 + 전환별 processed_data / commands + 압력 알림
+    트랜잭션이 실패하면 캐시를 버리고 예외를 그대로 올림
+    """
+    user_id, session_id = batch.user_id, batch.session_id
+    source_ts = batch.source_ts
+
+    stages = stage_names(predict_stage_hybrid_batch(batch.hr, batch.spo2, batch.mic_avg, batch.pressure_avg))
+    state_key = f"{user_id}__{session_id}"
+    tag_session(state_key)
+
+    # on_new_data 가 캐시에만 흡수해 둔 상태(안정화 창, 마지막 raw 단계)부터 이어서 접음
+    now = now_utc()
+    cached = _session_cache.get(state_key, now)
+    try:
+        transitions, closed, new_state, version, conflict = _update_session_state_batch(
+            repo, state_key, user_id=user_id, session_id=session_id, steps=list(zip(stages, source_ts)), now=now,
+            expected_version=cached.version if cached else None, pending=cached.state if cached else None,
+        )
+    except Exception as e:
+        logs.error("[Batch Transaction Error] %s", e, user=user_id, session=session_id)
+        logs.session_event(user_id, session_id, now, samples=len(batch), batches=1, errors=1)
+        report_db_error(e)
+        _session_cache.drop(state_key)
+        raise
+    if new_state is not None:
+        _session_cache.put(state_key, new_state, version, now, conflict=conflict)
+
+    repo.add_processed_stages([{
+        "userId": user_id, "sessionId": session_id, "stage": stable_stage,
+        "raw_stage": stages[i], "confidence": stage_confidence(stable_stage),
+        "ts": gcf.SERVER_TIMESTAMP, "changed_at": changed_at, "source_ts": source_ts[i],
+    } for i, stable_stage, changed_at in transitions])
+    if transitions:
+        _append_hypnogram(repo, state_key, new_state, closed)
+
+    # 압력 알림: on_new_data 와 같은 디바운스 (샘플 시각 기준)
+    alert_count = 0
+    for i in np.flatnonzero(batch.pressure_avg > PRESSURE_ALERT_THRESHOLD).tolist():
+        if _create_pressure_alert(repo, state_key, user_id, session_id, float(batch.pressure_avg[i]), source_ts[i], doc_ts=source_ts[i]):
+            alert_count += 1
+
+    command_count = 0
+    for i, stable_stage, changed_at in transitions:
+        if batch.auto_control_active[i]:
+            command_count += create_command_for_stage(repo, user_id, session_id, stable_stage, changed_at, source_ts[i])
+
+    stable_stage = transitions[-1][1] if transitions else None
+    logs.debug("[Batch Ok] %s samples=%d transitions=%d alerts=%d -> %s", session_id, len(batch), len(transitions), alert_count,
+               stable_stage or "(unchanged)", user=user_id, session=session_id)
+    logs.session_event(user_id, session_id, now_utc(), samples=len(batch), batches=1, transitions=len(transitions),
+                       commands=command_count, alerts=alert_count)
+
+    return {
+        "session_id": session_id,
+        "sample_count": len(batch),
+        "transitions": [{"stage": stage, "changed_at": changed_at.isoformat()} for _, stage, changed_at in transitions],
+        "alert_count": alert_count,
+    }
+
+# ========================================
+# 🧱 raw 청크 수집: 구간(기본 60초) 샘플을 묶은 문서 1개 → 배치 처리 1회
+# ========================================
+
+@firestore_fn.on_document_created(document=f"{CHUNK_COLLECTION}/{{chunkId}}", region="asia-northeast3")
+@instrumented("on_new_chunk")
+def on_new_chunk(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]):
+    """
+    raw_chunks 문서(형식은 chunks.py) 하나를 ingest_batch 와 같은 경로로 처리
+    열 배열은 문서 bytes 위의 뷰로 읽어서 그대로 벡터 판정에 넘김
+    """
+    if event.data is None: return
+    repo = get_repo()
+    data = event.data.to_dict() or {}
+    try:
+        batch = chunk_to_batch(read_chunk(data))
+    except DecodeError as e:
+        logs.warning("[청크 형식 오류] %s %s", event.data.id, e, user=data.get("userId"), session=data.get("sessionId"))
+        return
+    _ingest_sample_batch(repo, batch)
 
 # ========================================
 # 📊 수면 점수 및 AHI 진단 통합 버전
 # ========================================
+_SCORED_STAGES = ("Deep", "Light", "REM", "Awake", "Apnea", "Snoring")
+
+def _accumulated_sleep_totals(repo: Repository, user_id: str | None, session_id: str) -> dict | None:
+    """session_state.score_acc 에서 O(1)로 읽기 (문서 1개) - 누적값이 없으면 None"""
+    if user_id:
+        st = repo.get_session_state(f"{user_id}__{session_id}")
+    else:
+        st = repo.find_session_state(session_id)
+    acc = (st or {}).get("score_acc")
+    if not acc: return None
+
+    first_ts, last_ts = to_utc(acc.get("first_ts")), to_utc(acc.get("last_ts"))
+    if first_ts is None or last_ts is None: return None
+    durations = acc.get("stage_durations") or {}
+    return {
+        "total_duration_sec": (last_ts - first_ts).total_seconds(),
+        "stage_durations": {s: durations.get(s, 0) for s in _SCORED_STAGES},
+        "apnea_event_count": int(acc.get("apnea_count", 0)),
+    }
+
+def _hypnogram_sleep_totals(repo: Repository, user_id: str | None, session_id: str) -> dict | None:
+    """hypnograms 문서(보통 1개)의 닫힌 구간으로 계산 - 세션 상태가 없을 때 processed_data 재집계 전에 시도"""
+    if not user_id: return None
+    found = repo.get_hypnogram(f"{user_id}__{session_id}")
+    totals = sleep_totals(read_hypnogram(*found)) if found else None
+    if totals is None: return None
+    durations = totals["stage_durations"]
+    return {**totals, "stage_durations": {s: durations.get(s, 0) for s in _SCORED_STAGES}}
+
+def _rescan_sleep_totals(repo: Repository, session_id: str) -> dict | None:
+    """검증/폴백용: processed_data 전체를 changed_at 순으로 다시 훑어서 계산"""
+    stages_data = repo.list_processed_stages(session_id)
+    if not stages_data: return None
+
+    changed = [to_utc(d["changed_at"]) for d in stages_data]
+    first_ts, last_ts = changed[0], changed[-1]
+
+    stage_durations = {s: 0 for s in _SCORED_STAGES}
+    apnea_event_count = 0
+    for i in range(len(stages_data) - 1):
+        duration = (changed[i + 1] - changed[i]).total_seconds()
+        stage = stages_data[i].get("stage", "Unknown")
+        if stage in stage_durations: stage_durations[stage] += duration
+        if stage == "Apnea": apnea_event_count += 1
+
+    return {
+        "total_duration_sec": (last_ts - first_ts).total_seconds(),
+        "stage_durations": stage_durations,
+        "apnea_event_count": apnea_event_count,
+    }
+
+def _load_sleep_totals(repo: Repository, user_id: str | None, session_id: str, mode: str = "auto") -> dict | None:
+    """
+    단계별 시간 및 무호흡 횟수 (세션 상태의 러닝 합계 → 하이프노그램 → 없으면 전체 재집계)
+    mode: "auto"(누적값 우선) | "rescan"(processed_data 전체 재집계) | "verify"(둘 다 계산 후 비교 로그, 재집계 결과 사용)
+    """
+    totals = None if mode == "rescan" else _accumulated_sleep_totals(repo, user_id, session_id)
+    if totals is None and mode == "auto":
+        totals = _hypnogram_sleep_totals(repo, user_id, session_id)
+    if totals is None or mode == "verify":
+        rescanned = _rescan_sleep_totals(repo, session_id)
+        if totals is not None and rescanned is not None and totals != rescanned:
+            logs.warning("[누적값 검증 불일치] session: %s acc=%s rescan=%s", session_id, totals, rescanned, user=user_id, session=session_id)
+        totals = rescanned
+    return totals
+
+
+def _build_sleep_report(user_id: str | None, session_id: str, totals: dict) -> tuple[dict, dict]:
+    """
+    단계별 누적 시간 → 수면 점수 + AHI 진단 리포트 (Firestore 접근 없음)
+    반환: (sleep_reports 문서, 알림 값 {score, message, efficiency, snoring_min})
+    """
+    total_duration_sec = totals["total_duration_sec"]
+    total_duration_hours = total_duration_sec / 3600 if total_duration_sec > 0 else 0
+    stage_durations = totals["stage_durations"]
+    apnea_event_count = totals["apnea_event_count"]
+
+    # 3️⃣ 점수 계산
+    # 3-1. 수면 시간 점수 (40점)
+    if 7 <= total_duration_hours <= 9: duration_score = 40
+    elif 6 <= total_duration_hours < 7: duration_score = 30
+    elif 9 < total_duration_hours <= 10: duration_score = 35
+    elif 5 <= total_duration_hours < 6: duration_score = 20
+    else: duration_score = 10
+
+    # 3-2. 깊은 수면 점수 (25점)
+    deep_ratio = stage_durations["Deep"] / total_duration_sec if total_duration_sec > 0 else 0
+    if 0.15 <= deep_ratio <= 0.25: deep_score = 25
+    elif 0.10 <= deep_ratio < 0.15 or 0.25 < deep_ratio <= 0.30: deep_score = 20
+    else: deep_score = 10
+
+    # 3-3. REM 수면 점수 (20점)
+    rem_ratio = stage_durations["REM"] / total_duration_sec if total_duration_sec > 0 else 0
+    if 0.20 <= rem_ratio <= 0.25: rem_score = 20
+    elif 0.15 <= rem_ratio < 0.20 or 0.25 < rem_ratio <= 0.30: rem_score = 15
+    else: rem_score = 8
+
+    # 3-4. 수면 효율 점수 (15점)
+    awake_ratio = stage_durations["Awake"] / total_duration_sec if total_duration_sec > 0 else 0
+    if awake_ratio < 0.05: efficiency_score = 15
+    elif awake_ratio < 0.10: efficiency_score = 12
+    elif awake_ratio < 0.15: efficiency_score = 8
+    else: efficiency_score = 3
+
+    total_score = duration_score + deep_score + rem_score + efficiency_score
+
+    # 4️⃣ AHI 기반 무호흡 진단
+    ahi_score = apnea_event_count / total_duration_hours if total_duration_hours > 0 else 0
+    apnea_diagnosis = "정상"
+    if apnea_event_count >= 30 or ahi_score >= 5:
+        total_score = max(0, total_score - 15)
+        if ahi_score >= 30: apnea_diagnosis = "중증 수면 무호흡 (위험)"
+        elif ahi_score >= 15: apnea_diagnosis = "중등도 수면 무호흡 (주의)"
+        else: apnea_diagnosis = "경증 수면 무호흡 (관찰 필요)"
+
+    # 5️⃣ 메시지
+    if total_score >= 90: message = "훌륭한 수면이었습니다! 🌟"
+    elif total_score >= 80: message = "좋은 수면입니다 😊"
+    elif total_score >= 70: message = "양호한 수면입니다 👍"
+    elif total_score >= 60: message = "수면이 부족합니다 😐"
+    else: message = "수면 개선이 필요합니다 ⚠️"
+
+    # 6️⃣ 리포트 문서
+    # Flutter 모델과 완전히 호환되도록 모든 필드 포함
+    report_data = {
+        "userId": user_id,
+        "sessionId": session_id,
+        "created_at": now_utc().isoformat(),
+        "total_score": int(total_score),
+        "message": message,
+        "summary": {
+            # 총 수면 시간
+            "total_duration_hours": round(total_duration_hours, 2),
+
+            # 각 단계별 시간 (시간 단위)
+            "deep_sleep_hours": round(stage_durations["Deep"] / 3600, 2),
+            "rem_sleep_hours": round(stage_durations["REM"] / 3600, 2),
+            "light_sleep_hours": round(stage_durations["Light"] / 3600, 2),
+            "awake_hours": round(stage_durations["Awake"] / 3600, 2),
+
+            # 각 단계별 비율 (%)
+            "deep_ratio": round(deep_ratio * 100, 1),
+            "rem_ratio": round(rem_ratio * 100, 1),
+            "awake_ratio": round(awake_ratio * 100, 1),
+
+            # 무호흡 및 코골이 정보
+            "apnea_count": apnea_event_count,
+            "ahi_index": round(ahi_score, 1),
+            "apnea_diagnosis": apnea_diagnosis,
+            "snoring_duration": round(stage_durations["Snoring"] / 60, 1)
+        }
+    }
+    
+    notify = {
+        "score": int(total_score),
+        "message": message,
+        # awake_ratio 로 수면 효율(%) 계산
+        "efficiency": (1.0 - awake_ratio) * 100,
+        # stage_durations["Snoring"]은 초 단위이므로 분 단위로 변환
+        "snoring_min": stage_durations["Snoring"] / 60,
+    }
+    return report_data, notify
+
+
+def _write_and_notify(repo: Repository, user_id: str | None, notify: dict, write) -> None:
+    """
+    write()(리포트 커밋)가 끝난 뒤에만 알림 3종 발송 - 쓰기가 실패하면 알림 없이 그대로 올려보냄
+    커밋하는 동안 알림에 쓸 users/{uid} 는 미리 읽어서 프로필 캐시를 채워 둠 (발송 자체는 커밋 후)
+    알림 실패는 로그만 남김
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        if user_id:
+            pool.submit(contextvars.copy_context().run, get_user_profile, repo, user_id)
+        write()
+    try:
+        send_report_notifications(repo, user_id, **notify)
+    except Exception as e:
+        logs.error("[알림 발송 오류] user: %s, %s", user_id, e, user=user_id)
+
+
 @https_fn.on_call()
+@instrumented("calculate_sleep_score")
 def calculate_sleep_score(req: https_fn.CallableRequest):
     """
     수면 점수 계산 및 '수면 무호흡증(AHI)' 진단 로직 통합
+
+    요청 파라미터:
+    - session_id: 세션 ID (필수)
+    - user_id: 사용자 ID (있으면 session_state 문서를 바로 읽음)
+    - mode: "auto"(기본, 누적값 우선) | "rescan"(processed_data 전체 재집계) | "verify"(둘 다 계산 후 비교 로그, 재집계 결과 사용)
     """
     db = get_db()
     session_id = req.data.get("session_id")
@@ -328,148 +877,125 @@ def calculate_sleep_score(req: https_fn.CallableRequest):
     if not session_id:
         raise https_fn.HttpsError("invalid-argument", "session_id is required")
     
-    print(f"[수면 점수 및 진단 시작] session: {session_id}")
+    tag_session(f"{user_id}__{session_id}" if user_id else session_id)
+    logs.info("[수면 점수 및 진단 시작] session: %s", session_id, user=user_id)
     
     try:
-        # 1️⃣ 데이터 가져오기
-        processed_docs = db.collection("processed_data")\
-            .where("sessionId", "==", session_id)\
-            .order_by("changed_at", direction=firestore.Query.ASCENDING)\
-            .stream()
-        stages_data = [doc.to_dict() for doc in processed_docs]
-        if not stages_data:
+        totals = _load_sleep_totals(get_repo(), user_id, session_id, req.data.get("mode", "auto"))
+        if totals is None:
             return {"error": "No data", "total_score": 0, "message": "데이터가 없습니다"}
-        
-        first_ts = stages_data[0]["changed_at"]
-        last_ts = stages_data[-1]["changed_at"]
-        if hasattr(first_ts, "to_datetime"): first_ts = first_ts.to_datetime()
-        if hasattr(last_ts, "to_datetime"): last_ts = last_ts.to_datetime()
-        total_duration_sec = (last_ts - first_ts).total_seconds()
-        total_duration_hours = total_duration_sec / 3600 if total_duration_sec > 0 else 0
-        
-        # 2️⃣ 단계별 시간 및 무호흡 계산
-        stage_durations = {"Deep": 0, "Light": 0, "REM": 0, "Awake": 0, "Apnea": 0, "Snoring": 0}
-        apnea_event_count = 0
-        for i in range(len(stages_data) - 1):
-            current = stages_data[i]
-            next_ts = stages_data[i + 1]["changed_at"]
-            if hasattr(next_ts, "to_datetime"): next_ts = next_ts.to_datetime()
-            current_ts = current["changed_at"]
-            if hasattr(current_ts, "to_datetime"): current_ts = current_ts.to_datetime()
-            duration = (next_ts - current_ts).total_seconds()
-            stage = current.get("stage", "Unknown")
-            if stage in stage_durations: stage_durations[stage] += duration
-            if stage == "Apnea": apnea_event_count += 1
-        
-        # 3️⃣ 점수 계산
-        # 3-1. 수면 시간 점수 (40점)
-        if 7 <= total_duration_hours <= 9: duration_score = 40
-        elif 6 <= total_duration_hours < 7: duration_score = 30
-        elif 9 < total_duration_hours <= 10: duration_score = 35
-        elif 5 <= total_duration_hours < 6: duration_score = 20
-        else: duration_score = 10
-        
-        # 3-2. 깊은 수면 점수 (25점)
-        deep_ratio = stage_durations["Deep"] / total_duration_sec if total_duration_sec > 0 else 0
-        if 0.15 <= deep_ratio <= 0.25: deep_score = 25
-        elif 0.10 <= deep_ratio < 0.15 or 0.25 < deep_ratio <= 0.30: deep_score = 20
-        else: deep_score = 10
-        
-        # 3-3. REM 수면 점수 (20점)
-        rem_ratio = stage_durations["REM"] / total_duration_sec if total_duration_sec > 0 else 0
-        if 0.20 <= rem_ratio <= 0.25: rem_score = 20
-        elif 0.15 <= rem_ratio < 0.20 or 0.25 < rem_ratio <= 0.30: rem_score = 15
-        else: rem_score = 8
-        
-        # 3-4. 수면 효율 점수 (15점)
-        awake_ratio = stage_durations["Awake"] / total_duration_sec if total_duration_sec > 0 else 0
-        if awake_ratio < 0.05: efficiency_score = 15
-        elif awake_ratio < 0.10: efficiency_score = 12
-        elif awake_ratio < 0.15: efficiency_score = 8
-        else: efficiency_score = 3
-        
-        total_score = duration_score + deep_score + rem_score + efficiency_score
-        
-        # 4️⃣ AHI 기반 무호흡 진단
-        ahi_score = apnea_event_count / total_duration_hours if total_duration_hours > 0 else 0
-        apnea_diagnosis = "정상"
-        if apnea_event_count >= 30 or ahi_score >= 5:
-            total_score = max(0, total_score - 15)
-            if ahi_score >= 30: apnea_diagnosis = "중증 수면 무호흡 (위험)"
-            elif ahi_score >= 15: apnea_diagnosis = "중등도 수면 무호흡 (주의)"
-            else: apnea_diagnosis = "경증 수면 무호흡 (관찰 필요)"
-        
-        # 5️⃣ 메시지
-        if total_score >= 90: message = "훌륭한 수면이었습니다! 🌟"
-        elif total_score >= 80: message = "좋은 수면입니다 😊"
-        elif total_score >= 70: message = "양호한 수면입니다 👍"
-        elif total_score >= 60: message = "수면이 부족합니다 😐"
-        else: message = "수면 개선이 필요합니다 ⚠️"
-        
-        # 6️⃣ DB 저장
-        # Flutter 모델과 완전히 호환되도록 모든 필드 포함
-        report_data = {
-            "userId": user_id,
-            "sessionId": session_id,
-            "created_at": now_utc().isoformat(),
-            "total_score": int(total_score),
-            "message": message,
-            "summary": {
-                # 총 수면 시간
-                "total_duration_hours": round(total_duration_hours, 2),
-                
-                # 각 단계별 시간 (시간 단위)
-                "deep_sleep_hours": round(stage_durations["Deep"] / 3600, 2),
-                "rem_sleep_hours": round(stage_durations["REM"] / 3600, 2),
-                "light_sleep_hours": round(stage_durations["Light"] / 3600, 2),
-                "awake_hours": round(stage_durations["Awake"] / 3600, 2),
-                
-                # 각 단계별 비율 (%)
-                "deep_ratio": round(deep_ratio * 100, 1),
-                "rem_ratio": round(rem_ratio * 100, 1),
-                "awake_ratio": round(awake_ratio * 100, 1),
-                
-                # 무호흡 및 코골이 정보
-                "apnea_count": apnea_event_count,
-                "ahi_index": round(ahi_score, 1),
-                "apnea_diagnosis": apnea_diagnosis,
-                "snoring_duration": round(stage_durations["Snoring"] / 60, 1)
-            }
-        }
-        
-        db.collection("sleep_reports").document(session_id).set({
-            **report_data, "created_at": gcf.SERVER_TIMESTAMP
-        })
-        
-        # ====================================================
-        # 🔔 [수정됨] 알림 3종 세트 발송 로직 추가
-        # ====================================================
-        
-        # 1. 수면 리포트 알림 (기존)
-        send_sleep_report_notification(db=db, user_id=user_id, score=int(total_score), message=message)
-        
-        # 2. 수면 효율 알림 (누락된 부분 추가)
-        # awake_ratio가 계산되어 있으므로 이를 이용해 효율(%) 계산
-        sleep_efficiency_percent = (1.0 - awake_ratio) * 100
-        send_sleep_efficiency_notification(db=db, user_id=user_id, efficiency=sleep_efficiency_percent)
 
-        # 3. 코골이 알림 (누락된 부분 추가)
-        # stage_durations["Snoring"]은 초 단위이므로 분 단위로 변환
-        snoring_min = stage_durations["Snoring"] / 60
-        send_snoring_notification(db=db, user_id=user_id, duration_min=snoring_min)
+        report_data, notify = _build_sleep_report(user_id, session_id, totals)
+        
+        # 리포트 + 월별 롤업(users/{uid}/rollups/{yyyy-mm})을 한 트랜잭션으로, 커밋 후 알림 3종 발송
+        _write_and_notify(get_repo(), user_id, notify, lambda: write_report_with_rollup(db, session_id, report_data))
 
         return report_data
         
     except Exception as e:
-        print(f"[오류] {e}")
+        logs.error("[오류] %s", e, user=user_id)
+        report_db_error(e)
         raise https_fn.HttpsError("internal", str(e))
 
 
+# ========================================
+# 📈 하이프노그램 조회 (차트용, 문서 1개)
+# ========================================
+MAX_HYPNOGRAM_RESOLUTION_SEC = 3600
+
+@https_fn.on_call()
+@instrumented("get_hypnogram")
+def get_hypnogram(req: https_fn.CallableRequest):
+    """
+    세션의 단계 구간을 요청한 시간 해상도로 반환 (hypnograms 문서 1개, 아주 긴 세션만 넘침 페이지 추가)
+
+    요청 파라미터:
+    - user_id / session_id: 필수
+    - resolution_sec: 구간 간격(초) - 각 구간은 가장 오래 머문 단계, 0 이거나 생략하면 저장된 구간 그대로
+    - until: 진행 중인 마지막 단계를 이 시각까지로 포함 (ISO 문자열 / epoch 초·밀리초, 생략하면 닫힌 구간만)
+
+    반환: start_ts, stages(코드 → 이름), runs([코드, 시작 오프셋(초), 길이(초)] 목록), open([코드, 시작 오프셋] 또는 None)
+    """
+    user_id = req.data.get("user_id")
+    session_id = req.data.get("session_id")
+    if not user_id or not session_id:
+        raise https_fn.HttpsError("invalid-argument", "user_id and session_id are required")
+    try:
+        resolution_sec = float(req.data.get("resolution_sec") or 0)
+    except (TypeError, ValueError):
+        raise https_fn.HttpsError("invalid-argument", "resolution_sec must be a number")
+    if not 0 <= resolution_sec <= MAX_HYPNOGRAM_RESOLUTION_SEC:
+        raise https_fn.HttpsError("invalid-argument", f"resolution_sec must be between 0 and {MAX_HYPNOGRAM_RESOLUTION_SEC}")
+    until = to_utc(req.data.get("until"))
+
+    state_key = f"{user_id}__{session_id}"
+    tag_session(state_key)
+    found = get_repo().get_hypnogram(state_key)
+    if found is None:
+        return {"error": "No data", "session_id": session_id, "runs": []}
+
+    hyp = read_hypnogram(*found)
+    runs = hyp.until(until) if until is not None else hyp.runs
+    return {
+        "session_id": session_id,
+        "start_ts": hyp.start_ts.isoformat() if hyp.start_ts else None,
+        "resolution_sec": resolution_sec,
+        "stages": list(STAGES),
+        "runs": resample(runs, resolution_sec),
+        "open": hyp.open,
+    }
+
+
 # ========================================
 # ✨ E단계: 주간 통계 계산
 # ========================================
 
+# 주간/월간 통계가 실제로 쓰는 리포트 필드 - 폴백 조회는 이것만 받아옴
+_REPORT_STAT_FIELDS = [
+    "sessionId", "userId", "total_score", "created_at",
+    "summary.total_duration_hours", "summary.deep_ratio", "summary.rem_ratio",
+]
+
+def _iter_reports_since(db: gcf.Client, user_id: str, start: datetime):
+    """
+    start 이후 리포트를 created_at 순서로 하나씩 - 롤업 문서(월별 1~2개)에서 읽고,
+    롤업이 그 기간을 다 덮지 못하면 sleep_reports 범위 조회(필드 투영)를 흘려보내면서 롤업을 채움
+    """
+    rows = load_rollup_reports(db, user_id, start)
+    if rows is not None:
+        yield from rows
+        return
+
+    reports = db.collection("sleep_reports")\
+        .where("userId", "==", user_id)\
+        .where("created_at", ">=", start)\
+        .select(_REPORT_STAT_FIELDS)\
+        .stream()
+    backfill = RollupBackfill(db, user_id, start)
+    waited, n = 0.0, 0  # 쿼리 시간 = 결과를 기다린 시간만 (호출 쪽 처리 시간 제외)
+    while True:
+        t0 = time.perf_counter()
+        doc = next(reports, None)
+        waited += time.perf_counter() - t0
+        if doc is None: break
+        n += 1
+        data = doc.to_dict()
+        if backfill is not None:
+            try:
+                backfill.add(data)
+            except Exception as e:
+                logs.error("[롤업 채우기 오류] user: %s, %s", user_id, e, user=user_id)
+                backfill = None
+        yield data
+    record_op(time.perf_counter() - waited, reads=max(1, n), queries=1, query_docs=n)  # 시작 시각 = 지금 - 기다린 시간
+    if backfill is not None:
+        try:
+            backfill.finish()
+        except Exception as e:
+            logs.error("[롤업 채우기 오류] user: %s, %s", user_id, e, user=user_id)
+
 @https_fn.on_call()
+@instrumented("calculate_weekly_stats")
 def calculate_weekly_stats(req: https_fn.CallableRequest):
     """
     사용자의 주간 수면 통계 계산
@@ -497,16 +1023,11 @@ def calculate_weekly_stats(req: https_fn.CallableRequest):
     else:
         week_start = datetime.now(timezone.utc) - timedelta(days=7)
     
-    print(f"[주간 통계 계산] user: {user_id}, from: {week_start}")
+    logs.info("[주간 통계 계산] user: %s, from: %s", user_id, week_start, user=user_id)
     
     try:
-        # 해당 기간의 리포트 조회
-        reports = db.collection("sleep_reports")\
-            .where("userId", "==", user_id)\
-            .where("created_at", ">=", week_start)\
-            .stream()
-        
-        report_list = [doc.to_dict() for doc in reports]
+        # 해당 기간의 리포트 조회 (롤업 우선)
+        report_list = list(_iter_reports_since(db, user_id, week_start))
         
         if not report_list:
             return {
@@ -567,19 +1088,298 @@ def calculate_weekly_stats(req: https_fn.CallableRequest):
             "trend": trend
         }
         
-        print(f"[주간 통계 완료] {len(report_list)}개 리포트, 평균 점수: {avg_score:.1f}")
+        logs.info("[주간 통계 완료] %d개 리포트, 평균 점수: %.1f", len(report_list), avg_score, user=user_id)
         
         return result
         
     except Exception as e:
-        print(f"[주간 통계 오류] {e}")
+        logs.error("[주간 통계 오류] %s", e, user=user_id)
+        report_db_error(e)
         raise https_fn.HttpsError("internal", f"Stats calculation failed: {str(e)}")
     
 # ========================================
 # ✨ Phase 3: 인사이트 생성
 # ========================================
 
+def _build_sleep_insights(session_id: str, report: dict) -> dict:
+    """수면 리포트 → 인사이트 / 종합 평가 / 실행 계획 (Firestore 접근 없음)"""
+    # 인사이트 수집
+    insights = []
+
+    # 1. 수면 시간 분석
+    sleep_hours = report["summary"]["total_duration_hours"]
+
+    if sleep_hours < 5:
+        insights.append({
+            "type": "critical",
+            "category": "duration",
+            "title": "심각한 수면 부족",
+            "message": f"현재 {sleep_hours:.1f}시간으로 건강에 위험할 수 있어요",
+            "priority": 1,
+            "impact": "건강, 집중력, 면역력",
+            "actions": [
+                "오늘 밤 최소 7시간 수면 목표 설정",
+                "취침 시간 2시간 앞당기기",
+                "낮잠 20분 이내로 제한"
+            ]
+        })
+    elif sleep_hours < 6:
+        insights.append({
+            "type": "warning",
+            "category": "duration",
+            "title": "수면 시간 부족",
+            "message": f"현재 {sleep_hours:.1f}시간으로 권장(7-9시간)보다 부족해요",
+            "priority": 2,
+            "impact": "피로 누적, 업무 효율 저하",
+            "actions": [
+                "취침 시간을 1시간 앞당기기",
+                "기상 알람 30분 늦추기",
+                "주말에 보충 수면"
+            ]
+        })
+    elif sleep_hours > 10:
+        insights.append({
+            "type": "info",
+            "category": "duration",
+            "title": "과도한 수면",
+            "message": f"{sleep_hours:.1f}시간은 권장(7-9시간)보다 많아요",
+            "priority": 3,
+            "impact": "낮 동안 졸림, 운동 부족",
+            "actions": [
+                "규칙적인 기상 시간 설정",
+                "낮 활동량 늘리기",
+                "카페인 섭취 줄이기"
+            ]
+        })
+
+    # 2. 깊은 수면 분석
+    deep_ratio = report["summary"]["deep_ratio"]
+    deep_hours = report["summary"]["deep_sleep_hours"]
+
+    if deep_ratio < 5:
+        insights.append({
+            "type": "critical",
+            "category": "quality",
+            "title": "깊은 수면 심각 부족",
+            "message": f"깊은 수면이 {deep_ratio:.1f}%로 매우 부족해요 (권장: 15-25%)",
+            "priority": 1,
+            "impact": "회복력, 성장호르몬, 면역력",
+            "actions": [
+                "저녁 6시 이후 카페인 금지",
+                "오후 3-5시에 30분 유산소 운동",
+                "취침 2시간 전 따뜻한 샤워",
+                "침실 온도 18-20도 유지"
+            ]
+        })
+    elif deep_ratio < 10:
+        insights.append({
+            "type": "warning",
+            "category": "quality",
+            "title": "깊은 수면 부족",
+            "message": f"깊은 수면이 {deep_ratio:.1f}% ({deep_hours:.1f}시간)로 부족해요",
+            "priority": 2,
+            "impact": "피로 회복, 기억력",
+            "actions": [
+                "낮에 20-30분 가벼운 운동",
+                "저녁 식사 취침 3시간 전",
+                "취침 전 스트레칭 10분"
+            ]
+        })
+
+    # 3. REM 수면 분석
+    rem_ratio = report["summary"]["rem_ratio"]
+    rem_hours = report["summary"]["rem_sleep_hours"]
+
+    if rem_ratio < 10:
+        insights.append({
+            "type": "warning",
+            "category": "quality",
+            "title": "REM 수면 부족",
+            "message": f"REM 수면이 {rem_ratio:.1f}% ({rem_hours:.1f}시간)로 부족해요 (권장: 20-25%)",
+            "priority": 2,
+            "impact": "학습, 기억력, 감정 조절",
+            "actions": [
+                "규칙적인 수면 스케줄 유지",
+                "알코올 섭취 줄이기",
+                "충분한 총 수면 시간 확보"
+            ]
+        })
+
+    # 4. 수면 효율 분석
+    awake_ratio = report["summary"]["awake_ratio"]
+    awake_hours = report["summary"]["awake_hours"]
+
+    if awake_ratio > 20:
+        insights.append({
+            "type": "warning",
+            "category": "efficiency",
+            "title": "수면 효율 매우 낮음",
+            "message": f"수면 중 {awake_ratio:.1f}% ({awake_hours:.1f}시간) 깨어있었어요",
+            "priority": 2,
+            "impact": "수면의 질, 낮 피로",
+            "actions": [
+                "침실을 완전히 어둡게",
+                "소음 차단 (귀마개 사용)",
+                "취침 1시간 전 스마트폰/TV 끄기",
+                "침대는 수면용으로만 사용"
+            ]
+        })
+    elif awake_ratio > 10:
+        insights.append({
+            "type": "info",
+            "category": "efficiency",
+            "title": "수면 효율 개선 필요",
+            "message": f"수면 중 {awake_ratio:.1f}% 깨어있었어요 (권장: 5% 이하)",
+            "priority": 3,
+            "impact": "수면의 질",
+            "actions": [
+                "취침 환경 점검 (온도, 소음, 빛)",
+                "규칙적인 취침 루틴 만들기"
+            ]
+        })
+
+    # 5. 무호흡 경고
+    apnea_count = report["summary"]["apnea_count"]
+
+    if apnea_count > 15:
+        insights.append({
+            "type": "critical",
+            "category": "health",
+            "title": "⚠️ 수면 무호흡 위험",
+            "message": f"수면 중 {apnea_count}회 무호흡이 감지됐어요",
+            "priority": 1,
+            "impact": "심혈관 건강, 뇌 산소 공급",
+            "actions": [
+                "즉시 수면 전문의 상담 예약",
+                "수면다원검사 권장",
+                "당분간 옆으로 자기"
+            ]
+        })
+    elif apnea_count > 5:
+        insights.append({
+            "type": "warning",
+            "category": "health",
+            "title": "무호흡 감지",
+            "message": f"수면 중 {apnea_count}회 무호흡이 감지됐어요",
+            "priority": 2,
+            "impact": "수면의 질, 피로",
+            "actions": [
+                "체중 관리 (BMI 정상 범위)",
+                "금연 및 음주 제한",
+                "옆으로 자는 습관 들이기",
+                "2주 후에도 지속되면 병원 상담"
+            ]
+        })
+
+    # 6. 코골이 분석
+    snoring_duration = report["summary"]["snoring_duration"]
+
+    if snoring_duration > 60:
+        insights.append({
+            "type": "warning",
+            "category": "health",
+            "title": "심한 코골이 감지",
+            "message": f"수면 중 {snoring_duration:.0f}분 동안 코를 골았어요",
+            "priority": 2,
+            "impact": "수면의 질, 주변 사람",
+            "actions": [
+                "옆으로 자기 (등 받침 베개 사용)",
+                "비강 확장 스트립 사용",
+                "체중 감량 (과체중인 경우)",
+                "알코올 섭취 줄이기"
+            ]
+        })
+    elif snoring_duration > 30:
+        insights.append({
+            "type": "info",
+            "category": "health",
+            "title": "코골이 감지",
+            "message": f"수면 중 {snoring_duration:.0f}분 동안 코를 골았어요",
+            "priority": 3,
+            "impact": "수면의 질",
+            "actions": [
+                "옆으로 자는 습관",
+                "베개 높이 조절"
+            ]
+        })
+
+    # 우선순위 순으로 정렬
+    insights.sort(key=lambda x: x["priority"])
+
+    # 7. 종합 평가
+    score = report["total_score"]
+
+    if score >= 90:
+        overall = {
+            "grade": "S",
+            "message": "완벽한 수면입니다! 🌟",
+            "summary": "모든 지표가 이상적입니다. 현재 수면 습관을 꾸준히 유지하세요.",
+            "emoji": "🌟"
+        }
+    elif score >= 80:
+        overall = {
+            "grade": "A",
+            "message": "좋은 수면입니다 😊",
+            "summary": "대부분의 지표가 양호합니다. 몇 가지만 개선하면 완벽해질 수 있어요.",
+            "emoji": "😊"
+        }
+    elif score >= 70:
+        overall = {
+            "grade": "B",
+            "message": "양호한 수면입니다 👍",
+            "summary": "기본은 갖췄지만 개선할 부분이 있어요. 아래 조언을 참고하세요.",
+            "emoji": "👍"
+        }
+    elif score >= 60:
+        overall = {
+            "grade": "C",
+            "message": "수면 개선이 필요합니다 😐",
+            "summary": "여러 지표에서 개선이 필요해요. 우선순위가 높은 것부터 실천하세요.",
+            "emoji": "😐"
+        }
+    else:
+        overall = {
+            "grade": "D",
+            "message": "수면에 적극적인 관리가 필요합니다 ⚠️",
+            "summary": "건강에 영향을 줄 수 있는 심각한 문제들이 있어요. 즉시 개선이 필요합니다.",
+            "emoji": "⚠️"
+        }
+
+    # 8. 오늘의 실행 계획 (우선순위 Top 3)
+    action_plan = {
+        "today": [],
+        "this_week": [],
+        "long_term": []
+    }
+
+    # 우선순위 1 (critical) - 오늘 당장
+    critical_insights = [i for i in insights if i["type"] == "critical"]
+    for insight in critical_insights[:2]:  # 최대 2개
+        action_plan["today"].extend(insight["actions"][:2])
+
+    # 우선순위 2 (warning) - 이번 주
+    warning_insights = [i for i in insights if i["type"] == "warning"]
+    for insight in warning_insights[:2]:  # 최대 2개
+        action_plan["this_week"].extend(insight["actions"][:1])
+
+    # 우선순위 3 (info) - 장기
+    info_insights = [i for i in insights if i["type"] == "info"]
+    for insight in info_insights[:1]:  # 최대 1개
+        action_plan["long_term"].extend(insight["actions"][:1])
+
+    return {
+        "session_id": session_id,
+        "score": score,
+        "overall": overall,
+        "insights": insights,
+        "insights_count": len(insights),
+        "action_plan": action_plan,
+        "generated_at": now_utc().isoformat()
+    }
+
+
 @https_fn.on_call()
+@instrumented("generate_sleep_insights")
 def generate_sleep_insights(req: https_fn.CallableRequest):
     """
     수면 리포트 기반 맞춤형 인사이트 및 개선 제안 생성
@@ -598,302 +1398,32 @@ def generate_sleep_insights(req: https_fn.CallableRequest):
     if not session_id:
         raise https_fn.HttpsError("invalid-argument", "session_id is required")
     
-    print(f"[인사이트 생성 시작] session: {session_id}")
+    tag_session(session_id)
+    logs.info("[인사이트 생성 시작] session: %s", session_id)
     
     try:
         # 리포트 가져오기
-        report_doc = db.collection("sleep_reports").document(session_id).get()
+        report = get_repo().get_report(session_id)
         
-        if not report_doc.exists:
+        if report is None:
             raise https_fn.HttpsError("not-found", f"Report not found for session: {session_id}")
         
-        report = report_doc.to_dict()
-        
-        # 인사이트 수집
-        insights = []
-        
-        # 1. 수면 시간 분석
-        sleep_hours = report["summary"]["total_duration_hours"]
-        
-        if sleep_hours < 5:
-            insights.append({
-                "type": "critical",
-                "category": "duration",
-                "title": "심각한 수면 부족",
-                "message": f"현재 {sleep_hours:.1f}시간으로 건강에 위험할 수 있어요",
-                "priority": 1,
-                "impact": "건강, 집중력, 면역력",
-                "actions": [
-                    "오늘 밤 최소 7시간 수면 목표 설정",
-                    "취침 시간 2시간 앞당기기",
-                    "낮잠 20분 이내로 제한"
-                ]
-            })
-        elif sleep_hours < 6:
-            insights.append({
-                "type": "warning",
-                "category": "duration",
-                "title": "수면 시간 부족",
-                "message": f"현재 {sleep_hours:.1f}시간으로 권장(7-9시간)보다 부족해요",
-                "priority": 2,
-                "impact": "피로 누적, 업무 효율 저하",
-                "actions": [
-                    "취침 시간을 1시간 앞당기기",
-                    "기상 알람 30분 늦추기",
-                    "주말에 보충 수면"
-                ]
-            })
-        elif sleep_hours > 10:
-            insights.append({
-                "type": "info",
-                "category": "duration",
-                "title": "과도한 수면",
-                "message": f"{sleep_hours:.1f}시간은 권장(7-9시간)보다 많아요",
-                "priority": 3,
-                "impact": "낮 동안 졸림, 운동 부족",
-                "actions": [
-                    "규칙적인 기상 시간 설정",
-                    "낮 활동량 늘리기",
-                    "카페인 섭취 줄이기"
-                ]
-            })
-        
-        # 2. 깊은 수면 분석
-        deep_ratio = report["summary"]["deep_ratio"]
-        deep_hours = report["summary"]["deep_sleep_hours"]
-        
-        if deep_ratio < 5:
-            insights.append({
-                "type": "critical",
-                "category": "quality",
-                "title": "깊은 수면 심각 부족",
-                "message": f"깊은 수면이 {deep_ratio:.1f}%로 매우 부족해요 (권장: 15-25%)",
-                "priority": 1,
-                "impact": "회복력, 성장호르몬, 면역력",
-                "actions": [
-                    "저녁 6시 이후 카페인 금지",
-                    "오후 3-5시에 30분 유산소 운동",
-                    "취침 2시간 전 따뜻한 샤워",
-                    "침실 온도 18-20도 유지"
-                ]
-            })
-        elif deep_ratio < 10:
-            insights.append({
-                "type": "warning",
-                "category": "quality",
-                "title": "깊은 수면 부족",
-                "message": f"깊은 수면이 {deep_ratio:.1f}% ({deep_hours:.1f}시간)로 부족해요",
-                "priority": 2,
-                "impact": "피로 회복, 기억력",
-                "actions": [
-                    "낮에 20-30분 가벼운 운동",
-                    "저녁 식사 취침 3시간 전",
-                    "취침 전 스트레칭 10분"
-                ]
-            })
-        
-        # 3. REM 수면 분석
-        rem_ratio = report["summary"]["rem_ratio"]
-        rem_hours = report["summary"]["rem_sleep_hours"]
-        
-        if rem_ratio < 10:
-            insights.append({
-                "type": "warning",
-                "category": "quality",
-                "title": "REM 수면 부족",
-                "message": f"REM 수면이 {rem_ratio:.1f}% ({rem_hours:.1f}시간)로 부족해요 (권장: 20-25%)",
-                "priority": 2,
-                "impact": "학습, 기억력, 감정 조절",
-                "actions": [
-                    "규칙적인 수면 스케줄 유지",
-                    "알코올 섭취 줄이기",
-                    "충분한 총 수면 시간 확보"
-                ]
-            })
-        
-        # 4. 수면 효율 분석
-        awake_ratio = report["summary"]["awake_ratio"]
-        awake_hours = report["summary"]["awake_hours"]
-        
-        if awake_ratio > 20:
-            insights.append({
-                "type": "warning",
-                "category": "efficiency",
-                "title": "수면 효율 매우 낮음",
-                "message": f"수면 중 {awake_ratio:.1f}% ({awake_hours:.1f}시간) 깨어있었어요",
-                "priority": 2,
-                "impact": "수면의 질, 낮 피로",
-                "actions": [
-                    "침실을 완전히 어둡게",
-                    "소음 차단 (귀마개 사용)",
-                    "취침 1시간 전 스마트폰/TV 끄기",
-                    "침대는 수면용으로만 사용"
-                ]
-            })
-        elif awake_ratio > 10:
-            insights.append({
-                "type": "info",
-                "category": "efficiency",
-                "title": "수면 효율 개선 필요",
-                "message": f"수면 중 {awake_ratio:.1f}% 깨어있었어요 (권장: 5% 이하)",
-                "priority": 3,
-                "impact": "수면의 질",
-                "actions": [
-                    "취침 환경 점검 (온도, 소음, 빛)",
-                    "규칙적인 취침 루틴 만들기"
-                ]
-            })
-        
-        # 5. 무호흡 경고
-        apnea_count = report["summary"]["apnea_count"]
-        
-        if apnea_count > 15:
-            insights.append({
-                "type": "critical",
-                "category": "health",
-                "title": "⚠️ 수면 무호흡 위험",
-                "message": f"수면 중 {apnea_count}회 무호흡이 감지됐어요",
-                "priority": 1,
-                "impact": "심혈관 건강, 뇌 산소 공급",
-                "actions": [
-                    "즉시 수면 전문의 상담 예약",
-                    "수면다원검사 권장",
-                    "당분간 옆으로 자기"
-                ]
-            })
-        elif apnea_count > 5:
-            insights.append({
-                "type": "warning",
-                "category": "health",
-                "title": "무호흡 감지",
-                "message": f"수면 중 {apnea_count}회 무호흡이 감지됐어요",
-                "priority": 2,
-                "impact": "수면의 질, 피로",
-                "actions": [
-                    "체중 관리 (BMI 정상 범위)",
-                    "금연 및 음주 제한",
-                    "옆으로 자는 습관 들이기",
-                    "2주 후에도 지속되면 병원 상담"
-                ]
-            })
-        
-        # 6. 코골이 분석
-        snoring_duration = report["summary"]["snoring_duration"]
-        
-        if snoring_duration > 60:
-            insights.append({
-                "type": "warning",
-                "category": "health",
-                "title": "심한 코골이 감지",
-                "message": f"수면 중 {snoring_duration:.0f}분 동안 코를 골았어요",
-                "priority": 2,
-                "impact": "수면의 질, 주변 사람",
-                "actions": [
-                    "옆으로 자기 (등 받침 베개 사용)",
-                    "비강 확장 스트립 사용",
-                    "체중 감량 (과체중인 경우)",
-                    "알코올 섭취 줄이기"
-                ]
-            })
-        elif snoring_duration > 30:
-            insights.append({
-                "type": "info",
-                "category": "health",
-                "title": "코골이 감지",
-                "message": f"수면 중 {snoring_duration:.0f}분 동안 코를 골았어요",
-                "priority": 3,
-                "impact": "수면의 질",
-                "actions": [
-                    "옆으로 자는 습관",
-                    "베개 높이 조절"
-                ]
-            })
-        
-        # 우선순위 순으로 정렬
-        insights.sort(key=lambda x: x["priority"])
-        
-        # 7. 종합 평가
-        score = report["total_score"]
-        
-        if score >= 90:
-            overall = {
-                "grade": "S",
-                "message": "완벽한 수면입니다! 🌟",
-                "summary": "모든 지표가 이상적입니다. 현재 수면 습관을 꾸준히 유지하세요.",
-                "emoji": "🌟"
-            }
-        elif score >= 80:
-            overall = {
-                "grade": "A",
-                "message": "좋은 수면입니다 😊",
-                "summary": "대부분의 지표가 양호합니다. 몇 가지만 개선하면 완벽해질 수 있어요.",
-                "emoji": "😊"
-            }
-        elif score >= 70:
-            overall = {
-                "grade": "B",
-                "message": "양호한 수면입니다 👍",
-                "summary": "기본은 갖췄지만 개선할 부분이 있어요. 아래 조언을 참고하세요.",
-                "emoji": "👍"
-            }
-        elif score >= 60:
-            overall = {
-                "grade": "C",
-                "message": "수면 개선이 필요합니다 😐",
-                "summary": "여러 지표에서 개선이 필요해요. 우선순위가 높은 것부터 실천하세요.",
-                "emoji": "😐"
-            }
-        else:
-            overall = {
-                "grade": "D",
-                "message": "수면에 적극적인 관리가 필요합니다 ⚠️",
-                "summary": "건강에 영향을 줄 수 있는 심각한 문제들이 있어요. 즉시 개선이 필요합니다.",
-                "emoji": "⚠️"
-            }
-        
-        # 8. 오늘의 실행 계획 (우선순위 Top 3)
-        action_plan = {
-            "today": [],
-            "this_week": [],
-            "long_term": []
-        }
-        
-        # 우선순위 1 (critical) - 오늘 당장
-        critical_insights = [i for i in insights if i["type"] == "critical"]
-        for insight in critical_insights[:2]:  # 최대 2개
-            action_plan["today"].extend(insight["actions"][:2])
-        
-        # 우선순위 2 (warning) - 이번 주
-        warning_insights = [i for i in insights if i["type"] == "warning"]
-        for insight in warning_insights[:2]:  # 최대 2개
-            action_plan["this_week"].extend(insight["actions"][:1])
-        
-        # 우선순위 3 (info) - 장기
-        info_insights = [i for i in insights if i["type"] == "info"]
-        for insight in info_insights[:1]:  # 최대 1개
-            action_plan["long_term"].extend(insight["actions"][:1])
-        
-        result = {
-            "session_id": session_id,
-            "score": score,
-            "overall": overall,
-            "insights": insights,
-            "insights_count": len(insights),
-            "action_plan": action_plan,
-            "generated_at": now_utc().isoformat()
-        }
+        result = _build_sleep_insights(session_id, report)
         
         # Firestore에 저장
+        started = time.perf_counter()
         db.collection("sleep_insights").document(session_id).set(result)
+        record_op(started, writes=1, commits=1, docs=(f"sleep_insights/{session_id}",))
         
-        print(f"[인사이트 생성 완료] session: {session_id}, insights: {len(insights)}")
+        logs.info("[인사이트 생성 완료] session: %s, insights: %s", session_id, result["insights_count"])
         
         return result
         
     except https_fn.HttpsError:
         raise
     except Exception as e:
-        print(f"[인사이트 생성 오류] {e}")
+        logs.error("[인사이트 생성 오류] %s", e)
+        report_db_error(e)
         raise https_fn.HttpsError("internal", f"Insights generation failed: {str(e)}")
     
 # ========================================
@@ -901,6 +1431,7 @@ def generate_sleep_insights(req: https_fn.CallableRequest):
 # ========================================
 
 @https_fn.on_call()
+@instrumented("calculate_monthly_trends")
 def calculate_monthly_trends(req: https_fn.CallableRequest):
     """
     최근 30일 수면 패턴 및 트렌드 분석
@@ -924,28 +1455,18 @@ def calculate_monthly_trends(req: https_fn.CallableRequest):
     days = req.data.get("days", 30)
     start_date = datetime.now(timezone.utc) - timedelta(days=days)
     
-    print(f"[월간 트렌드 분석] user: {user_id}, days: {days}")
+    logs.info("[월간 트렌드 분석] user: %s, days: %s", user_id, days, user=user_id)
     
     try:
-        # 기간 내 리포트 조회
-        reports = db.collection("sleep_reports")\
-            .where("userId", "==", user_id)\
-            .where("created_at", ">=", start_date)\
-            .stream()
-        
-        report_list = []
-        for doc in reports:
-            data = doc.to_dict()
-            # created_at을 datetime으로 변환
-            created_at = data.get("created_at")
-            if hasattr(created_at, "to_datetime"):
-                created_at = created_at.to_datetime()
-            elif isinstance(created_at, str):
-                created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-            data["created_at_dt"] = created_at
-            report_list.append(data)
-        
-        if not report_list:
+        # 기간 내 리포트를 한 번만 훑으면서 1~4번 통계를 같이 누적 (롤업 우선)
+        agg = MonthlyTrendAggregator()
+        for data in _iter_reports_since(db, user_id, start_date):
+            created_at = to_utc(data.get("created_at"))
+            summary = data["summary"]
+            agg.add(data["total_score"], summary["total_duration_hours"],
+                    summary["deep_ratio"], summary["rem_ratio"], created_at)
+        
+        if not agg.count:
             return {
                 "user_id": user_id,
                 "period_days": days,
@@ -953,83 +1474,11 @@ def calculate_monthly_trends(req: https_fn.CallableRequest):
                 "message": "데이터가 없습니다"
             }
         
-        # 1. 전체 평균
-        total_scores = [r["total_score"] for r in report_list]
-        sleep_hours = [r["summary"]["total_duration_hours"] for r in report_list]
-        deep_ratios = [r["summary"]["deep_ratio"] for r in report_list]
-        rem_ratios = [r["summary"]["rem_ratio"] for r in report_list]
-        
-        overall_avg = {
-            "score": round(sum(total_scores) / len(total_scores), 1),
-            "sleep_hours": round(sum(sleep_hours) / len(sleep_hours), 2),
-            "deep_ratio": round(sum(deep_ratios) / len(deep_ratios), 1),
-            "rem_ratio": round(sum(rem_ratios) / len(rem_ratios), 1)
-        }
-        
-        # 2. 주중/주말 비교
-        weekday_reports = []
-        weekend_reports = []
-        
-        for report in report_list:
-            dt = report["created_at_dt"]
-            if dt.weekday() < 5:  # 0=월, 4=금
-                weekday_reports.append(report)
-            else:  # 5=토, 6=일
-                weekend_reports.append(report)
-        
-        weekday_vs_weekend = {}
-        
-        if weekday_reports:
-            weekday_scores = [r["total_score"] for r in weekday_reports]
-            weekday_hours = [r["summary"]["total_duration_hours"] for r in weekday_reports]
-            weekday_vs_weekend["weekday"] = {
-                "count": len(weekday_reports),
-                "avg_score": round(sum(weekday_scores) / len(weekday_scores), 1),
-                "avg_hours": round(sum(weekday_hours) / len(weekday_hours), 2)
-            }
-        
-        if weekend_reports:
-            weekend_scores = [r["total_score"] for r in weekend_reports]
-            weekend_hours = [r["summary"]["total_duration_hours"] for r in weekend_reports]
-            weekday_vs_weekend["weekend"] = {
-                "count": len(weekend_reports),
-                "avg_score": round(sum(weekend_scores) / len(weekend_scores), 1),
-                "avg_hours": round(sum(weekend_hours) / len(weekend_hours), 2)
-            }
-        
-        # 3. 요일별 분석
-        weekday_names = ["월요일", "화요일", "수요일", "목요일", "금요일", "토요일", "일요일"]
-        by_weekday = {}
-        
-        for i in range(7):
-            day_reports = [r for r in report_list if r["created_at_dt"].weekday() == i]
-            if day_reports:
-                day_scores = [r["total_score"] for r in day_reports]
-                day_hours = [r["summary"]["total_duration_hours"] for r in day_reports]
-                by_weekday[weekday_names[i]] = {
-                    "count": len(day_reports),
-                    "avg_score": round(sum(day_scores) / len(day_scores), 1),
-                    "avg_hours": round(sum(day_hours) / len(day_hours), 2)
-                }
-        
-        # 4. 주별 트렌드 (최근 4주)
-        weekly_trends = []
-        for week in range(4):
-            week_start = datetime.now(timezone.utc) - timedelta(days=(week+1)*7)
-            week_end = datetime.now(timezone.utc) - timedelta(days=week*7)
-            
-            week_reports = [
-                r for r in report_list 
-                if week_start <= r["created_at_dt"] < week_end
-            ]
-            
-            if week_reports:
-                week_scores = [r["total_score"] for r in week_reports]
-                weekly_trends.insert(0, {
-                    "week": f"{week+1}주 전",
-                    "avg_score": round(sum(week_scores) / len(week_scores), 1),
-                    "count": len(week_reports)
-                })
+        # 1. 전체 평균 / 2. 주중/주말 비교 / 3. 요일별 분석 / 4. 주별 트렌드 (최근 4주)
+        overall_avg = agg.overall_average()
+        weekday_vs_weekend = agg.weekday_vs_weekend()
+        by_weekday = agg.by_weekday()
+        weekly_trends = agg.weekly_trends()
         
         # 5. 개선 추세 계산
         if len(weekly_trends) >= 2:
@@ -1093,7 +1542,7 @@ def calculate_monthly_trends(req: https_fn.CallableRequest):
         result = {
             "user_id": user_id,
             "period_days": days,
-            "report_count": len(report_list),
+            "report_count": agg.count,
             "date_range": {
                 "start": start_date.isoformat(),
                 "end": datetime.now(timezone.utc).isoformat()
@@ -1109,12 +1558,13 @@ def calculate_monthly_trends(req: https_fn.CallableRequest):
             "insights": insights
         }
         
-        print(f"[월간 트렌드 완료] {len(report_list)}개 리포트, 평균: {overall_avg['score']:.1f}점")
+        logs.info("[월간 트렌드 완료] %d개 리포트, 평균: %.1f점", agg.count, overall_avg["score"], user=user_id)
         
         return result
         
     except Exception as e:
-        print(f"[월간 트렌드 오류] {e}")
+        logs.error("[월간 트렌드 오류] %s", e, user=user_id)
+        report_db_error(e)
         raise https_fn.HttpsError("internal", f"Trends calculation failed: {str(e)}")
 
 
@@ -1122,7 +1572,29 @@ def calculate_monthly_trends(req: https_fn.CallableRequest):
 # ✨ Phase 5: 자동 리포트 생성
 # ========================================
 
+def _generate_report(db: gcf.Client, user_id: str, session_id: str) -> tuple[dict, dict] | None:
+    """
+    점수 → 인사이트 → 저장 + 알림 (auto_generate_report / 리포트 작업 큐 공용)
+    반환: (리포트, 인사이트), 데이터가 없으면 None
+    """
+    totals = _load_sleep_totals(get_repo(), user_id, session_id)
+    if totals is None:
+        return None
+    score_result, notify = _build_sleep_report(user_id, session_id, totals)
+    
+    # 방금 만든 리포트를 그대로 넘김 - 다시 읽지 않음
+    insights_result = _build_sleep_insights(session_id, score_result)
+    
+    # 리포트 + 롤업 + 인사이트를 한 커밋으로, 커밋 후 알림 3종 발송
+    insights_ref = db.collection("sleep_insights").document(session_id)
+    _write_and_notify(get_repo(), user_id, notify, lambda: write_report_with_rollup(
+        db, session_id, score_result, extra_sets=[(insights_ref, insights_result)]
+    ))
+    return score_result, insights_result
+
+
 @https_fn.on_call()
+@instrumented("auto_generate_report")
 def auto_generate_report(req: https_fn.CallableRequest):
     """
     세션 종료 시 자동으로 리포트 생성
@@ -1143,14 +1615,15 @@ def auto_generate_report(req: https_fn.CallableRequest):
     if not user_id or not session_id:
         raise https_fn.HttpsError("invalid-argument", "user_id and session_id are required")
     
-    print(f"[자동 리포트 생성] user: {user_id}, session: {session_id}")
+    tag_session(f"{user_id}__{session_id}")
+    logs.info("[자동 리포트 생성] user: %s, session: %s", user_id, session_id, user=user_id)
     
     try:
-        # 1. 수면 점수 계산
-        score_result = calculate_sleep_score.call({"data": {"session_id": session_id}})
-        
-        # 2. 인사이트 생성
-        insights_result = generate_sleep_insights.call({"data": {"session_id": session_id}})
+        # 1. 수면 점수 계산 → 2. 인사이트 생성
+        generated = _generate_report(db, user_id, session_id)
+        if generated is None:
+            raise https_fn.HttpsError("not-found", f"No data for session: {session_id}")
+        score_result, insights_result = generated
         
         # 3. 통합 결과
         result = {
@@ -1162,68 +1635,254 @@ def auto_generate_report(req: https_fn.CallableRequest):
             "auto_generated": True
         }
         
-        print(f"[자동 리포트 완료] session: {session_id}, score: {score_result.get('total_score')}")
+        logs.info("[자동 리포트 완료] session: %s, score: %s", session_id, score_result.get("total_score"), user=user_id)
         
         return result
         
+    except https_fn.HttpsError:
+        raise
     except Exception as e:
-        print(f"[자동 리포트 오류] {e}")
+        logs.error("[자동 리포트 오류] %s", e, user=user_id)
+        report_db_error(e)
         raise https_fn.HttpsError("internal", f"Auto report generation failed: {str(e)}")
 
 
 # ========================================
-# ✨ Phase 5: 세션 종료 감지 (트리거)
+# ✨ Phase 5: 세션 종료 감지 (트리거 + 스윕)
 # ========================================
 
+SESSION_END_IDLE_SEC = 30 * 60       # 30분 이상 Awake 유지 또는 30분 이상 데이터 없음 → 종료로 간주
+SESSION_SWEEP_PAGE_SIZE = 200
+SESSION_SWEEP_MAX_PAGES = 25
+
+def _queue_session_report(db: gcf.Client, batch: gcf.WriteBatch, state_ref: gcf.DocumentReference, data: dict, now: datetime) -> bool | None:
+    """
+    리포트 작업 등록 + session_state 에 report_queued 표시 (표시는 batch 로 모아서 커밋)
+    반환: 새로 등록했으면 True, 이미 있으면 False, userId/sessionId 가 없어서 batch 에 넣지 않았으면 None
+    """
+    user_id, session_id = data.get("userId"), data.get("sessionId")
+    if not user_id or not session_id:
+        return None
+    queued = enqueue_report_job(FirestoreJobStore(db), user_id, session_id, now)
+    batch.update(state_ref, {"report_queued": True, "report_queued_at": now})
+    return queued
+
 @firestore_fn.on_document_updated(document="session_state/{stateId}", region="asia-northeast3")
+@instrumented("on_session_end")
 def on_session_end(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]):
     """
-    세션 상태 변경 감지 → 종료 시 자동 리포트 생성
+    세션 상태 변경 감지 → 종료 시 자동 리포트 작업 등록
+    샘플/하트비트마다 불리므로 이벤트 데이터만 보고 바로 끝냄 (Firestore 읽기 없음)
+    마지막 샘플 이후로는 업데이트가 없어서 여기서 못 잡는 종료는 sweep_ended_sessions 가 잡음
     """
-    db = get_db()
-    
-    if event.data is None:
+    if event.data is None or event.data.after is None:
         return
     
-    before = event.data.before
-    after = event.data.after
+    after_data = event.data.after.to_dict() or {}
     
-    if before is None or after is None:
+    # 이미 등록했거나 Awake 가 아니면 끝
+    if after_data.get("report_queued") or after_data.get("stage") != "Awake":
         return
     
-    before_data = before.to_dict() or {}
-    after_data = after.to_dict() or {}
-    
-    # 세션이 활성 → 종료로 변경되었는지 확인
-    # (예: stage가 "Awake"가 30분 이상 지속되면 종료로 간주)
+    # 30분 이상 Awake 상태면 세션 종료로 간주
+    last_change = to_utc(after_data.get("last_change_ts"))
+    now = now_utc()
+    if not last_change or (now - last_change).total_seconds() <= SESSION_END_IDLE_SEC:
+        return
     
-    before_stage = before_data.get("stage")
-    after_stage = after_data.get("stage")
+    logs.info("[세션 종료 감지] user: %s, session: %s", after_data.get("userId"), after_data.get("sessionId"), user=after_data.get("userId"))
+    try:
+        db = get_db()
+        batch = db.batch()
+        queued = _queue_session_report(db, batch, event.data.after.reference, after_data, now)
+        commit_batch(batch, int(queued is not None))
+        logs.info("[자동 리포트 트리거] session: %s, queued: %s", after_data.get("sessionId"), queued, user=after_data.get("userId"))
+    except Exception as e:
+        logs.error("[자동 리포트 트리거 오류] %s", e, user=after_data.get("userId"))
+        report_db_error(e)
+
+
+@scheduler_fn.on_schedule(schedule="*/5 * * * *", region="asia-northeast3", max_instances=1)
+@instrumented("sweep_ended_sessions")
+def sweep_ended_sessions(event: scheduler_fn.ScheduledEvent):
+    """
+    아직 리포트 작업이 없는 세션 중
+      - 30분 넘게 업데이트가 없거나 (기기가 업로드를 멈춤)
+      - 30분 넘게 Awake 인 것
+    을 색인 조회로 페이지 단위로 찾아서 리포트 작업 등록
+    report_queued 필드가 없는 옛 문서는 조회에 안 잡힘 - 배포 후 1번 backfill.py report_queued 로 채움
+    """
+    db = get_db()
+    now = now_utc()
+    cutoff = now - timedelta(seconds=SESSION_END_IDLE_SEC)
+    states = db.collection("session_state").where("report_queued", "==", False)
+    queries = {
+        "idle": states.where("updated_at", "<=", cutoff).order_by("updated_at"),
+        "awake": states.where("stage", "==", "Awake").where("last_change_ts", "<=", cutoff).order_by("last_change_ts"),
+    }
+    stats = {"pages": 0, "sessions": 0, "queued": 0}
     
-    # 예시: Awake 상태로 변경되고 충분한 시간이 지났다면
-    if after_stage == "Awake":
-        last_change = after_data.get("last_change_ts")
-        if hasattr(last_change, "to_datetime"):
-            last_change = last_change.to_datetime()
-        
-        now = now_utc()
-        
-        # 30분 이상 Awake 상태면 세션 종료로 간주
-        if last_change and (now - last_change).total_seconds() > 1800:  # 30분
-            user_id = after_data.get("userId")
-            session_id = after_data.get("sessionId")
-            
-            # 이미 리포트가 생성되었는지 확인
-            report_exists = db.collection("sleep_reports").document(session_id).get().exists
-            
-            if not report_exists:
-                print(f"[세션 종료 감지] user: {user_id}, session: {session_id}")
+    try:
+        for name, query in queries.items():
+            cursor = None
+            for _ in range(SESSION_SWEEP_MAX_PAGES):
+                page_query = query.limit(SESSION_SWEEP_PAGE_SIZE)
+                if cursor is not None:
+                    page_query = page_query.start_after(cursor)
+                page = stream_query(page_query)
+                if not page:
+                    break
+                cursor = page[-1]
                 
-                try:
-                    # 자동 리포트 생성 (내부 호출)
-                    # 실제로는 Cloud Tasks로 비동기 처리하는 게 좋음
-                    print(f"[자동 리포트 트리거] session: {session_id}")
-                    # 여기서는 로그만 남기고, 실제 생성은 프론트엔드가 호출하도록
-                    
-                except Exception as e:
-                    print(f"[자동 리포트 트리거 오류] {e}")
\ No newline at end of file
+                batch, marked = db.batch(), 0
+                for doc in page:
+                    queued = _queue_session_report(db, batch, doc.reference, doc.to_dict() or {}, now)
+                    if queued is None: continue
+                    marked += 1
+                    stats["queued"] += queued
+                commit_batch(batch, marked)
+                stats["pages"] += 1
+                stats["sessions"] += len(page)
+                if len(page) < SESSION_SWEEP_PAGE_SIZE:
+                    break
+        if stats["sessions"]:
+            logs.info("[세션 종료 스윕] %s", stats)
+    except Exception as e:
+        logs.error("❌ [세션 종료 스윕 오류] %s %s", e, stats)
+        report_db_error(e)
+
+
+# ========================================
+# ⏳ 만료된 명령 정리 (ttlSec)
+# ========================================
+COMMAND_MIN_TTL_SEC = 20             # command_policy 의 가장 짧은 ttlSec - 이보다 어린 명령은 조회하지 않음
+COMMAND_SWEEP_PAGE_SIZE = 300        # 페이지 1개 = WriteBatch 1개 (한도 500)
+COMMAND_SWEEP_MAX_PAGES = 20         # 한 번에 최대 6,000건 - 남으면 다음 실행에서 이어서
+COMMAND_SWEEP_MODE = os.environ.get("COMMAND_SWEEP_MODE", "expire")  # "expire"(status=EXPIRED 로 표시) | "delete"
+
+@scheduler_fn.on_schedule(schedule="*/5 * * * *", region="asia-northeast3", max_instances=1)
+@instrumented("sweep_expired_commands")
+def sweep_expired_commands(event: scheduler_fn.ScheduledEvent):
+    """
+    ts + ttlSec 가 지난 PENDING 명령을 (status, ts) 색인 조회로 페이지 단위로 찾아서
+    WriteBatch 로 EXPIRED 표시 (COMMAND_SWEEP_MODE=delete 면 삭제) - 명령 구독/조회가 보는 PENDING 집합을 작게 유지
+    """
+    db = get_db()
+    now = now_utc()
+    started = time.perf_counter()
+    query = db.collection("commands")\
+        .where("status", "==", "PENDING")\
+        .where("ts", "<=", now - timedelta(seconds=COMMAND_MIN_TTL_SEC))\
+        .order_by("ts")
+    stats = {"mode": COMMAND_SWEEP_MODE, "pages": 0, "scanned": 0, "swept": 0, "more": False}
+
+    try:
+        cursor = None
+        for _ in range(COMMAND_SWEEP_MAX_PAGES):
+            page_query = query.limit(COMMAND_SWEEP_PAGE_SIZE)
+            if cursor is not None:
+                page_query = page_query.start_after(cursor)
+            page = stream_query(page_query)
+            if not page:
+                break
+            cursor = page[-1]
+
+            batch, swept = db.batch(), 0
+            for doc in page:
+                data = doc.to_dict() or {}
+                ts = to_utc(data.get("ts"))
+                ttl = float(data.get("ttlSec") or COMMAND_MIN_TTL_SEC)
+                if ts is not None and (now - ts).total_seconds() < ttl:
+                    continue  # 아직 유효 (ttlSec 가 더 긴 명령)
+                if COMMAND_SWEEP_MODE == "delete":
+                    batch.delete(doc.reference)
+                else:
+                    batch.update(doc.reference, {"status": "EXPIRED", "expiredTs": gcf.SERVER_TIMESTAMP})
+                swept += 1
+            if swept:
+                commit_batch(batch, swept)
+            stats["pages"] += 1
+            stats["scanned"] += len(page)
+            stats["swept"] += swept
+            if len(page) < COMMAND_SWEEP_PAGE_SIZE:
+                break
+        else:
+            stats["more"] = True  # 페이지 한도에 걸림 - 다음 실행에서 이어서
+        stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logs.info("[만료 명령 정리] %s", stats, sweep=stats)
+    except Exception as e:
+        stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logs.error("❌ [만료 명령 정리 오류] %s %s", e, stats, sweep=stats)
+        report_db_error(e)
+
+
+# ========================================
+# 👤 사용자 문서 변경 → 프로필 캐시 무효화
+# ========================================
+
+@firestore_fn.on_document_written(document="users/{userId}", region="asia-northeast3")
+@instrumented("on_user_written")
+def on_user_written(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]):
+    """
+    FCM 토큰/알림 설정이 바뀌면 이 인스턴스의 캐시를 비움 (다른 인스턴스는 TTL 로 갱신)
+    취침 알림 버킷 색인(bedtime_buckets)도 같이 갱신
+    """
+    user_id = event.params["userId"]
+    invalidate_user_profile(user_id)
+
+    if event.data is None:
+        return
+    before = event.data.before.to_dict() if event.data.before is not None and event.data.before.exists else None
+    after = event.data.after.to_dict() if event.data.after is not None and event.data.after.exists else None
+    try:
+        update_bedtime_index(get_db(), user_id, before, after)
+    except Exception as e:
+        logs.error("[취침 알림 색인 오류] user: %s, %s", user_id, e, user=user_id)
+        report_db_error(e)
+
+
+# ========================================
+# 🌙 취침 알림 스케줄러 (5분마다, 해당 버킷만 발송)
+# ========================================
+
+@scheduler_fn.on_schedule(schedule="*/5 * * * *", timezone=scheduler_fn.Timezone(BEDTIME_TIMEZONE), region="asia-northeast3")
+@instrumented("send_bedtime_reminders")
+def send_bedtime_reminders(event: scheduler_fn.ScheduledEvent):
+    slot = current_bedtime_slot(event.schedule_time or now_utc())
+    t0 = time.perf_counter()
+    try:
+        stats = fan_out_bedtime_reminders(get_db(), slot)
+    except Exception as e:
+        logs.error("❌ [취침 알림 발송 오류] slot: %s, %s", slot, e)
+        report_db_error(e)
+        return
+    logs.info("[취침 알림 발송] %s %.1fs", stats, time.perf_counter() - t0)
+
+
+# ========================================
+# 📝 리포트 작업 큐 워커 (스케줄러)
+# ========================================
+
+@scheduler_fn.on_schedule(schedule="* * * * *", region="asia-northeast3", max_instances=1, timeout_sec=540)
+@instrumented("process_report_jobs")
+def process_report_jobs(event: scheduler_fn.ScheduledEvent):
+    """
+    report_jobs 에서 실행할 차례인 작업을 리스 잡고 리포트 생성 (동시 REPORT_JOB_CONCURRENCY 개)
+    실패하면 백오프 + 지터로 다시 PENDING, REPORT_JOB_MAX_ATTEMPTS 번째 실패면 FAILED
+    """
+    db = get_db()
+
+    def _handle(job: dict):
+        # 앱이 먼저 calculate_sleep_score 를 불렀으면 다시 만들지 않음 (알림 중복 방지)
+        if get_repo().get_report(job["sessionId"]) is not None:
+            return
+        if _generate_report(db, job["userId"], job["sessionId"]) is None:
+            logs.info("[리포트 작업] 데이터 없음 → 완료 처리, session: %s", job["sessionId"], user=job["userId"])
+
+    try:
+        stats = run_report_jobs(FirestoreJobStore(db), _handle, owner=INSTANCE_ID, now=now_utc(), clock=now_utc)
+        if stats["due"]:
+            logs.info("[리포트 작업 처리] %s", stats)
+    except Exception as e:
+        logs.error("❌ [리포트 작업 큐 오류] %s", e)
+        report_db_error(e)
@@ -1,19 +1,62 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+
 from firebase_admin import messaging
 from google.cloud import firestore as gcf
 
-def get_user_fcm_token(db: gcf.Client, user_id: str) -> str | None:
+import logs
+from opstats import commit as commit_batch, stream as stream_query
+from storage import Repository
+
+# ========================================
+# 👤 사용자 프로필 캐시 (users/{uid})
+# ========================================
+# 리포트 1건에 알림 3종 × (설정 + 토큰) = 같은 문서 6번 읽기 → 인스턴스당 1번으로
+# users 문서가 바뀌면 on_user_written 트리거가 invalidate_user_profile() 호출,
+# 다른 인스턴스에 남은 값은 TTL 이 지나면 다시 읽음
+PROFILE_CACHE_TTL_SEC = 300
+PROFILE_CACHE_MAX_ENTRIES = 2048
+
+_profile_cache: OrderedDict[str, tuple[float, dict | None]] = OrderedDict()
+_profile_lock = threading.Lock()
+
+def get_user_profile(repo: Repository, user_id: str) -> dict | None:
+    """users/{uid} 문서 (없으면 None) - TTL/LRU 캐시 경유, 읽기는 repo.get_user"""
+    now = time.monotonic()
+    with _profile_lock:
+        hit = _profile_cache.get(user_id)
+        if hit is not None and now - hit[0] < PROFILE_CACHE_TTL_SEC:
+            _profile_cache.move_to_end(user_id)
+            return hit[1]
+
+    profile = repo.get_user(user_id)
+
+    with _profile_lock:
+        _profile_cache[user_id] = (now, profile)
+        _profile_cache.move_to_end(user_id)
+        while len(_profile_cache) > PROFILE_CACHE_MAX_ENTRIES:
+            _profile_cache.popitem(last=False)
+    return profile
+
+def invalidate_user_profile(user_id: str):
+    with _profile_lock:
+        _profile_cache.pop(user_id, None)
+
+def get_user_fcm_token(repo: Repository, user_id: str) -> str | None:
     """사용자 FCM 토큰 가져오기"""
-    user_doc = db.collection("users").document(user_id).get()
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
+    user_data = get_user_profile(repo, user_id)
+    if user_data is not None:
         return user_data.get("fcmToken")
     return None
 
-def get_notification_settings(db: gcf.Client, user_id: str) -> dict:
+def get_notification_settings(repo: Repository, user_id: str) -> dict:
     """사용자 알림 설정 가져오기"""
-    user_doc = db.collection("users").document(user_id).get()
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
+    user_data = get_user_profile(repo, user_id)
+    if user_data is not None:
         return user_data.get("notificationSettings", {
             "sleepReport": True,
             "sleepScore": True,
@@ -22,6 +65,28 @@ def get_notification_settings(db: gcf.Client, user_id: str) -> dict:
         })
     return {}
 
+def _android_config() -> messaging.AndroidConfig:
+    # Android 설정
+    return messaging.AndroidConfig(
+        priority='high',
+        notification=messaging.AndroidNotification(
+            channel_id='sleep_channel',  # Flutter 설정과 동일해야 함!
+            sound='default',
+            color='#1E3A8A',  # AppColors.primaryNavy
+        ),
+    )
+
+def _apns_config() -> messaging.APNSConfig:
+    # iOS 설정
+    return messaging.APNSConfig(
+        payload=messaging.APNSPayload(
+            aps=messaging.Aps(
+                sound='default',
+                badge=1,
+            ),
+        ),
+    )
+
 def send_push_notification(
     user_fcm_token: str, 
     title: str, 
@@ -42,46 +107,30 @@ def send_push_notification(
         notification=notification,
         data=data or {},  # 추가 데이터 (화면 이동용)
         token=user_fcm_token,
-        # Android 설정
-        android=messaging.AndroidConfig(
-            priority='high',
-            notification=messaging.AndroidNotification(
-                channel_id='sleep_channel',  # Flutter 설정과 동일해야 함!
-                sound='default',
-                color='#1E3A8A',  # AppColors.primaryNavy
-            ),
-        ),
-        # iOS 설정
-        apns=messaging.APNSConfig(
-            payload=messaging.APNSPayload(
-                aps=messaging.Aps(
-                    sound='default',
-                    badge=1,
-                ),
-            ),
-        ),
+        android=_android_config(),
+        apns=_apns_config(),
     )
     
     try:
         response = messaging.send(message)
-        print(f"✅ [푸시 알림 성공] response: {response}")
+        logs.info("✅ [푸시 알림 성공] response: %s", response)
         return True
     except Exception as e:
-        print(f"❌ [푸시 알림 실패] {e}")
+        logs.error("❌ [푸시 알림 실패] %s", e)
         return False
 
 # ========================================
 # ✨ 알림 타입별 함수들
 # ========================================
 
-def send_sleep_report_notification(db: gcf.Client, user_id: str, score: int, message: str):
+def send_sleep_report_notification(repo: Repository, user_id: str, score: int, message: str):
     """1. 수면 리포트 알림"""
-    settings = get_notification_settings(db, user_id)
+    settings = get_notification_settings(repo, user_id)
     if not settings.get("sleepReport", True):
-        print(f"[알림 스킵] {user_id}는 수면 리포트 알림 OFF")
+        logs.debug("[알림 스킵] %s는 수면 리포트 알림 OFF", user_id, user=user_id)
         return
     
-    token = get_user_fcm_token(db, user_id)
+    token = get_user_fcm_token(repo, user_id)
     if token:
         send_push_notification(
             user_fcm_token=token,
@@ -94,14 +143,14 @@ def send_sleep_report_notification(db: gcf.Client, user_id: str, score: int, mes
             }
         )
 
-def send_sleep_efficiency_notification(db: gcf.Client, user_id: str, efficiency: float):
+def send_sleep_efficiency_notification(repo: Repository, user_id: str, efficiency: float):
     """2. 수면 효율 알림 (낮을 때만)"""
-    settings = get_notification_settings(db, user_id)
+    settings = get_notification_settings(repo, user_id)
     if not settings.get("sleepScore", True):
         return
     
     if efficiency < 75:  # 효율이 75% 미만일 때만
-        token = get_user_fcm_token(db, user_id)
+        token = get_user_fcm_token(repo, user_id)
         if token:
             send_push_notification(
                 user_fcm_token=token,
@@ -110,14 +159,14 @@ def send_sleep_efficiency_notification(db: gcf.Client, user_id: str, efficiency:
                 data={"type": "sleep_efficiency"}
             )
 
-def send_snoring_notification(db: gcf.Client, user_id: str, duration_min: float):
+def send_snoring_notification(repo: Repository, user_id: str, duration_min: float):
     """3. 코골이 심할 때 알림"""
-    settings = get_notification_settings(db, user_id)
+    settings = get_notification_settings(repo, user_id)
     if not settings.get("snoring", True):
         return
     
     if duration_min > 30:  # 30분 이상 코골이
-        token = get_user_fcm_token(db, user_id)
+        token = get_user_fcm_token(repo, user_id)
         if token:
             send_push_notification(
                 user_fcm_token=token,
@@ -126,17 +175,213 @@ def send_snoring_notification(db: gcf.Client, user_id: str, duration_min: float)
                 data={"type": "snoring"}
             )
 
-def send_bedtime_reminder(db: gcf.Client, user_id: str):
+def send_bedtime_reminder(repo: Repository, user_id: str):
     """4. 수면 가이드 알림 (취침 1시간 전)"""
-    settings = get_notification_settings(db, user_id)
+    settings = get_notification_settings(repo, user_id)
     if not settings.get("guide", True):
         return
     
-    token = get_user_fcm_token(db, user_id)
+    token = get_user_fcm_token(repo, user_id)
     if token:
         send_push_notification(
             user_fcm_token=token,
             title="🌙 수면 가이드",
             body="1시간 후 취침 시간이에요. 준비하세요!",
             data={"type": "guide"}
-        )
\ No newline at end of file
+        )
+
+def send_report_notifications(repo: Repository, user_id: str, score: int, message: str, efficiency: float, snoring_min: float):
+    """리포트 완성 시 알림 3종 (리포트 / 수면 효율 / 코골이)"""
+    send_sleep_report_notification(repo=repo, user_id=user_id, score=score, message=message)
+    send_sleep_efficiency_notification(repo=repo, user_id=user_id, efficiency=efficiency)
+    send_snoring_notification(repo=repo, user_id=user_id, duration_min=snoring_min)
+
+# ========================================
+# 🌙 취침 알림 대량 발송 (스케줄러용)
+# ========================================
+# users/{uid}.bedtime ("HH:MM", BEDTIME_TIMEZONE 기준) 이 있으면 알림 시각(취침 1시간 전)을
+# 5분 단위 버킷으로 묶어 bedtime_buckets/{HHMM}/members/{uid} 에 토큰과 함께 색인해 둠
+# → 스케줄러는 사용자 문서를 읽지 않고 버킷만 페이지 단위로 읽어서 500개씩 멀티캐스트
+# ⚠️ 지금 앱(lib/)은 users/{uid}.bedtime 을 쓰지 않음 (프로필 화면의 취침 시각은 기기에만 있음)
+#    → 앱이 bedtime 을 저장하기 전까지 버킷은 비어 있고 스케줄러는 빈 페이지 1번만 읽고 끝남
+#    기존 사용자 문서는 on_user_written 이 다시 불리기 전까지 색인되지 않으므로 배포 후 1번
+#    backfill.py bedtime 으로 채워 둠
+BEDTIME_TIMEZONE = "Asia/Seoul"
+BEDTIME_REMINDER_LEAD_MIN = 60
+BEDTIME_SLOT_MIN = 5
+MULTICAST_MAX_TOKENS = 500          # FCM 멀티캐스트 1회 한도
+FANOUT_MAX_CONCURRENCY = 8
+FANOUT_MAX_ATTEMPTS = 3
+FANOUT_BACKOFF_BASE_SEC = 0.5
+
+def bedtime_slot(bedtime: str | None) -> str | None:
+    """취침 시각 "HH:MM" → 알림 버킷 ID "HHMM" (형식이 틀리면 None)"""
+    try:
+        hh, mm = (int(x) for x in str(bedtime).split(":")[:2])
+        if not (0 <= hh < 24 and 0 <= mm < 60): return None
+    except (TypeError, ValueError):
+        return None
+    minute = (hh * 60 + mm - BEDTIME_REMINDER_LEAD_MIN) % (24 * 60)
+    minute -= minute % BEDTIME_SLOT_MIN
+    return f"{minute // 60:02d}{minute % 60:02d}"
+
+def current_bedtime_slot(now) -> str:
+    """스케줄러 실행 시각(datetime, tz 포함) → 지금 보내야 할 버킷 ID"""
+    local = now.astimezone(ZoneInfo(BEDTIME_TIMEZONE))
+    minute = local.hour * 60 + local.minute
+    minute -= minute % BEDTIME_SLOT_MIN
+    return f"{minute // 60:02d}{minute % 60:02d}"
+
+def _bedtime_member(profile: dict | None) -> tuple[str | None, dict | None]:
+    """프로필 → (버킷 ID, 멤버 문서) - 알림 대상이 아니면 (None, None)"""
+    if not profile: return None, None
+    slot = bedtime_slot(profile.get("bedtime"))
+    token = profile.get("fcmToken")
+    settings = profile.get("notificationSettings") or {}
+    if slot is None or not token or not settings.get("guide", True):
+        return None, None
+    return slot, {"fcmToken": token}
+
+def update_bedtime_index(db: gcf.Client, user_id: str, before: dict | None, after: dict | None):
+    """users 문서 변경 시 버킷 색인 갱신 (바뀐 게 없으면 쓰기 없음)"""
+    old_slot, old_member = _bedtime_member(before)
+    new_slot, new_member = _bedtime_member(after)
+    if (old_slot, old_member) == (new_slot, new_member):
+        return
+
+    batch, writes = db.batch(), 0
+    if old_slot and old_slot != new_slot:
+        batch.delete(db.collection("bedtime_buckets").document(old_slot).collection("members").document(user_id))
+        writes += 1
+    if new_slot:
+        batch.set(db.collection("bedtime_buckets").document(new_slot).collection("members").document(user_id), new_member)
+        writes += 1
+    commit_batch(batch, writes)
+
+def backfill_bedtime_index(db: gcf.Client, page_size: int = MULTICAST_MAX_TOKENS) -> dict:
+    """
+    users 전체를 문서 ID 커서로 훑어서 알림 대상만 버킷에 색인 (여러 번 돌려도 결과 같음)
+    기존 멤버 문서는 덮어쓰기만 하고 지우지 않음 - 대상에서 빠진 사용자는 on_user_written 이 정리
+    """
+    users_ref = db.collection("users")
+    stats = {"users": 0, "indexed": 0}
+    cursor = None
+    while True:
+        query = users_ref.order_by("__name__").limit(page_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        page = stream_query(query)
+        if not page:
+            break
+        cursor = page[-1]
+
+        batch, pending = db.batch(), 0
+        for doc in page:
+            slot, member = _bedtime_member(doc.to_dict())
+            if slot is None:
+                continue
+            batch.set(db.collection("bedtime_buckets").document(slot).collection("members").document(doc.id), member)
+            pending += 1
+        if pending:
+            commit_batch(batch, pending)
+        stats["users"] += len(page)
+        stats["indexed"] += pending
+        if len(page) < page_size:
+            break
+    return stats
+
+def _bedtime_multicast(tokens: list[str]) -> messaging.MulticastMessage:
+    return messaging.MulticastMessage(
+        tokens=tokens,
+        notification=messaging.Notification(
+            title="🌙 수면 가이드",
+            body="1시간 후 취침 시간이에요. 준비하세요!",
+        ),
+        data={"type": "guide"},
+        android=_android_config(),
+        apns=_apns_config(),
+    )
+
+def _send_multicast_with_retry(tokens: list[str]) -> tuple[int, list[str]]:
+    """
+    500개 이하 토큰을 한 번에 발송, 일시 오류는 지수 백오프로 재시도
+    반환: (성공 수, 더 이상 유효하지 않은 토큰 목록)
+    """
+    pending = list(tokens)
+    success, unregistered = 0, []
+    for attempt in range(FANOUT_MAX_ATTEMPTS):
+        try:
+            response = messaging.send_each_for_multicast(_bedtime_multicast(pending))
+        except Exception as e:
+            logs.warning("❌ [멀티캐스트 실패] attempt=%d tokens=%d %s", attempt + 1, len(pending), e)
+            if attempt + 1 < FANOUT_MAX_ATTEMPTS:
+                time.sleep(FANOUT_BACKOFF_BASE_SEC * (2 ** attempt))
+            continue
+
+        retry = []
+        for token, r in zip(pending, response.responses):
+            if r.success: success += 1
+            elif isinstance(r.exception, messaging.UnregisteredError): unregistered.append(token)
+            elif isinstance(r.exception, (messaging.UnavailableError, messaging.QuotaExceededError)): retry.append(token)
+        if not retry or attempt + 1 == FANOUT_MAX_ATTEMPTS:
+            break
+        pending = retry
+        time.sleep(FANOUT_BACKOFF_BASE_SEC * (2 ** attempt))
+    return success, unregistered
+
+def fan_out_bedtime_reminders(db: gcf.Client, slot: str) -> dict:
+    """
+    버킷 하나를 문서 ID 커서로 500명씩 읽으면서 멀티캐스트 (동시 발송은 최대 FANOUT_MAX_CONCURRENCY)
+    만료된 토큰의 멤버 문서는 정리
+    """
+    members_ref = db.collection("bedtime_buckets").document(slot).collection("members")
+    stats = {"slot": slot, "pages": 0, "members": 0, "sent": 0, "unregistered": 0}
+    token_owner: dict[str, str] = {}
+    gate = threading.BoundedSemaphore(FANOUT_MAX_CONCURRENCY)
+    futures = []
+
+    def _send(tokens: list[str]):
+        try:
+            return _send_multicast_with_retry(tokens)
+        finally:
+            gate.release()
+
+    with ThreadPoolExecutor(max_workers=FANOUT_MAX_CONCURRENCY) as pool:
+        cursor = None
+        while True:
+            query = members_ref.order_by("__name__").limit(MULTICAST_MAX_TOKENS)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            page = stream_query(query)
+            if not page:
+                break
+            cursor = page[-1]
+
+            tokens = []
+            for doc in page:
+                token = (doc.to_dict() or {}).get("fcmToken")
+                if token:
+                    tokens.append(token)
+                    token_owner[token] = doc.id
+            stats["pages"] += 1
+            stats["members"] += len(page)
+            if tokens:
+                gate.acquire()  # 발송 중인 페이지가 너무 많으면 다음 페이지 읽기를 잠시 멈춤
+                futures.append(pool.submit(contextvars.copy_context().run, _send, tokens))
+            if len(page) < MULTICAST_MAX_TOKENS:
+                break
+
+    stale = []
+    for f in futures:
+        sent, unregistered = f.result()
+        stats["sent"] += sent
+        stale.extend(unregistered)
+
+    for i in range(0, len(stale), MULTICAST_MAX_TOKENS):
+        batch = db.batch()
+        chunk = stale[i:i + MULTICAST_MAX_TOKENS]
+        for token in chunk:
+            batch.delete(members_ref.document(token_owner[token]))
+        commit_batch(batch, len(chunk))
+    stats["unregistered"] = len(stale)
+    return stats
@@ -0,0 +1,179 @@
+# opstats.py
+# ✅ [Firestore 비용 계측] 호출(invocation)마다 문서 읽기/쓰기, 트랜잭션(재시도 포함), 쿼리 결과 수, 연산 시간을 세서
+# 호출이 끝날 때 구조화 로그 1줄로 남기고, 세션별 누적 합계와 자주 닿는 문서(hot document)를 인스턴스 메모리에 유지
+#
+# 계측 위치: Firestore 를 부르는 쪽이 연산 1개가 끝날 때마다 record() 로 보고
+#   storage.FirestoreRepository / MemoryRepository : 수집/점수 경로의 모든 연산 (두 구현이 같은 숫자를 냄)
+#   rollups, main._iter_reports_since              : 리포트 쓰기 + 주간/월간 통계의 롤업/범위 조회
+#   report_jobs.FirestoreJobStore                  : 작업 등록/조회/리스/완료
+#   main 의 스케줄러/트리거, notifications 의 취침 알림 색인/발송 : 아래 stream() / commit() 경유
+# 클라이언트 내부(GAPIC 스텁)는 건드리지 않음 - get_db() 로 직접 부르는 새 경로도 record() 를 붙여야 셈에 들어감
+#
+# 세는 기준 (Firestore 과금 기준과 같게)
+#   reads        : 읽은 문서 수 (없는 문서도 1, 쿼리는 결과 0건이어도 1)
+#   writes       : 쓴 문서 수, commits : 커밋(배치/트랜잭션/단건 쓰기) 수
+#   transactions : 트랜잭션 수, tx_retries : 충돌로 fn 을 다시 부른 횟수, rollbacks : 예외로 끝난 트랜잭션
+#   queries / query_docs : 쿼리 수 / 결과 문서 수
+#   ops / op_ms  : record() 호출 수 / 연산에 걸린 시간 합 (쿼리는 결과를 다 받을 때까지)
+#
+# 호출 단위는 contextvars 로 추적 - ThreadPoolExecutor 로 넘길 때는 contextvars.copy_context().run 으로 감싸야
+# 워커 스레드의 연산도 같은 호출로 집계됨
+
+import contextvars
+import functools
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import logs
+
+OPSTATS_SESSION_MAX_ENTRIES = 10_000
+OPSTATS_HOT_DOC_MAX_ENTRIES = 50_000
+OPSTATS_HOT_DOCS_PER_RECORD = 3
+
+_COUNTERS = ("reads", "writes", "commits", "transactions", "tx_retries", "rollbacks", "queries", "query_docs", "ops")
+
+
+class Invocation:
+    """함수 호출 1회의 Firestore 사용량 (여러 스레드에서 더할 수 있음)"""
+    __slots__ = ("name", "session", "started", "counts", "op_ms", "docs")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.session: str | None = None
+        self.started = time.perf_counter()
+        self.counts: dict[str, int] | None = None  # 첫 연산 때 생성 (연산 없는 호출은 할당 없이 끝남)
+        self.op_ms = 0.0
+        self.docs: Counter[str] | None = None
+
+    def add(self, op_ms: float = 0.0, docs=(), **counts) -> None:
+        with _lock:
+            if self.counts is None:
+                self.counts, self.docs = dict.fromkeys(_COUNTERS, 0), Counter()
+            self.counts["ops"] += 1
+            self.op_ms += op_ms
+            for k, v in counts.items():
+                self.counts[k] += v
+            self.docs.update(docs)
+
+
+_current: contextvars.ContextVar[Invocation | None] = contextvars.ContextVar("opstats_invocation", default=None)
+
+_lock = threading.Lock()
+_session_totals: OrderedDict[str, dict] = OrderedDict()
+_hot_docs: Counter[str] = Counter()
+
+
+def current() -> Invocation | None:
+    return _current.get()
+
+
+def tag_session(session_key: str | None) -> None:
+    """지금 호출의 비용을 이 세션에 합산 (user__session 형식 권장)"""
+    inv = _current.get()
+    if inv is not None and session_key:
+        inv.session = session_key
+
+
+def instrumented(name: str, *, emit_empty: bool = False):
+    """
+    함수 호출 1회를 계측 단위로 - 끝날 때 요약 1줄 출력
+    emit_empty=False 면 Firestore 연산이 없었던 호출(캐시 적중, 조기 종료)은 출력 생략 (합계에는 반영)
+    이미 계측 중인 호출 안에서 불리면 바깥 호출에 합산
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is not None:
+                return fn(*args, **kwargs)
+            inv = Invocation(name)
+            token = _current.set(inv)
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                _current.reset(token)
+                _finish(inv, error, emit_empty)
+        return wrapper
+    return decorator
+
+
+def _finish(inv: Invocation, error: str | None, emit_empty: bool) -> None:
+    with _lock:
+        totals = None
+        if inv.session:
+            totals = _session_totals.get(inv.session)
+            if totals is None:
+                totals = _session_totals[inv.session] = {**dict.fromkeys(_COUNTERS, 0), "op_ms": 0.0, "invocations": 0}
+                while len(_session_totals) > OPSTATS_SESSION_MAX_ENTRIES:
+                    _session_totals.popitem(last=False)
+            else:
+                _session_totals.move_to_end(inv.session)
+            totals["invocations"] += 1
+            if inv.counts is not None:
+                for k, v in inv.counts.items():
+                    totals[k] += v
+                totals["op_ms"] += inv.op_ms
+        if inv.docs:
+            _hot_docs.update(inv.docs)
+            if len(_hot_docs) > OPSTATS_HOT_DOC_MAX_ENTRIES:
+                keep = _hot_docs.most_common(OPSTATS_HOT_DOC_MAX_ENTRIES // 5)
+                _hot_docs.clear()
+                _hot_docs.update(dict(keep))
+        if inv.counts is None and not error and not emit_empty:
+            return  # 연산 없는 호출 (캐시 적중, 조기 종료) - 합계만 반영
+        if totals is not None:
+            totals = {k: (round(v, 1) if isinstance(v, float) else v) for k, v in totals.items()}
+
+    record = {
+        "function": inv.name,
+        "session": inv.session,
+        "duration_ms": round((time.perf_counter() - inv.started) * 1000, 1),
+        **(inv.counts or dict.fromkeys(_COUNTERS, 0)),
+        "op_ms": round(inv.op_ms, 1),
+        "hot_docs": inv.docs.most_common(OPSTATS_HOT_DOCS_PER_RECORD) if inv.docs else [],
+    }
+    if error: record["error"] = error
+    if totals: record["session_totals"] = totals
+    # Cloud Logging 은 JSON 한 줄을 구조화 로그로 파싱 (jsonPayload.opstats 로 검색/집계)
+    logs.info("[opstats] %s", inv.name, opstats=record)
+
+
+def record(started: float, docs=(), **counts) -> None:
+    """
+    Firestore 연산 1개를 지금 호출에 기록 (계측 중이 아니면 아무것도 안 함)
+    started: 연산 직전의 time.perf_counter(), docs: 닿은 문서 경로 (collection/doc)
+    """
+    inv = _current.get()
+    if inv is not None:
+        inv.add(op_ms=(time.perf_counter() - started) * 1000, docs=docs, **counts)
+
+
+def stream(query) -> list:
+    """쿼리 결과를 끝까지 받아서 스냅샷 목록으로 - 쿼리 1개로 기록 (결과 0건이어도 읽기 1)"""
+    started = time.perf_counter()
+    snaps = list(query.stream())
+    record(started, reads=max(1, len(snaps)), queries=1, query_docs=len(snaps))
+    return snaps
+
+
+def commit(batch, writes: int, docs=()) -> None:
+    """WriteBatch 커밋 - writes: 배치에 넣은 쓰기(set/update/delete) 수"""
+    started = time.perf_counter()
+    batch.commit()
+    record(started, writes=writes, commits=1, docs=docs)
+
+
+def session_totals(session_key: str) -> dict | None:
+    with _lock:
+        totals = _session_totals.get(session_key)
+        return dict(totals) if totals else None
+
+
+def hot_documents(n: int = 20) -> list[tuple[str, int]]:
+    """이 인스턴스에서 가장 많이 읽고/쓴 문서 경로"""
+    with _lock:
+        return _hot_docs.most_common(n)
@@ -0,0 +1,269 @@
+# report_jobs.py
+# ✅ [리포트 작업 큐] 세션 종료 → report_jobs/{sessionId} 문서로 쌓아두고, 스케줄 워커가 미리 리포트를 만듦
+# 기상 시간에 앱이 한꺼번에 calculate_sleep_score 를 부르는 대신 밤새/새벽에 흩어서 처리
+#
+# 작업 문서 (report_jobs/{sessionId})
+#   userId, sessionId
+#   status      : PENDING → LEASED → DONE | FAILED (LEASED 에서 실패하면 다시 PENDING + run_after 뒤로)
+#   run_after   : 이 시각 이후에만 실행 (등록 시 지터, 재시도 시 백오프 + 지터)
+#   lease_until : LEASED 인 동안 다른 워커가 못 가져감 - 워커가 죽으면 이 시각 이후 다시 가져갈 수 있음
+#   lease_owner : 리스마다 새로 만드는 토큰 "{워커 ID}:{임의값}" (완료/재시도는 자기 리스가 아직 유효할 때만 반영)
+#                 같은 인스턴스가 만료된 자기 작업을 다시 가져가도 이전 실행의 완료 처리는 무시됨
+#   attempts    : 리스를 잡은 횟수 (잡을 때 늘림), last_error
+#                 워커가 죽어서 리스가 끝난 작업도 REPORT_JOB_MAX_ATTEMPTS 번을 채웠으면 다시 빌려주지 않고 FAILED
+#
+# 같은 세션은 문서 ID 가 같으므로 몇 번을 등록해도 작업은 1개 (create 가 AlreadyExists 면 무시)
+# 필요한 복합 색인 (firestore.indexes.json): (status, run_after), (status, lease_until)
+
+import contextvars
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore as gcf
+
+import logs
+import opstats
+
+PENDING, LEASED, DONE, FAILED = "PENDING", "LEASED", "DONE", "FAILED"
+
+REPORT_JOB_ENQUEUE_JITTER_SEC = 15 * 60   # 세션 종료 후 0~15분 사이에 흩어서 실행
+REPORT_JOB_LEASE_SEC = 5 * 60
+REPORT_JOB_MAX_ATTEMPTS = 5
+REPORT_JOB_BACKOFF_BASE_SEC = 60          # 60s, 120s, 240s ... (+ 지터)
+REPORT_JOB_BACKOFF_MAX_SEC = 60 * 60
+REPORT_JOBS_PER_RUN = 50
+REPORT_JOB_CONCURRENCY = 4
+
+
+def retry_delay_sec(attempts: int, rng: random.Random = random) -> float:
+    """attempts 번째 실패 후 다시 시도할 때까지의 시간 (지수 백오프, 절반~전체 사이 지터)"""
+    base = min(REPORT_JOB_BACKOFF_BASE_SEC * (2 ** max(0, attempts - 1)), REPORT_JOB_BACKOFF_MAX_SEC)
+    return base * rng.uniform(0.5, 1.0)
+
+
+def new_job(user_id: str, session_id: str, now: datetime, rng: random.Random = random) -> dict:
+    return {
+        "userId": user_id,
+        "sessionId": session_id,
+        "status": PENDING,
+        "attempts": 0,
+        "run_after": now + timedelta(seconds=rng.uniform(0, REPORT_JOB_ENQUEUE_JITTER_SEC)),
+        "lease_until": None,
+        "lease_owner": None,
+        "last_error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def _leasable(job: dict, now: datetime) -> bool:
+    if job["status"] == PENDING:
+        return job["run_after"] <= now
+    if job["status"] == LEASED:
+        return job["lease_until"] is not None and job["lease_until"] <= now
+    return False
+
+
+def _owns_lease(job: dict | None, owner: str, now: datetime) -> bool:
+    """아직 이 워커의 리스인지 (만료됐으면 다른 워커가 이미 가져갔을 수 있으므로 False)"""
+    return (job is not None and job.get("status") == LEASED and job.get("lease_owner") == owner
+            and job.get("lease_until") is not None and job["lease_until"] > now)
+
+
+def _lease_updates(job: dict, owner: str, now: datetime) -> dict:
+    """
+    리스 잡기 (attempts + 1) - 리스가 만료된 LEASED 인데 이미 최대 횟수를 채웠으면
+    (실행 중에 워커가 계속 죽는 작업) 더 빌려주지 않고 FAILED 로 닫음
+    """
+    if job["status"] == LEASED and job.get("attempts", 0) >= REPORT_JOB_MAX_ATTEMPTS:
+        return {
+            "status": FAILED, "lease_owner": None, "lease_until": None, "updated_at": now,
+            "last_error": f"lease expired {job.get('attempts', 0)} times without finishing",
+        }
+    return {
+        "status": LEASED,
+        "lease_owner": owner,
+        "lease_until": now + timedelta(seconds=REPORT_JOB_LEASE_SEC),
+        "attempts": job.get("attempts", 0) + 1,
+        "updated_at": now,
+    }
+
+
+def _finish_updates(job: dict, now: datetime, error: str | None, rng: random.Random) -> dict:
+    """성공이면 DONE, 실패면 남은 횟수에 따라 PENDING(백오프) 또는 FAILED"""
+    if error is None:
+        return {"status": DONE, "lease_owner": None, "lease_until": None, "last_error": None, "updated_at": now}
+    if job.get("attempts", 0) >= REPORT_JOB_MAX_ATTEMPTS:
+        return {"status": FAILED, "lease_owner": None, "lease_until": None, "last_error": error, "updated_at": now}
+    return {
+        "status": PENDING, "lease_owner": None, "lease_until": None, "last_error": error, "updated_at": now,
+        "run_after": now + timedelta(seconds=retry_delay_sec(job.get("attempts", 0), rng)),
+    }
+
+
+# ---------- 저장소: Firestore ----------
+
+class FirestoreJobStore:
+    collection = "report_jobs"
+
+    def __init__(self, db: gcf.Client):
+        self.db = db
+        self._jobs = db.collection(self.collection)
+
+    def create(self, job: dict) -> bool:
+        started = time.perf_counter()
+        try:
+            self._jobs.document(job["sessionId"]).create(job)
+            created = True
+        except gexc.AlreadyExists:
+            created = False
+        opstats.record(started, writes=int(created), commits=1, docs=(f"{self.collection}/{job['sessionId']}",))
+        return created
+
+    def due(self, now: datetime, limit: int) -> list[str]:
+        """실행할 차례인 PENDING + 리스가 끝난 LEASED 작업 ID (run_after / lease_until 오래된 순)"""
+        pending = self._jobs.where("status", "==", PENDING).where("run_after", "<=", now)\
+            .order_by("run_after").limit(limit)
+        ids = [doc.id for doc in opstats.stream(pending)]
+        if len(ids) < limit:
+            expired = self._jobs.where("status", "==", LEASED).where("lease_until", "<=", now)\
+                .order_by("lease_until").limit(limit - len(ids))
+            ids.extend(doc.id for doc in opstats.stream(expired))
+        return ids
+
+    def lease(self, job_id: str, owner: str, now: datetime) -> dict | None:
+        return self._transact(_lease_tx, job_id, owner=owner, now=now)
+
+    def finish(self, job_id: str, owner: str, now: datetime, error: str | None = None, rng: random.Random = random) -> str | None:
+        return self._transact(_finish_tx, job_id, owner=owner, now=now, error=error, rng=rng)
+
+    def _transact(self, tx_fn, job_id: str, **kwargs):
+        """작업 문서 1개 트랜잭션 - 결과가 None 이면 쓰기 없이 끝난 것 (storage.FirestoreRepository._transact 와 같은 기준으로 셈)"""
+        tries: list[int] = []
+        started = time.perf_counter()
+        ok, result = False, None
+        try:
+            result = tx_fn(self.db.transaction(), self._jobs.document(job_id), tries=tries, **kwargs)
+            ok = True
+            return result
+        finally:
+            opstats.record(started, reads=len(tries), writes=int(ok and result is not None), commits=int(ok), transactions=1,
+                           tx_retries=max(0, len(tries) - 1), rollbacks=int(not ok), docs=(f"{self.collection}/{job_id}",))
+
+
+@gcf.transactional
+def _lease_tx(tx: gcf.Transaction, ref, *, owner: str, now: datetime, tries: list) -> dict | None:
+    tries.append(1)
+    snap = ref.get(transaction=tx)
+    job = snap.to_dict() if snap.exists else None
+    if job is None or not _leasable(job, now):
+        return None
+    updates = _lease_updates(job, owner, now)
+    tx.update(ref, updates)
+    return {**job, **updates}
+
+
+@gcf.transactional
+def _finish_tx(tx: gcf.Transaction, ref, *, owner: str, now: datetime, error: str | None, rng: random.Random,
+               tries: list) -> str | None:
+    tries.append(1)
+    snap = ref.get(transaction=tx)
+    job = snap.to_dict() if snap.exists else None
+    if not _owns_lease(job, owner, now):
+        return None  # 리스가 만료됨 (다른 워커가 가져갔거나 가져갈 수 있음) - 쓰지 않고 그쪽 결과를 따름
+    updates = _finish_updates(job, now, error, rng)
+    tx.update(ref, updates)
+    return updates["status"]
+
+
+# ---------- 저장소: 메모리 (로컬 실행/리플레이용) ----------
+
+class MemoryJobStore:
+    """FirestoreJobStore 와 같은 의미의 프로세스 내 저장소"""
+
+    def __init__(self):
+        self.jobs: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: dict) -> bool:
+        with self._lock:
+            if job["sessionId"] in self.jobs:
+                return False
+            self.jobs[job["sessionId"]] = dict(job)
+            return True
+
+    def due(self, now: datetime, limit: int) -> list[str]:
+        with self._lock:
+            pending = sorted((j["run_after"], k) for k, j in self.jobs.items() if j["status"] == PENDING and j["run_after"] <= now)
+            expired = sorted((j["lease_until"], k) for k, j in self.jobs.items() if j["status"] == LEASED and _leasable(j, now))
+        return [k for _, k in pending + expired][:limit]
+
+    def lease(self, job_id: str, owner: str, now: datetime) -> dict | None:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or not _leasable(job, now):
+                return None
+            job.update(_lease_updates(job, owner, now))
+            return dict(job)
+
+    def finish(self, job_id: str, owner: str, now: datetime, error: str | None = None, rng: random.Random = random) -> str | None:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not _owns_lease(job, owner, now):
+                return None
+            job.update(_finish_updates(job, now, error, rng))
+            return job["status"]
+
+
+# ---------- 등록 / 워커 ----------
+
+def enqueue_report_job(store, user_id: str, session_id: str, now: datetime, rng: random.Random = random) -> bool:
+    """세션당 작업 1개 - 이미 있으면 False"""
+    return store.create(new_job(user_id, session_id, now, rng))
+
+
+def run_report_jobs(store, handler, *, owner: str, now: datetime, limit: int = REPORT_JOBS_PER_RUN,
+                    concurrency: int = REPORT_JOB_CONCURRENCY, clock=None) -> dict:
+    """
+    실행할 차례인 작업을 최대 limit 개 골라서 handler(job) 실행 (동시에 최대 concurrency 개)
+    리스는 워커 스레드가 handler 를 부르기 직전에 잡음 - 풀에서 기다리는 동안 리스가 만료돼서
+    다른 워커가 같은 작업을 다시 가져가는 일(리포트/알림 중복)이 없게
+    handler 가 예외 없이 끝나면 DONE, 예외면 백오프 후 재시도 (REPORT_JOB_MAX_ATTEMPTS 번째 실패면 FAILED)
+    owner: 워커 ID - 리스마다 뒤에 임의 토큰을 붙여서 lease_owner 로 씀
+    clock: 리스/완료 시각용 (기본: 시작 시각 now)
+    """
+    clock = clock or (lambda: now)
+    stats = {"due": 0, "leased": 0, DONE: 0, PENDING: 0, FAILED: 0, "lost_lease": 0}
+
+    def _run(job_id: str) -> str | None:
+        token = f"{owner}:{uuid.uuid4().hex[:12]}"
+        job = store.lease(job_id, token, clock())
+        if job is None:
+            return None  # 다른 워커가 먼저 가져감
+        if job["status"] == FAILED:
+            logs.error("❌ [리포트 작업 포기] session: %s %s", job["sessionId"], job["last_error"], user=job.get("userId"))
+            return FAILED
+        try:
+            handler(job)
+            error = None
+        except Exception as e:
+            error = str(e)[:500]
+            logs.error("❌ [리포트 작업 실패] session: %s attempt=%s %s", job["sessionId"], job["attempts"], error, user=job.get("userId"))
+        return store.finish(job_id, token, clock(), error) or "lost_lease"
+
+    job_ids = store.due(now, limit)
+    stats["due"] = len(job_ids)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        # opstats 집계를 호출 단위로 유지
+        futures = [pool.submit(contextvars.copy_context().run, _run, job_id) for job_id in job_ids]
+        for f in futures:
+            status = f.result()
+            if status is None: continue
+            stats["leased"] += 1
+            stats[status] += 1
+    return stats
@@ -0,0 +1,187 @@
+# rollups.py
+# ✅ [사용자 롤업] 주간/월간 통계용 압축 요약 - users/{uid}/rollups/{yyyy-mm}
+# sleep_reports 범위 조회 + 전체 문서 역직렬화 대신, 월별 문서 1~2개만 읽어서 같은 결과를 냄
+#
+# 문서 구조
+#   users/{uid}/rollups/{yyyy-mm} : {userId, month, reports: {sessionId: {score, hours, deep_ratio, rem_ratio, weekday, created_at}}}
+#   users/{uid}/rollups/_meta     : {complete_from} - 이 시각 이후 생성된 리포트는 롤업에 모두 들어있음
+#
+# 리포트와 롤업은 같은 트랜잭션으로 쓰고, 둘 다 리포트의 created_at 을 그대로 씀 (월 키도 이 값 기준)
+# 리포트를 다시 계산해서 created_at 의 월이 바뀌면 이전 월 문서의 항목은 같은 트랜잭션에서 지움 (세션당 항목 1개)
+
+import time
+from datetime import datetime, timezone
+
+from google.cloud import firestore as gcf
+
+import opstats
+from decoder import to_utc
+
+META_DOC_ID = "_meta"
+
+
+def month_key(dt: datetime) -> str:
+    return f"{dt.year:04d}-{dt.month:02d}"
+
+
+def _months_between(start: datetime, end: datetime) -> list[str]:
+    keys, y, m = [], start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        keys.append(f"{y:04d}-{m:02d}")
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return keys
+
+
+def rollup_entry(report: dict, created_at) -> dict:
+    summary = report["summary"]
+    created_dt = to_utc(created_at)
+    return {
+        "score": report["total_score"],
+        "hours": summary["total_duration_hours"],
+        "deep_ratio": summary["deep_ratio"],
+        "rem_ratio": summary["rem_ratio"],
+        "weekday": (created_dt or datetime.now(timezone.utc)).weekday(),
+        "created_at": created_at,
+    }
+
+
+def _rollups(db: gcf.Client, user_id: str):
+    return db.collection("users").document(user_id).collection("rollups")
+
+
+@gcf.transactional
+def _write_report_tx(tx: gcf.Transaction, report_ref, rollups, *, user_id: str, session_id: str, report: dict,
+                     created_at: datetime, extra_sets=()) -> int:
+    """반환: 쓴 문서 수"""
+    meta_ref = rollups.document(META_DOC_ID)
+    meta = meta_ref.get(transaction=tx)
+    prev = report_ref.get(transaction=tx)
+    prev_created = to_utc((prev.to_dict() or {}).get("created_at")) if prev.exists else None
+
+    month = month_key(created_at)
+    writes = 2 + len(extra_sets)
+    if not meta.exists:
+        tx.set(meta_ref, {"complete_from": created_at})
+        writes += 1
+    if prev_created is not None and month_key(prev_created) != month:
+        tx.set(rollups.document(month_key(prev_created)), {"reports": {session_id: gcf.DELETE_FIELD}}, merge=True)
+        writes += 1
+    tx.set(report_ref, {**report, "created_at": created_at})
+    tx.set(rollups.document(month), {
+        "userId": user_id, "month": month,
+        "reports": {session_id: rollup_entry(report, created_at)},
+    }, merge=True)
+    for ref, data in extra_sets:
+        tx.set(ref, data)
+    return writes
+
+
+def write_report_with_rollup(db: gcf.Client, session_id: str, report: dict, *, extra_sets=()):
+    """
+    sleep_reports/{sessionId} 저장 + 리포트 created_at 이 속한 월 롤업 갱신 (userId 가 없으면 리포트만 저장)
+    extra_sets: 같은 커밋에 같이 넣을 (문서 참조, 데이터) 목록 - 예: sleep_insights
+    """
+    report_ref = db.collection("sleep_reports").document(session_id)
+    created_at = to_utc(report.get("created_at")) or datetime.now(timezone.utc)
+    user_id = report.get("userId")
+    started = time.perf_counter()
+    if not user_id:
+        batch = db.batch()
+        batch.set(report_ref, {**report, "created_at": created_at})
+        for ref, data in extra_sets:
+            batch.set(ref, data)
+        batch.commit()
+        opstats.record(started, writes=1 + len(extra_sets), commits=1, docs=(f"sleep_reports/{session_id}",))
+        return
+    writes = _write_report_tx(
+        db.transaction(), report_ref, _rollups(db, user_id),
+        user_id=user_id, session_id=session_id, report=report, created_at=created_at, extra_sets=extra_sets,
+    )
+    opstats.record(started, reads=2, writes=writes, commits=1, transactions=1,
+                   docs=(f"sleep_reports/{session_id}", f"users/{user_id}/rollups/{month_key(created_at)}"))
+
+
+def load_rollup_reports(db: gcf.Client, user_id: str, start: datetime, end: datetime | None = None) -> list[dict] | None:
+    """
+    start 이후 리포트를 롤업에서 읽어서 sleep_reports 문서와 같은 모양(필요한 필드만)으로 반환
+    순서도 Firestore 범위 조회와 같게 (created_at, sessionId) 오름차순
+    롤업이 그 기간을 다 덮지 못하면 None → 호출 쪽에서 sleep_reports 조회로 폴백
+    """
+    end = end or datetime.now(timezone.utc)
+    rollups = _rollups(db, user_id)
+    refs = [rollups.document(META_DOC_ID)] + [rollups.document(k) for k in _months_between(start, end)]
+    started = time.perf_counter()
+    snaps = {snap.id: snap for snap in db.get_all(refs)}
+    opstats.record(started, reads=len(refs))
+
+    meta = snaps.get(META_DOC_ID)
+    complete_from = to_utc((meta.to_dict() or {}).get("complete_from")) if meta is not None and meta.exists else None
+    if complete_from is None or complete_from > start:
+        return None
+
+    rows = []
+    for key, snap in snaps.items():
+        if key == META_DOC_ID or not snap.exists: continue
+        for session_id, e in ((snap.to_dict() or {}).get("reports") or {}).items():
+            created_at = to_utc(e.get("created_at"))
+            if created_at is None or created_at < start: continue
+            rows.append({
+                "sessionId": session_id,
+                "userId": user_id,
+                "total_score": e["score"],
+                "created_at": created_at,
+                "summary": {
+                    "total_duration_hours": e["hours"],
+                    "deep_ratio": e["deep_ratio"],
+                    "rem_ratio": e["rem_ratio"],
+                },
+            })
+    rows.sort(key=lambda r: (r["created_at"], r["sessionId"]))
+    return rows
+
+
+class RollupBackfill:
+    """
+    폴백 조회 결과를 한 건씩 받아서 롤업을 채움 - 월이 바뀔 때마다 그 달 항목을 내려써서
+    기간이 길어져도 한 달치 이상 들고 있지 않음 (입력은 created_at 오름차순 = 범위 조회 순서)
+    finish() 가 호출돼야 complete_from 을 start 까지 당김 (중간에 끊기면 롤업만 일부 채워짐)
+    """
+
+    def __init__(self, db: gcf.Client, user_id: str, start: datetime):
+        self.db = db
+        self.user_id = user_id
+        self.start = start
+        self._rollups = _rollups(db, user_id)
+        self._month: str | None = None
+        self._entries: dict[str, dict] = {}
+
+    def add(self, report: dict) -> None:
+        created_at = to_utc(report.get("created_at"))
+        if created_at is None or not report.get("sessionId"): return
+        month = month_key(created_at)
+        if month != self._month:
+            self._flush()
+            self._month = month
+        self._entries[report["sessionId"]] = rollup_entry(report, created_at)
+
+    def _flush(self) -> None:
+        if self._entries:
+            started = time.perf_counter()
+            self._rollups.document(self._month).set(
+                {"userId": self.user_id, "month": self._month, "reports": self._entries}, merge=True
+            )
+            opstats.record(started, writes=1, commits=1, docs=(f"users/{self.user_id}/rollups/{self._month}",))
+        self._entries = {}
+
+    def finish(self) -> None:
+        self._flush()
+        meta_ref = self._rollups.document(META_DOC_ID)
+        started = time.perf_counter()
+        meta = meta_ref.get()
+        opstats.record(started, reads=1)
+        complete_from = to_utc((meta.to_dict() or {}).get("complete_from")) if meta.exists else None
+        if complete_from is None or complete_from > self.start:
+            started = time.perf_counter()
+            meta_ref.set({"complete_from": self.start})
+            opstats.record(started, writes=1, commits=1)
+
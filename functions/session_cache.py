@@ -0,0 +1,106 @@
+# session_cache.py
+# ✅ [세션 상태 캐시] warm 인스턴스 메모리에 session_state 를 들고 있다가
+# 단계가 바뀔 때 또는 하트비트 주기가 지났을 때만 Firestore 트랜잭션으로 내려씀 (write-behind)
+#
+# 일관성 규칙
+# - session_state 문서는 쓸 때마다 version 을 +1 하고 owner(인스턴스 ID)를 기록
+# - 캐시는 "내가 마지막으로 쓴 version" 을 들고 있고, 다음 write-through 트랜잭션이
+#   문서 version 과 비교해서 다른 인스턴스가 끼어들었으면 conflict 로 세고 문서 값 기준으로 다시 계산
+# - 그래서 캐시가 낡아 있을 수 있는 시간은 최대 하트비트 주기
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+INSTANCE_ID = uuid.uuid4().hex[:8]
+
+SESSION_STATE_HEARTBEAT_SEC = float(os.environ.get("SESSION_STATE_HEARTBEAT_SEC", "60"))
+SESSION_CACHE_MAX_ENTRIES = 10_000
+SESSION_CACHE_IDLE_TTL_SEC = 15 * 60
+
+
+class CachedSession:
+    __slots__ = ("state", "version", "flushed_at", "touched_at", "last_alert_ts")
+
+    def __init__(self, state: dict, version: int, now: datetime, last_alert_ts: datetime | None = None):
+        self.state = state
+        self.version = version
+        self.flushed_at = now
+        self.touched_at = now
+        self.last_alert_ts = last_alert_ts
+
+
+class SessionStateCache:
+    """세션 키(user__session) → 마지막으로 확정된 상태, LRU + 유휴 만료"""
+
+    def __init__(self, max_entries: int = SESSION_CACHE_MAX_ENTRIES, idle_ttl_sec: float = SESSION_CACHE_IDLE_TTL_SEC,
+                 heartbeat_sec: float = SESSION_STATE_HEARTBEAT_SEC):
+        self.max_entries = max_entries
+        self.idle_ttl_sec = idle_ttl_sec
+        self.heartbeat_sec = heartbeat_sec
+        self._entries: OrderedDict[str, CachedSession] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "skipped_writes": 0, "write_throughs": 0, "conflicts": 0}
+
+    def get(self, key: str, now: datetime) -> CachedSession | None:
+        """
+        캐시된 세션의 스냅샷 (state 는 복사본) - 다른 스레드의 absorb 가 캐시 항목을 고쳐도
+        호출 쪽이 읽는 상태는 바뀌지 않음 (얕은 복사 - 중첩 값(stab, score_acc)은 고치지 않고 통째로 갈아끼우므로 충분)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (now - entry.touched_at).total_seconds() > self.idle_ttl_sec:
+                if entry is not None: del self._entries[key]
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            snapshot = CachedSession(dict(entry.state), entry.version, entry.flushed_at, entry.last_alert_ts)
+            snapshot.touched_at = entry.touched_at
+            return snapshot
+
+    def absorb(self, key: str, updates: dict, now: datetime) -> bool:
+        """
+        Firestore 에 쓰지 않고 캐시에만 반영 (단계 변화 없음 + 하트비트 전)
+        반환: 반영했으면 True, 하트비트가 지나서 내려써야 하면 False
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (now - entry.flushed_at).total_seconds() >= self.heartbeat_sec:
+                return False
+            entry.state.update(updates)
+            entry.touched_at = now
+            self.stats["skipped_writes"] += 1
+            return True
+
+    def put(self, key: str, state: dict, version: int, now: datetime, *, conflict: bool = False) -> None:
+        """write-through 직후 호출 - 방금 쓴 상태와 version 으로 캐시 갱신"""
+        with self._lock:
+            prev = self._entries.get(key)
+            self._entries[key] = CachedSession(dict(state), version, now, prev.last_alert_ts if prev else None)
+            self._entries.move_to_end(key)
+            self.stats["write_throughs"] += 1
+            if conflict: self.stats["conflicts"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def last_alert(self, key: str) -> datetime | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.last_alert_ts if entry is not None else None
+
+    def mark_alert(self, key: str, ts: datetime) -> None:
+        """압력 알림 디바운스용 - 이 세션에서 마지막으로 알림을 낸(또는 이미 있던) 시각"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.last_alert_ts is None or ts > entry.last_alert_ts):
+                entry.last_alert_ts = ts
+
+    def drop(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,162 @@
+# stabilizer.py
+# ✅ [단계 안정화] 샘플마다 나오는 raw 단계 → 세션의 안정 단계 (processed_data / 명령은 안정 단계가 바뀔 때만 생김)
+# 센서 값이 경계에 걸리면 raw 단계가 계속 뒤집히고, 받아들인 뒤집힘마다 쓰기/명령이 생기므로 여기서 걸러냄
+#
+# 한 스텝 (step) 순서
+#   1) 최근 raw 단계 window 개를 창에 넣고 투표 (vote) → 후보 단계
+#        "latest"   : 마지막 raw 단계 그대로
+#        "majority" : 창에서 가장 많은 단계 (동률이면 지금 안정 단계, 그다음 최근 단계)
+#        "median"   : 깊이 순서(Awake < REM < Light < Deep)의 중앙값 - 이벤트 단계(Apnea/Snoring/Tossing)가 과반이면 그 단계
+#   2) 긴급 단계 (urgent, 기본 Apnea): 창에 urgent_votes 개 이상 있으면 유지 시간/확인 시간 없이 바로 전환
+#   3) 히스테리시스: 후보의 표가 지금 안정 단계의 표보다 창 크기 × switch_margin 이상 많아야 하고,
+#      confirm_sec 동안 계속 후보여야 함
+#   4) 유지 시간: 지금 안정 단계에 dwell_sec[단계] 이상 머물렀어야 떠날 수 있음
+#
+# 상태는 session_state 의 "stab" 필드 {"window": [raw 단계...], "candidate": 단계, "candidate_since": 시각}
+# 세션 캐시(write-behind)와 같이 움직이므로 인스턴스가 바뀌어도 하트비트 주기 안의 값까지는 이어짐
+# "legacy" 설정(창 1, 확인 0)은 상태 없이 예전 규칙(단계 무관 30초 유지)과 같은 결과
+#
+# 배포별 설정: STAGE_STABILIZER 환경변수 - 프리셋 이름 ("legacy" | "smoothed") 또는 JSON
+#   예) STAGE_STABILIZER='{"preset": "smoothed", "dwell_sec": {"Deep": 180}, "confirm_sec": 20}'
+
+import json
+import os
+from datetime import datetime
+
+from decoder import to_utc
+
+VOTES = ("latest", "majority", "median")
+_DEPTH = {"Awake": 0, "REM": 1, "Light": 2, "Deep": 3}
+
+PRESETS = {
+    "legacy": {
+        "window": 1, "vote": "latest", "default_dwell_sec": 30, "dwell_sec": {},
+        "switch_margin": 0.0, "confirm_sec": 0, "urgent": [], "urgent_votes": 1,
+    },
+    "smoothed": {
+        "window": 15, "vote": "majority", "default_dwell_sec": 60,
+        "dwell_sec": {"Deep": 120, "REM": 90, "Light": 60, "Awake": 30, "Snoring": 30, "Tossing": 20, "Apnea": 10},
+        "switch_margin": 0.2, "confirm_sec": 5, "urgent": ["Apnea"], "urgent_votes": 3,
+    },
+}
+DEFAULT_PRESET = "legacy"
+
+
+class StabilizerConfig:
+    __slots__ = ("window", "vote", "default_dwell_sec", "dwell_sec", "switch_margin", "confirm_sec", "urgent", "urgent_votes")
+
+    def __init__(self, window: int = 1, vote: str = "latest", default_dwell_sec: float = 30, dwell_sec: dict | None = None,
+                 switch_margin: float = 0.0, confirm_sec: float = 0, urgent=(), urgent_votes: int = 1):
+        if int(window) < 1: raise ValueError("window must be >= 1")
+        if vote not in VOTES: raise ValueError(f"vote must be one of {VOTES}")
+        if not 0.0 <= float(switch_margin) <= 1.0: raise ValueError("switch_margin must be between 0 and 1")
+        self.window = int(window)
+        self.vote = vote
+        self.default_dwell_sec = float(default_dwell_sec)
+        self.dwell_sec = {str(k): float(v) for k, v in (dwell_sec or {}).items()}
+        self.switch_margin = float(switch_margin)
+        self.confirm_sec = float(confirm_sec)
+        self.urgent = frozenset(urgent)
+        self.urgent_votes = max(1, int(urgent_votes))
+
+    @property
+    def stateless(self) -> bool:
+        """창/후보를 기억할 필요가 없는 설정 (legacy) - session_state 에 stab 필드를 쓰지 않음"""
+        return self.window == 1 and self.confirm_sec <= 0
+
+    def dwell_for(self, stage: str | None) -> float:
+        return self.dwell_sec.get(stage, self.default_dwell_sec)
+
+    def as_dict(self) -> dict:
+        return {k: (sorted(v) if isinstance(v, frozenset) else v) for k, v in ((k, getattr(self, k)) for k in self.__slots__)}
+
+
+def parse_config(value: str | dict | None) -> StabilizerConfig:
+    """프리셋 이름 / JSON 문자열 / dict → StabilizerConfig (dict 의 "preset" 위에 나머지 키를 덮어씀)"""
+    if value is None or value == "":
+        value = DEFAULT_PRESET
+    if isinstance(value, str):
+        value = value.strip()
+        value = json.loads(value) if value.startswith("{") else {"preset": value}
+    overrides = dict(value)
+    name = overrides.pop("preset", DEFAULT_PRESET)
+    if name not in PRESETS:
+        raise ValueError(f"unknown stabilizer preset: {name}")
+    return StabilizerConfig(**{**PRESETS[name], **overrides})
+
+
+def load_config() -> StabilizerConfig:
+    return parse_config(os.environ.get("STAGE_STABILIZER"))
+
+
+# ---------- 투표 ----------
+
+def _majority(window: list[str], stable: str | None) -> tuple[str, int]:
+    counts: dict[str, int] = {}
+    for stage in window:
+        counts[stage] = counts.get(stage, 0) + 1
+    best = max(counts.values())
+    if counts.get(stable) == best:
+        return stable, best
+    for stage in reversed(window):  # 동률이면 최근 단계
+        if counts[stage] == best:
+            return stage, best
+    raise AssertionError("unreachable")
+
+
+def _median(window: list[str], stable: str | None) -> tuple[str, int]:
+    winner, votes = _majority(window, stable)
+    if winner not in _DEPTH and votes * 2 > len(window):
+        return winner, votes
+    ranked = sorted(_DEPTH[s] for s in window if s in _DEPTH)
+    if not ranked:
+        return winner, votes
+    depth = ranked[(len(ranked) - 1) // 2]
+    stage = next(s for s, d in _DEPTH.items() if d == depth)
+    return stage, window.count(stage)
+
+
+def vote(config: StabilizerConfig, window: list[str], stable: str | None) -> tuple[str, int]:
+    """(후보 단계, 창 안에서 그 단계의 표 수)"""
+    if config.vote == "latest" or len(window) == 1:
+        return window[-1], window.count(window[-1])
+    if config.vote == "median":
+        return _median(window, stable)
+    return _majority(window, stable)
+
+
+# ---------- 한 스텝 ----------
+
+def step(config: StabilizerConfig, stab: dict | None, stable: str | None, since: datetime | None,
+         raw_stage: str, now: datetime) -> tuple[dict | None, str | None]:
+    """
+    (새 stab 상태 (stateless 설정이면 None), 바꿀 안정 단계 (유지면 None))
+    since: 지금 안정 단계가 시작된 시각 (없으면 유지 시간 조건 없음)
+    """
+    stab = stab or {}
+    window = (list(stab.get("window") or []) + [raw_stage])[-config.window:]
+    candidate, votes = vote(config, window, stable)
+
+    def _state(cand: str | None, cand_since: datetime | None) -> dict | None:
+        if config.stateless: return None
+        return {"window": window, "candidate": cand, "candidate_since": cand_since}
+
+    # 긴급 단계는 다수결 후보가 아직 지금 안정 단계여도 창에 urgent_votes 개가 차면 바로 전환
+    if candidate in config.urgent or raw_stage in config.urgent:
+        urgent = candidate if candidate in config.urgent else raw_stage
+        if urgent != stable and window.count(urgent) >= config.urgent_votes:
+            return _state(None, None), urgent
+
+    if candidate == stable:
+        return _state(None, None), None
+
+    if votes - window.count(stable) < config.switch_margin * len(window):
+        return _state(None, None), None
+
+    cand_since = to_utc(stab.get("candidate_since")) if stab.get("candidate") == candidate else None
+    cand_since = cand_since or now
+    if (now - cand_since).total_seconds() < config.confirm_sec:
+        return _state(candidate, cand_since), None
+    if since is not None and (now - since).total_seconds() < config.dwell_for(stable):
+        return _state(candidate, cand_since), None
+    return _state(None, None), candidate
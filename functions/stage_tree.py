@@ -0,0 +1,116 @@
+# stage_tree.py
+# ✅ [AI 모델 로더] SleepModelTrainer.ipynb 가 내보낸 평탄화 트리(stage_tree.json)를 읽어서 평가
+# 트리를 바꿀 때 main.py 를 고칠 필요 없이 JSON 만 교체하면 됩니다. (STAGE_TREE_PATH 로 경로 변경 가능)
+#
+# 파일 형식 (sklearn tree_ 배열과 같은 노드 순서):
+#   features  : 입력 특성 이름 (hr, spo2, mic_avg, pressure_avg 순서)
+#   classes   : 리프가 가리키는 단계 이름
+#   feature   : 노드별 분기 특성 인덱스 (리프는 -2)
+#   threshold : 노드별 분기 임계값 (x <= threshold 이면 왼쪽)
+#   left/right: 자식 노드 인덱스 (리프는 -1)
+#   leaf      : 노드별 classes 인덱스 (분기 노드는 -1)
+#   version   : 위 배열들의 sha256 앞 12자리 - 로드할 때 다시 계산해서 검증
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+import logs
+
+FEATURES = ("hr", "spo2", "mic_avg", "pressure_avg")
+DEFAULT_TREE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stage_tree.json")
+
+_ARRAY_KEYS = ("feature", "threshold", "left", "right", "leaf")
+
+
+def tree_version(spec: dict) -> str:
+    """features/classes/노드 배열로 계산한 모델 버전 해시"""
+    core = {k: spec[k] for k in ("features", "classes", *_ARRAY_KEYS)}
+    return hashlib.sha256(json.dumps(core, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class CompiledTree:
+    """평탄화된 결정 트리 - 스칼라는 파이썬 리스트로, 배치는 NumPy 인덱스 배열로 한 단계씩 내려감"""
+
+    def __init__(self, spec: dict):
+        if tuple(spec["features"]) != FEATURES:
+            raise ValueError(f"unexpected tree features: {spec['features']}")
+        n = len(spec["feature"])
+        if any(len(spec[k]) != n for k in _ARRAY_KEYS):
+            raise ValueError("tree arrays must have the same length")
+        version = tree_version(spec)
+        if spec.get("version") and spec["version"] != version:
+            raise ValueError(f"tree version mismatch: file={spec['version']} computed={version}")
+
+        self.version = version
+        self.classes = list(spec["classes"])
+        self.node_count = n
+
+        # 스칼라 경로: 리스트 인덱싱이 NumPy 스칼라보다 빠름
+        self._feature = [int(f) for f in spec["feature"]]
+        self._threshold = [float(t) for t in spec["threshold"]]
+        self._left = [int(c) for c in spec["left"]]
+        self._right = [int(c) for c in spec["right"]]
+        self._leaf_name = [self.classes[c] if c >= 0 else None for c in spec["leaf"]]
+
+        # 배치 경로
+        self._np_feature = np.asarray(self._feature, dtype=np.intp)
+        self._np_threshold = np.asarray(self._threshold, dtype=np.float64)
+        self._np_left = np.asarray(self._left, dtype=np.intp)
+        self._np_right = np.asarray(self._right, dtype=np.intp)
+        self._np_leaf = np.asarray(spec["leaf"], dtype=np.intp)
+        self.depth = self._max_depth()
+
+    def _max_depth(self) -> int:
+        depth, stack = 0, [(0, 0)]
+        while stack:
+            node, d = stack.pop()
+            depth = max(depth, d)
+            if self._left[node] != -1:
+                stack.append((self._left[node], d + 1))
+                stack.append((self._right[node], d + 1))
+        return depth
+
+    def predict(self, hr: float, spo2: float, mic_avg: float, pressure_avg: float) -> str:
+        x = (hr, spo2, mic_avg, pressure_avg)
+        feature, threshold, left, right = self._feature, self._threshold, self._left, self._right
+        node = 0
+        while left[node] != -1:
+            # NaN 비교는 False → 오른쪽 (if/else 트리와 같은 동작)
+            node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+        return self._leaf_name[node]
+
+    def predict_index(self, hr, spo2, mic_avg, pressure_avg) -> np.ndarray:
+        """배열 입력 → classes 인덱스 배열 (모든 샘플을 depth 단계만큼 동시에 내려보냄)"""
+        X = np.stack(np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (hr, spo2, mic_avg, pressure_avg))), axis=-1)
+        flat = X.reshape(-1, len(FEATURES))
+        rows = np.arange(flat.shape[0])
+        node = np.zeros(flat.shape[0], dtype=np.intp)
+        for _ in range(self.depth):
+            left = self._np_left[node]
+            is_split = left != -1
+            go_left = flat[rows, self._np_feature[node]] <= self._np_threshold[node]
+            node = np.where(is_split, np.where(go_left, left, self._np_right[node]), node)
+        return self._np_leaf[node].reshape(X.shape[:-1])
+
+
+def load_tree(path: str) -> CompiledTree:
+    with open(path, encoding="utf-8") as f:
+        return CompiledTree(json.load(f))
+
+
+# ---------- warm 인스턴스당 1회 로드 ----------
+_tree: CompiledTree | None = None
+_tree_lock = threading.Lock()
+
+def get_stage_tree() -> CompiledTree:
+    global _tree
+    if _tree is None:
+        with _tree_lock:
+            if _tree is None:
+                _tree = load_tree(os.environ.get("STAGE_TREE_PATH", DEFAULT_TREE_PATH))
+                logs.info("[AI 모델 로드] version=%s nodes=%d depth=%d", _tree.version, _tree.node_count, _tree.depth)
+    return _tree
@@ -0,0 +1,71 @@
+# stage_vector.py
+# ✅ [벡터 엔진] predict_stage_hybrid / predict_stage_ai 의 NumPy 배열 버전
+# 백필, 리플레이, 배치 수집에서 샘플 수만큼 파이썬 분기를 도는 대신 마스크 연산으로 한 번에 판정합니다.
+# ⚠️ main.py 의 스칼라 규칙과 비트 단위로 같은 결과를 내야 합니다. 규칙을 바꾸면 양쪽을 같이 바꾸세요.
+
+import numpy as np
+
+from stage_tree import get_stage_tree
+
+# 단계 코드 (int8) - 순서를 바꾸면 저장된 코드의 의미가 바뀌므로 뒤에만 추가할 것
+STAGES = ("Deep", "Light", "REM", "Awake", "Apnea", "Snoring", "Tossing")
+STAGE_CODE = {name: code for code, name in enumerate(STAGES)}
+DEEP, LIGHT, REM, AWAKE, APNEA, SNORING, TOSSING = range(len(STAGES))
+
+_STAGE_NAMES = np.array(STAGES, dtype=object)
+
+
+def _as_f64(x) -> np.ndarray:
+    return np.asarray(x, dtype=np.float64)
+
+
+def predict_stage_ai_batch(hr, spo2, mic_avg, pressure_avg) -> np.ndarray:
+    """
+    predict_stage_ai 의 배열 버전 (반환: 단계 코드 int8 배열)
+    stage_tree.json 트리를 배열 단위로 평가하므로 NaN 도 스칼라와 같이 오른쪽(else) 으로 갑니다.
+    """
+    tree = get_stage_tree()
+    return _class_codes(tree.classes)[tree.predict_index(hr, spo2, mic_avg, pressure_avg)]
+
+
+_class_code_cache: dict[tuple, np.ndarray] = {}
+
+def _class_codes(classes: list[str]) -> np.ndarray:
+    """트리 classes 인덱스 → 단계 코드 변환표"""
+    key = tuple(classes)
+    if key not in _class_code_cache:
+        _class_code_cache[key] = np.asarray([STAGE_CODE[c] for c in classes], dtype=np.int8)
+    return _class_code_cache[key]
+
+
+def predict_stage_hybrid_batch(hr, spo2, mic_avg, pressure_avg) -> np.ndarray:
+    """
+    predict_stage_hybrid 의 배열 버전 (반환: 단계 코드 int8 배열)
+    규칙은 우선순위대로 마스크를 만들고, 어느 규칙에도 걸리지 않은 샘플만 AI 트리로 넘깁니다.
+    """
+    hr, spo2, mic_avg, pressure_avg = np.broadcast_arrays(*map(_as_f64, (hr, spo2, mic_avg, pressure_avg)))
+
+    rules = [
+        (spo2 <= 90.0, APNEA),
+        ((pressure_avg < 100.0) | (hr > 95), AWAKE),
+        (pressure_avg > 3000, TOSSING),
+        (mic_avg > 150, SNORING),
+        ((hr >= 70) & (hr <= 85) & (pressure_avg < 1000) & (mic_avg < 30), REM),
+        (hr < 60, DEEP),
+    ]
+
+    out = np.empty(hr.shape, dtype=np.int8)
+    undecided = np.ones(hr.shape, dtype=bool)
+    for mask, code in rules:
+        hit = undecided & mask
+        out[hit] = code
+        undecided &= ~mask
+
+    if undecided.any():
+        out[undecided] = predict_stage_ai_batch(hr[undecided], spo2[undecided], mic_avg[undecided], pressure_avg[undecided])
+    return out
+
+
+def stage_names(codes) -> list[str]:
+    """단계 코드 배열 → 단계 이름 리스트"""
+    return _STAGE_NAMES[np.asarray(codes, dtype=np.intp)].tolist()
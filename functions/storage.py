@@ -0,0 +1,367 @@
+# storage.py
+# ✅ [저장소 계층] 세션 상태 / 단계 기록 / 하이프노그램 / 명령 / 명령 수신함 / 압력 알림 / 리포트 / 사용자 문서 접근을 한 곳으로
+# main.py 의 수집 경로는 Firestore 클라이언트 대신 이 인터페이스만 사용
+#   - FirestoreRepository : 실제 배포용 (gcf.Client 위)
+#   - MemoryRepository    : 오프라인 벤치마크/부하 테스트용 (프로세스 내 dict + 락, 트랜잭션 의미 동일)
+#
+# 아직 get_db() 로 클라이언트를 직접 쓰는 경로 (수집 경로가 아니라 MemoryRepository 벤치 대상이 아님)
+# 여기도 연산마다 opstats.record / stream / commit 으로 셈 (bench/replay_ingest.py 가 함수별 요약을 확인)
+#   - _load_log_overrides                   : config/logging 문서 1개 (logs 모듈 설정)
+#   - 리포트 쓰기 (calculate_sleep_score, auto_generate_report, process_report_jobs)
+#       rollups.write_report_with_rollup 트랜잭션 (알림용 users/{uid} 읽기는 notifications 가 get_user 로)
+#   - 주간/월간 통계 (calculate_weekly_stats, calculate_monthly_trends) : 롤업 문서 / sleep_reports 범위 조회 + 롤업 백필
+#   - generate_sleep_insights               : sleep_insights 문서 쓰기
+#   - on_session_end, sweep_ended_sessions  : session_state 범위 조회 + report_jobs 등록 배치
+#   - sweep_expired_commands                : commands 범위 조회 + 배치 갱신/삭제
+#   - on_user_written, send_bedtime_reminders : notifications 의 취침 알림 색인
+#   - process_report_jobs                   : report_jobs.FirestoreJobStore (작업 큐는 자체 저장소 추상화가 있음)
+#
+# 트랜잭션은 "문서 1개 읽기 → 순수 함수 → 쓰기" 형태만 지원 (세션 상태 / 명령 수신함 갱신이 이 모양)
+#   fn(st) -> (result, write) ; st 는 문서 dict (없으면 None), write 는 ("set" | "update", data) 또는 None
+#   Firestore 에서는 충돌 시 fn 이 다시 불릴 수 있으므로 fn 은 부작용이 없어야 함
+#
+# 두 구현 모두 연산마다 opstats.record() 로 호출별 읽기/쓰기/트랜잭션 수를 보고 (같은 연산이면 같은 숫자)
+
+import copy
+import itertools
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as gexc
+from google.cloud import firestore as gcf
+
+import opstats
+from command_inbox import COMMAND_INBOX
+from hypnogram import HYPNOGRAM_COLLECTION, HYPNOGRAM_PAGE_COLLECTION
+
+SESSION_STATE = "session_state"
+PROCESSED_DATA = "processed_data"
+COMMANDS = "commands"
+PRESSURE_ALERTS = "pressure_alerts"
+SLEEP_REPORTS = "sleep_reports"
+USERS = "users"
+
+
+class Repository(ABC):
+    """저장소 인터페이스 - 두 구현이 같은 의미를 가져야 함 (빠진 메서드가 있으면 인스턴스를 만들 때 TypeError)"""
+
+    # ---------- session_state ----------
+    @abstractmethod
+    def get_session_state(self, state_key: str) -> dict | None: ...
+    @abstractmethod
+    def find_session_state(self, session_id: str) -> dict | None: ...
+    @abstractmethod
+    def transact_session_state(self, state_key: str, fn): ...
+
+    # ---------- processed_data ----------
+    @abstractmethod
+    def add_processed_stages(self, docs: list[dict]) -> None: ...
+    @abstractmethod
+    def list_processed_stages(self, session_id: str) -> list[dict]:
+        """changed_at 오름차순"""
+
+    # ---------- hypnograms ----------
+    @abstractmethod
+    def append_hypnogram(self, state_key: str, pages: dict[int, dict]) -> None:
+        """hypnogram.append_pages() 결과를 페이지별 merge 로 한 번에 씀"""
+    @abstractmethod
+    def get_hypnogram(self, state_key: str) -> tuple[dict, list[dict]] | None:
+        """(머리 문서, 넘침 페이지 문서들) - 머리 문서가 없으면 None"""
+
+    # ---------- commands / pressure_alerts ----------
+    @abstractmethod
+    def create_command(self, command_id: str, doc: dict) -> bool:
+        """새로 만들었으면 True, 같은 ID 가 이미 있으면 False (그 외 오류는 그대로 올림)"""
+    @abstractmethod
+    def create_pressure_alert(self, alert_id: str, doc: dict) -> bool: ...
+    @abstractmethod
+    def transact_command_inbox(self, device_key: str, fn):
+        """command_inbox/{device_key} 트랜잭션 (fn 형태는 transact_session_state 와 같음)"""
+
+    # ---------- sleep_reports / users ----------
+    @abstractmethod
+    def get_report(self, session_id: str) -> dict | None: ...
+    @abstractmethod
+    def get_user(self, user_id: str) -> dict | None: ...
+
+
+# ========================================
+# Firestore
+# ========================================
+
+@gcf.transactional
+def _transact_doc(tx: gcf.Transaction, ref: gcf.DocumentReference, fn):
+    snap = ref.get(transaction=tx)
+    result, write = fn(snap.to_dict() or {} if snap.exists else None)
+    if write is not None:
+        op, data = write
+        if op == "set": tx.set(ref, data)
+        else: tx.update(ref, data)
+    return result
+
+
+class FirestoreRepository(Repository):
+    def __init__(self, db: gcf.Client):
+        self.db = db
+
+    def _doc(self, collection: str, doc_id: str) -> dict | None:
+        started = time.perf_counter()
+        snap = self.db.collection(collection).document(doc_id).get()
+        opstats.record(started, reads=1, docs=(f"{collection}/{doc_id}",))
+        return snap.to_dict() if snap.exists else None
+
+    def _create(self, collection: str, doc_id: str, doc: dict) -> bool:
+        started = time.perf_counter()
+        try:
+            self.db.collection(collection).document(doc_id).create(doc)
+            created = True
+        except gexc.AlreadyExists:
+            created = False
+        opstats.record(started, writes=int(created), commits=1, docs=(f"{collection}/{doc_id}",))
+        return created
+
+    def _query(self, query) -> list[dict]:
+        started = time.perf_counter()
+        docs = [doc.to_dict() for doc in query.stream()]
+        opstats.record(started, reads=max(1, len(docs)), queries=1, query_docs=len(docs))
+        return docs
+
+    def _transact(self, collection: str, doc_id: str, fn):
+        attempts, wrote = 0, False
+
+        def counted(st):
+            nonlocal attempts, wrote
+            attempts += 1
+            result, write = fn(st)
+            wrote = write is not None
+            return result, write
+
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = _transact_doc(self.db.transaction(), self.db.collection(collection).document(doc_id), counted)
+            ok = True
+            return result
+        finally:
+            opstats.record(started, reads=attempts, writes=int(ok and wrote), commits=int(ok), transactions=1,
+                           tx_retries=max(0, attempts - 1), rollbacks=int(not ok), docs=(f"{collection}/{doc_id}",))
+
+    def get_session_state(self, state_key):
+        return self._doc(SESSION_STATE, state_key)
+
+    def find_session_state(self, session_id):
+        docs = self._query(self.db.collection(SESSION_STATE).where("sessionId", "==", session_id).limit(1))
+        return docs[0] if docs else None
+
+    def transact_session_state(self, state_key, fn):
+        return self._transact(SESSION_STATE, state_key, fn)
+
+    def add_processed_stages(self, docs):
+        if not docs: return
+        started = time.perf_counter()
+        if len(docs) == 1:
+            self.db.collection(PROCESSED_DATA).add(docs[0])
+        else:
+            batch = self.db.batch()
+            for doc in docs:
+                batch.set(self.db.collection(PROCESSED_DATA).document(), doc)
+            batch.commit()
+        opstats.record(started, writes=len(docs), commits=1)
+
+    def list_processed_stages(self, session_id):
+        return self._query(self.db.collection(PROCESSED_DATA)
+                           .where("sessionId", "==", session_id)
+                           .order_by("changed_at", direction=gcf.Query.ASCENDING))
+
+    def _hypnogram_page(self, state_key: str, page: int) -> gcf.DocumentReference:
+        head = self.db.collection(HYPNOGRAM_COLLECTION).document(state_key)
+        return head if page == 0 else head.collection(HYPNOGRAM_PAGE_COLLECTION).document(str(page))
+
+    def append_hypnogram(self, state_key, pages):
+        started = time.perf_counter()
+        if len(pages) == 1:
+            (page, data), = pages.items()
+            self._hypnogram_page(state_key, page).set(data, merge=True)
+        else:
+            batch = self.db.batch()
+            for page, data in pages.items():
+                batch.set(self._hypnogram_page(state_key, page), data, merge=True)
+            batch.commit()
+        opstats.record(started, writes=len(pages), commits=1, docs=(f"{HYPNOGRAM_COLLECTION}/{state_key}",))
+
+    def get_hypnogram(self, state_key):
+        head = self._doc(HYPNOGRAM_COLLECTION, state_key)
+        if head is None: return None
+        refs = [self._hypnogram_page(state_key, p) for p in range(1, int(head.get("pages", 1)))]
+        if not refs:
+            return head, []
+        started = time.perf_counter()
+        pages = [snap.to_dict() for snap in self.db.get_all(refs) if snap.exists]
+        opstats.record(started, reads=len(refs))
+        return head, pages
+
+    def create_command(self, command_id, doc):
+        return self._create(COMMANDS, command_id, doc)
+
+    def create_pressure_alert(self, alert_id, doc):
+        return self._create(PRESSURE_ALERTS, alert_id, doc)
+
+    def transact_command_inbox(self, device_key, fn):
+        return self._transact(COMMAND_INBOX, device_key, fn)
+
+    def get_report(self, session_id):
+        return self._doc(SLEEP_REPORTS, session_id)
+
+    def get_user(self, user_id):
+        return self._doc(USERS, user_id)
+
+
+# ========================================
+# 메모리
+# ========================================
+
+class MemoryRepository(Repository):
+    """
+    컬렉션별 dict + 락 하나 - 트랜잭션은 락 안에서 읽기/계산/쓰기 (직렬화 가능)
+    SERVER_TIMESTAMP 는 now() 로 치환, 저장/반환 시 복사해서 호출 쪽 변경이 새지 않게 함
+    stats: 읽기/쓰기/트랜잭션 수 (FirestoreRepository 를 썼을 때의 연산 수와 같게 셈, opstats 에도 같은 값을 보고)
+    """
+
+    def __init__(self, now=None):
+        self.now = now or (lambda: datetime.now(timezone.utc))
+        self.collections: dict[str, dict[str, dict]] = {}
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self.stats = {"reads": 0, "writes": 0, "transactions": 0}
+
+    def _col(self, name: str) -> dict[str, dict]:
+        return self.collections.setdefault(name, {})
+
+    def _count(self, started: float, docs=(), **counts) -> None:
+        for k in ("reads", "writes", "transactions"):
+            self.stats[k] += counts.get(k, 0)
+        opstats.record(started, docs=docs, **counts)
+
+    def _resolve(self, doc: dict) -> dict:
+        now = None
+        out = {}
+        for k, v in doc.items():
+            if v is gcf.SERVER_TIMESTAMP:
+                now = now or self.now()
+                v = now
+            elif isinstance(v, dict):
+                v = self._resolve(v)
+            else:
+                v = copy.copy(v)
+            out[k] = v
+        return out
+
+    def _get(self, collection: str, doc_id: str) -> dict | None:
+        started = time.perf_counter()
+        with self._lock:
+            self._count(started, reads=1, docs=(f"{collection}/{doc_id}",))
+            doc = self._col(collection).get(doc_id)
+            return copy.deepcopy(doc) if doc is not None else None
+
+    def _create(self, collection: str, doc_id: str, doc: dict) -> bool:
+        started = time.perf_counter()
+        with self._lock:
+            col = self._col(collection)
+            created = doc_id not in col
+            if created:
+                col[doc_id] = self._resolve(doc)
+            self._count(started, writes=int(created), commits=1, docs=(f"{collection}/{doc_id}",))
+            return created
+
+    def get_session_state(self, state_key):
+        return self._get(SESSION_STATE, state_key)
+
+    def find_session_state(self, session_id):
+        started = time.perf_counter()
+        with self._lock:
+            found = next((d for d in self._col(SESSION_STATE).values() if d.get("sessionId") == session_id), None)
+            self._count(started, reads=1, queries=1, query_docs=int(found is not None))
+            return copy.deepcopy(found) if found is not None else None
+
+    def _transact(self, collection: str, doc_id: str, fn):
+        started = time.perf_counter()
+        with self._lock:
+            col = self._col(collection)
+            st = col.get(doc_id)
+            ok, write = False, None
+            try:
+                result, write = fn(copy.deepcopy(st) if st is not None else None)
+                if write is not None:
+                    op, data = write
+                    if op == "set":
+                        col[doc_id] = self._resolve(data)
+                    elif st is None:
+                        raise gexc.NotFound(f"No document to update: {collection}/{doc_id}")
+                    else:
+                        st.update(self._resolve(data))
+                ok = True
+                return result
+            finally:
+                self._count(started, reads=1, writes=int(ok and write is not None), commits=int(ok), transactions=1,
+                            rollbacks=int(not ok), docs=(f"{collection}/{doc_id}",))
+
+    def transact_session_state(self, state_key, fn):
+        return self._transact(SESSION_STATE, state_key, fn)
+
+    def add_processed_stages(self, docs):
+        if not docs: return
+        started = time.perf_counter()
+        with self._lock:
+            col = self._col(PROCESSED_DATA)
+            for doc in docs:
+                col[f"p{next(self._ids):012d}"] = self._resolve(doc)
+            self._count(started, writes=len(docs), commits=1)
+
+    def list_processed_stages(self, session_id):
+        started = time.perf_counter()
+        with self._lock:
+            docs = [copy.deepcopy(d) for d in self._col(PROCESSED_DATA).values() if d.get("sessionId") == session_id]
+            self._count(started, reads=max(1, len(docs)), queries=1, query_docs=len(docs))
+        return sorted(docs, key=lambda d: d["changed_at"])
+
+    def append_hypnogram(self, state_key, pages):
+        started = time.perf_counter()
+        with self._lock:
+            col = self._col(HYPNOGRAM_COLLECTION)
+            self._count(started, writes=len(pages), commits=1, docs=(f"{HYPNOGRAM_COLLECTION}/{state_key}",))
+            for page, data in pages.items():
+                doc_id = state_key if page == 0 else f"{state_key}/{HYPNOGRAM_PAGE_COLLECTION}/{page}"
+                doc = col.setdefault(doc_id, {})
+                for k, v in self._resolve(data).items():
+                    if isinstance(v, dict) and isinstance(doc.get(k), dict): doc[k].update(v)
+                    else: doc[k] = v
+
+    def get_hypnogram(self, state_key):
+        head = self._get(HYPNOGRAM_COLLECTION, state_key)
+        if head is None: return None
+        ids = [f"{state_key}/{HYPNOGRAM_PAGE_COLLECTION}/{p}" for p in range(1, int(head.get("pages", 1)))]
+        if not ids:
+            return head, []
+        started = time.perf_counter()
+        with self._lock:
+            col = self._col(HYPNOGRAM_COLLECTION)
+            pages = [copy.deepcopy(col[i]) for i in ids if i in col]
+            self._count(started, reads=len(ids))
+        return head, pages
+
+    def create_command(self, command_id, doc):
+        return self._create(COMMANDS, command_id, doc)
+
+    def create_pressure_alert(self, alert_id, doc):
+        return self._create(PRESSURE_ALERTS, alert_id, doc)
+
+    def transact_command_inbox(self, device_key, fn):
+        return self._transact(COMMAND_INBOX, device_key, fn)
+
+    def get_report(self, session_id):
+        return self._get(SLEEP_REPORTS, session_id)
+
+    def get_user(self, user_id):
+        return self._get(USERS, user_id)
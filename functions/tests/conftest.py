@@ -0,0 +1,10 @@
+# conftest.py
+# functions/ 의 모듈(main, stage_vector ...)을 배포 때와 같은 최상위 이름으로 import (bench/ 스크립트와 같은 방식)
+# bench/ 도 경로에 넣어서 fake_firestore.MemFirestore 를 Firestore 대역으로 씀
+
+import os
+import sys
+
+_FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _FUNCTIONS_DIR)
+sys.path.insert(1, os.path.join(_FUNCTIONS_DIR, "bench"))
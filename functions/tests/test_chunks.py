@@ -0,0 +1,124 @@
+# test_chunks.py
+# pack_samples → read_chunk → chunk_to_batch 왕복 (빈 슬롯, 슬롯 끝으로 밀리는 샘플, 구간 나눔), 잘못된 문서
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from chunks import (
+    CHUNK_COLLECTION, FLAG_AUTO_CONTROL, FLAG_PRESENT, FLAG_SNORING,
+    chunk_id, chunk_to_batch, encode_chunk, pack_samples, read_chunk, read_session_columns,
+)
+from decoder import DecodeError, decode_batch, epoch_seconds
+from fake_firestore import MemFirestore
+
+START = datetime(2026, 1, 1, 14, 0, tzinfo=timezone.utc)  # 60초 구간 경계
+
+
+def _doc(sec: float, hr: float = 60.0, **extra) -> dict:
+    return {"userId": "u", "sessionId": "s", "ts": START + timedelta(seconds=sec), "hr": hr, "spo2": 97.0,
+            "mic_avg": 20.0, "pressure_avg": 1500.0, **extra}
+
+
+def test_round_trip_matches_decode_batch():
+    docs = [_doc(i, hr=55.0 + i * 0.5, auto_control_active=i % 2 == 0) for i in range(60)]
+    (chunk_doc,) = pack_samples(docs)
+    assert chunk_doc["count"] == 60 and chunk_doc["start_ts"] == START
+    assert chunk_doc["end_ts"] == START + timedelta(seconds=59)
+
+    batch = chunk_to_batch(read_chunk(chunk_doc))
+    expected = decode_batch(docs)
+    assert (batch.user_id, batch.session_id) == ("u", "s")
+    assert batch.source_ts == expected.source_ts
+    assert batch.ts_epoch.tolist() == expected.ts_epoch.tolist()
+    for name in ("hr", "spo2", "mic_avg", "pressure_avg"):
+        np.testing.assert_array_equal(getattr(batch, name), getattr(expected, name).astype(np.float32))
+    assert batch.auto_control_active.tolist() == expected.auto_control_active.tolist()
+
+
+def test_empty_slots_are_dropped_and_trailing_ones_trimmed():
+    docs = [_doc(0, hr=50), _doc(3, hr=53), _doc(10, hr=60, is_snoring=True)]
+    (chunk_doc,) = pack_samples(docs)
+    assert chunk_doc["count"] == 11  # 10초 뒤 빈 슬롯은 잘림
+
+    chunk = read_chunk(chunk_doc)
+    assert np.flatnonzero(chunk.present).tolist() == [0, 3, 10]
+    assert np.isnan(chunk.columns["hr"][1]) and chunk.columns["flags"][1] == 0
+    assert chunk.columns["flags"][10] == FLAG_PRESENT | FLAG_SNORING
+
+    batch = chunk_to_batch(chunk)
+    assert batch.hr.tolist() == [50.0, 53.0, 60.0]
+    assert batch.source_ts == [START, START + timedelta(seconds=3), START + timedelta(seconds=10)]
+
+
+def test_rounding_clamps_to_last_slot_and_later_sample_wins():
+    docs = [_doc(59.7, hr=70), _doc(1.2, hr=61), _doc(0.9, hr=62)]
+    (chunk_doc,) = pack_samples(docs)
+    chunk = read_chunk(chunk_doc)
+    assert chunk.count == 60
+    assert chunk.columns["hr"][59] == 70  # 59.7초 → 슬롯 60 이 아니라 마지막 슬롯 59
+    assert chunk.columns["hr"][1] == 62   # 1.2초, 0.9초 모두 슬롯 1 → 입력 순서상 나중 샘플
+
+
+def test_windows_split_and_sorted():
+    docs = [_doc(125, hr=3), _doc(5, hr=1), _doc(65, hr=2, auto_control_active=True)]
+    chunk_docs = pack_samples(docs)
+    assert [c["start_ts"] for c in chunk_docs] == [START + timedelta(seconds=s) for s in (0, 60, 120)]
+    assert chunk_id("u", "s", chunk_docs[1]["start_ts"]) == f"u__s__{int(epoch_seconds(START) * 1000) + 60_000}"
+    flags = read_chunk(chunk_docs[1]).columns["flags"]
+    assert flags[5] == FLAG_PRESENT | FLAG_AUTO_CONTROL
+
+
+def test_extra_columns_only_when_present():
+    (plain,) = pack_samples([_doc(0)])
+    (extra,) = pack_samples([_doc(0), _doc(1, watch_battery=80)])
+    assert "watch_battery" not in plain["cols"]
+    cols = read_chunk(extra).columns
+    assert np.isnan(cols["watch_battery"][0]) and cols["watch_battery"][1] == 80
+
+
+def test_pack_rejects_mixed_sessions_and_bad_window():
+    assert pack_samples([]) == []
+    with pytest.raises(DecodeError):
+        pack_samples([_doc(0), {**_doc(1), "sessionId": "other"}])
+    with pytest.raises(ValueError):
+        pack_samples([_doc(0)], interval_ms=700)
+
+
+def _valid() -> dict:
+    return pack_samples([_doc(0), _doc(1)])[0]
+
+
+@pytest.mark.parametrize("change", [
+    {"v": 2},
+    {"count": 0},
+    {"count": "2"},
+    {"interval_ms": 0},
+    {"start_ts": "nope"},
+    {"cols": ["hr", "spo2", "mic_avg", "flags"]},
+    {"cols": ["hr", "spo2", "mic_avg", "pressure_avg", "temp", "flags"]},
+    {"data": None},
+    {"data": b"\x00" * 7},
+])
+def test_read_chunk_rejects_bad_docs(change):
+    with pytest.raises(DecodeError):
+        read_chunk({**_valid(), **change})
+
+
+def test_chunk_with_no_samples_raises():
+    empty = encode_chunk("u", "s", START, 1000, {
+        "hr": [np.nan], "spo2": [np.nan], "mic_avg": [np.nan], "pressure_avg": [np.nan], "flags": [0],
+    })
+    with pytest.raises(DecodeError):
+        chunk_to_batch(read_chunk(empty))
+
+
+def test_read_session_columns_concatenates_present_slots():
+    db = MemFirestore()
+    for c in pack_samples([_doc(0, hr=1), _doc(2, hr=2), _doc(61, hr=3)]):
+        db.collection(CHUNK_COLLECTION).document(chunk_id("u", "s", c["start_ts"])).set(c)
+    cols = read_session_columns(db, "u", "s", columns=("hr", "watch_battery"))
+    assert cols["hr"].tolist() == [1.0, 2.0, 3.0]
+    assert cols["ts"].tolist() == [epoch_seconds(START) + s for s in (0, 2, 61)]
+    assert np.isnan(cols["watch_battery"]).all()
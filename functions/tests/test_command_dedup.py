@@ -0,0 +1,105 @@
+# test_command_dedup.py
+# 명령 dedupKey 규칙(재전송해도 같은 입력 → 같은 키, 처리 시각 changed_at 은 키에 없음) 과
+# CommandDedupCache - 명령 + 수신함 쓰기가 모두 끝난 키만 기억, 실패한 키는 다음 재전송에서 다시 시도
+
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+from command_dedup import CommandDedupCache
+from command_inbox import COMMAND_INBOX
+from decoder import epoch_seconds
+from storage import COMMANDS, MemoryRepository
+
+T0 = datetime(2026, 1, 1, 14, 0, tzinfo=timezone.utc)
+SRC = T0 - timedelta(seconds=2)  # 샘플 시각
+
+
+class _FlakyInbox(MemoryRepository):
+    """수신함 트랜잭션이 처음 fail 번 실패하는 저장소"""
+
+    def __init__(self, fail: int, **kw):
+        super().__init__(**kw)
+        self.fail = fail
+
+    def transact_command_inbox(self, device_key, fn):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("inbox down")
+        return super().transact_command_inbox(device_key, fn)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [T0]
+    monkeypatch.setattr(main, "now_utc", lambda: now[0])
+    monkeypatch.setattr(main, "_command_dedup", CommandDedupCache(window_sec=60))
+    return now
+
+
+def _create(repo, *, changed_at=T0, source_ts=SRC, event_id="raw1", stage="Apnea"):
+    return main.create_command_for_stage(repo, "u", "s", stage, changed_at, source_ts, event_id)
+
+
+def _key(source_ts=SRC, event_id="raw1", stage="Apnea") -> str:
+    core = {"u": "u", "s": "s", "stg": stage, "src": round(epoch_seconds(source_ts) * 1000), "ev": event_id}
+    return hashlib.sha1(json.dumps(core, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def test_key_ignores_processing_time(clock):
+    repo = MemoryRepository(now=lambda: clock[0])
+    assert _create(repo)
+    assert list(repo.collections[COMMANDS]) == [_key()]
+    assert repo.collections[COMMANDS][_key()]["dedupKey"] == _key()
+
+    # 트리거 재전송 - changed_at(처리 시각) 만 다름 → 캐시에서 걸러짐 (Firestore 호출 없음)
+    clock[0] = T0 + timedelta(seconds=5)
+    reads = repo.stats["reads"]
+    assert not _create(repo, changed_at=clock[0])
+    assert main._command_dedup.stats == {"skipped": 1, "created": 1, "duplicates": 0, "errors": 0}
+    assert repo.stats["reads"] == reads and len(repo.collections[COMMANDS]) == 1
+
+
+def test_key_changes_with_sample_event_or_stage(clock):
+    assert len({_key(), _key(source_ts=SRC + timedelta(milliseconds=1)), _key(event_id="raw2"),
+                _key(event_id=None), _key(stage="Snoring")}) == 5
+    assert _key(source_ts=SRC + timedelta(microseconds=400)) == _key()  # ms 단위로 반올림
+
+    repo = MemoryRepository(now=lambda: clock[0])
+    assert _create(repo) and _create(repo, event_id="raw2")
+    assert sorted(repo.collections[COMMANDS]) == sorted([_key(), _key(event_id="raw2")])
+
+
+def test_other_instance_duplicate_is_remembered(clock):
+    repo = MemoryRepository(now=lambda: clock[0])
+    assert _create(repo)
+    main._command_dedup = CommandDedupCache(window_sec=60)  # 다른 (새) 인스턴스
+    assert not _create(repo)
+    assert main._command_dedup.stats["duplicates"] == 1 and len(main._command_dedup) == 1
+    assert not _create(repo)
+    assert main._command_dedup.stats["skipped"] == 1
+
+
+def test_inbox_failure_is_retried(clock):
+    repo = _FlakyInbox(fail=1, now=lambda: clock[0])
+    assert _create(repo)  # 명령 문서는 생김, 수신함만 실패
+    assert len(main._command_dedup) == 0 and main._command_dedup.stats["errors"] == 1
+    assert COMMAND_INBOX not in repo.collections
+
+    assert not _create(repo)  # 재전송 - 명령은 이미 있지만 수신함에는 반영
+    assert repo.collections[COMMAND_INBOX]["u"]["cells"]["cell1"]["id"] == _key()
+    assert main._command_dedup.stats["duplicates"] == 1 and len(main._command_dedup) == 1
+
+
+def test_cache_window_and_size():
+    cache = CommandDedupCache(window_sec=60, max_entries=2)
+    cache.remember("a", T0, "created")
+    assert cache.seen("a", T0 + timedelta(seconds=60))
+    assert not cache.seen("a", T0 + timedelta(seconds=61))  # 창이 지나면 만료
+    for i, key in enumerate("bcd"):
+        cache.remember(key, T0 + timedelta(seconds=100 + i), "created")
+    assert len(cache) == 2 and not cache.seen("b", T0 + timedelta(seconds=103))
+    assert cache.seen("d", T0 + timedelta(seconds=103))
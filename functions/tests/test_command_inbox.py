@@ -0,0 +1,105 @@
+# test_command_inbox.py
+# command_inbox.post: 첫 명령(set) / 이후(update), 같은 id 중복, 늦게 도착한 명령, 덮어쓴 seq, 이력 링 크기
+# 기기 쪽 확인 규칙(seq > applied[키] 이고 만료 전) 과 서버가 applied 를 건드리지 않는지 - MemoryRepository 트랜잭션으로
+
+from datetime import datetime, timedelta, timezone
+
+from command_inbox import COMMAND_INBOX, INBOX_HISTORY_SIZE, actuator_key, post
+from storage import MemoryRepository
+
+T0 = datetime(2026, 1, 1, 14, 0, tzinfo=timezone.utc)
+HEIGHT = {"cellIndex": 1, "targetLevel": 2}
+
+
+def _post(inbox, command_id, *, at=0.0, command_type="SET_HEIGHT", payload=HEIGHT, ttl_sec=20, stage="Apnea"):
+    issued = T0 + timedelta(seconds=at)
+    return post(inbox, command_id=command_id, user_id="u", session_id="s", command_type=command_type, payload=payload,
+                stage=stage, issued_at=issued, ttl_sec=ttl_sec, now=issued)
+
+
+def _apply(inbox, write):
+    """저장소의 set / update 흉내"""
+    op, data = write
+    return dict(data) if op == "set" else {**inbox, **data}
+
+
+def _due(inbox: dict, now: datetime) -> dict[str, dict]:
+    """기기 쪽 규칙 - 실행할 구동부별 명령"""
+    applied = inbox.get("applied") or {}
+    return {k: c for k, c in (inbox.get("cells") or {}).items() if c["seq"] > applied.get(k, 0) and c["expires_at"] > now}
+
+
+def test_actuator_key():
+    assert actuator_key("SET_HEIGHT", {"cellIndex": 2, "targetLevel": 1}) == "cell2"
+    assert actuator_key("SET_HEIGHT", {"cellIndex": "3"}) == "cell3"
+    assert actuator_key("SET_HEIGHT", {}) == "SET_HEIGHT"
+    assert actuator_key("VIBRATE", None) == "VIBRATE"
+
+
+def test_first_post_sets_then_updates():
+    result, write = _post(None, "a")
+    assert result == "posted" and write[0] == "set"
+    inbox = _apply(None, write)
+    assert inbox["seq"] == 1 and (inbox["userId"], inbox["sessionId"]) == ("u", "s")
+    assert inbox["cells"]["cell1"] == {
+        "seq": 1, "id": "a", "type": "SET_HEIGHT", "payload": HEIGHT, "stage": "Apnea", "sessionId": "s",
+        "issued_at": T0, "expires_at": T0 + timedelta(seconds=20),
+    }
+    assert inbox["history"] == [{"seq": 1, "id": "a", "key": "cell1", "type": "SET_HEIGHT", "stage": "Apnea",
+                                 "issued_at": T0, "replaced": None}]
+
+    result, write = _post(inbox, "b", at=5, command_type="VIBRATE", payload={})
+    assert result == "posted" and write[0] == "update"
+    inbox = _apply(inbox, write)
+    assert inbox["seq"] == 2 and set(inbox["cells"]) == {"cell1", "VIBRATE"}
+
+
+def test_newer_command_replaces_same_actuator():
+    inbox = _apply(None, _post(None, "a")[1])
+    result, write = _post(inbox, "b", at=3, payload={"cellIndex": 1, "targetLevel": 1}, stage="Snoring")
+    inbox = _apply(inbox, write)
+    assert result == "posted" and inbox["cells"]["cell1"]["id"] == "b" and inbox["cells"]["cell1"]["seq"] == 2
+    assert inbox["history"][-1]["replaced"] == 1
+
+
+def test_duplicate_id_writes_nothing():
+    inbox = _apply(None, _post(None, "a")[1])
+    assert _post(inbox, "a", at=1) == ("duplicate", None)  # 아직 cells 에 있음
+    inbox = _apply(inbox, _post(inbox, "b", at=2)[1])
+    assert inbox["cells"]["cell1"]["id"] == "b"
+    assert _post(inbox, "a", at=3) == ("duplicate", None)  # 덮어써졌어도 history 에 남아 있음
+
+
+def test_older_command_is_stale():
+    inbox = _apply(None, _post(None, "b", at=10)[1])
+    assert _post(inbox, "a", at=5) == ("stale", None)
+    result, _ = _post(inbox, "c", at=5, command_type="VIBRATE", payload={})
+    assert result == "posted"  # 다른 구동부는 상관없음
+
+
+def test_history_is_capped():
+    inbox = None
+    for i in range(INBOX_HISTORY_SIZE + 5):
+        _, write = _post(inbox, f"c{i}", at=i)
+        inbox = _apply(inbox, write)
+    assert inbox["seq"] == INBOX_HISTORY_SIZE + 5
+    assert len(inbox["history"]) == INBOX_HISTORY_SIZE
+    assert inbox["history"][0]["seq"] == 6 and inbox["history"][-1]["id"] == f"c{INBOX_HISTORY_SIZE + 4}"
+
+
+def test_device_ack_rule_through_repository():
+    repo = MemoryRepository(now=lambda: T0)
+    assert repo.transact_command_inbox("u", lambda inbox: _post(inbox, "a")) == "posted"
+    inbox = repo.collections[COMMAND_INBOX]["u"]
+    assert set(_due(inbox, T0 + timedelta(seconds=1))) == {"cell1"}
+    assert _due(inbox, T0 + timedelta(seconds=20)) == {}  # expires_at 이 지나면 실행하지 않음
+
+    inbox["applied"] = {"cell1": 1}  # 기기가 실행 후 기록
+    assert _due(inbox, T0 + timedelta(seconds=1)) == {}
+
+    assert repo.transact_command_inbox("u", lambda inbox: _post(inbox, "a", at=1)) == "duplicate"
+    assert repo.transact_command_inbox("u", lambda inbox: _post(inbox, "b", at=2)) == "posted"
+    inbox = repo.collections[COMMAND_INBOX]["u"]
+    assert inbox["applied"] == {"cell1": 1}  # 서버는 applied 를 건드리지 않음
+    assert [c["id"] for c in _due(inbox, T0 + timedelta(seconds=3)).values()] == ["b"]
+    assert repo.stats["transactions"] == 3 and repo.stats["writes"] == 2
@@ -0,0 +1,109 @@
+# test_decoder.py
+# to_utc 시각 형식/오류 처리, decode_sample 별칭/기본값/오류, decode_batch 정렬/세션 검사
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from decoder import DEFAULT_SESSION_ID, DEFAULT_USER_ID, DecodeError, decode_batch, decode_sample, epoch_seconds, to_utc
+
+UTC = timezone.utc
+T = datetime(2026, 1, 1, 14, 0, 0, 250_000, tzinfo=UTC)
+KST = timezone(timedelta(hours=9))
+NOW = datetime(2026, 1, 2, tzinfo=UTC)
+
+
+class _Timestamp:
+    """to_datetime() 만 있는 구버전 Timestamp 흉내"""
+
+    def __init__(self, dt):
+        self.dt = dt
+
+    def to_datetime(self):
+        return self.dt
+
+
+@pytest.mark.parametrize("value", [
+    T,
+    T.replace(tzinfo=None),
+    T.astimezone(KST),
+    epoch_seconds(T),
+    epoch_seconds(T) * 1000,
+    T.isoformat(),
+    T.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    {"seconds": int(epoch_seconds(T)), "nanos": 250_000_000},
+    {"_seconds": int(epoch_seconds(T)), "_nanoseconds": 250_000_000},
+    _Timestamp(T.replace(tzinfo=None)),
+])
+def test_to_utc_formats(value):
+    out = to_utc(value)
+    assert out == T and out.tzinfo is UTC
+
+
+@pytest.mark.parametrize("value", [
+    None, "not a time", "", {"nanos": 5}, {"seconds": "x"}, 1e30, float("nan"), True, object(), [1, 2],
+])
+def test_to_utc_unparseable_returns_default(value):
+    assert to_utc(value) is None
+    assert to_utc(value, default=NOW) == NOW
+
+
+def test_decode_sample_aliases_and_defaults():
+    s = decode_sample({"hr": "61.5", "mic_level": 33, "pressure_level": None, "pressure_avg": 1200, "ts": T.isoformat()})
+    assert (s.hr, s.spo2, s.mic_avg, s.pressure_avg) == (61.5, 98.0, 33.0, 1200.0)
+    assert (s.user_id, s.session_id, s.auto_control_active, s.source_ts) == (DEFAULT_USER_ID, DEFAULT_SESSION_ID, False, T)
+
+
+def test_decode_sample_prefers_first_alias():
+    s = decode_sample({"mic_avg": 10, "mic_level": 20, "ts": T})
+    assert s.mic_avg == 10.0
+
+
+def test_decode_sample_missing_or_bad_ts_uses_now():
+    assert decode_sample({"hr": 60}, now=lambda: NOW).source_ts == NOW
+    assert decode_sample({"hr": 60, "ts": "yesterday"}, now=lambda: NOW).source_ts == NOW
+
+
+@pytest.mark.parametrize("doc", [{"hr": "fast"}, {"spo2": [97]}, {"pressure_level": {"v": 1}}])
+def test_decode_sample_bad_number_raises(doc):
+    with pytest.raises(DecodeError):
+        decode_sample({**doc, "ts": T})
+
+
+def test_decode_batch_sorts_stably_and_keeps_columns():
+    docs = [
+        {"userId": "u", "sessionId": "s", "hr": 3, "ts": T + timedelta(seconds=2)},
+        {"userId": "u", "sessionId": "s", "hr": 1, "ts": T},
+        {"userId": "u", "sessionId": "s", "hr": 2, "ts": T, "auto_control_active": True},
+    ]
+    batch = decode_batch(docs)
+    assert batch.hr.tolist() == [1.0, 2.0, 3.0]
+    assert batch.auto_control_active.tolist() == [False, True, False]
+    assert batch.source_ts == [T, T, T + timedelta(seconds=2)]
+    assert batch.ts_epoch.tolist() == [epoch_seconds(t) for t in batch.source_ts]
+    assert batch.sample(1).hr == 2.0 and batch.sample(1).auto_control_active
+
+
+def test_decode_batch_missing_ts_shares_one_now():
+    calls = []
+
+    def now():
+        calls.append(1)
+        return NOW
+
+    batch = decode_batch([{"hr": 1}, {"hr": 2, "ts": None}], now=now)
+    assert batch.source_ts == [NOW, NOW] and len(calls) == 1
+
+
+def test_decode_batch_errors():
+    with pytest.raises(DecodeError):
+        decode_batch([])
+    with pytest.raises(DecodeError):
+        decode_batch([{"sessionId": "a", "ts": T}, {"sessionId": "b", "ts": T}])
+    with pytest.raises(DecodeError):
+        decode_batch([{"hr": "x", "ts": T}])
+
+
+def test_decode_batch_explicit_ids_override_docs():
+    batch = decode_batch([{"sessionId": "a", "ts": T}, {"sessionId": "b", "ts": T}], user_id="u", session_id="s")
+    assert (batch.user_id, batch.session_id, len(batch)) == ("u", "s", 2)
@@ -0,0 +1,116 @@
+# test_hypnogram.py
+# 하이프노그램 페이지 쓰기(넘침 페이지 포함) → 읽기, 열린 구간 닫기, 해상도별 재표본, 점수용 합계
+
+from datetime import datetime, timedelta, timezone
+
+from hypnogram import (
+    HYPNOGRAM_FORMAT_VERSION, HYPNOGRAM_RUNS_PER_DOC, UNKNOWN_CODE,
+    append_pages, closed_run, read_hypnogram, resample, sleep_totals, stage_code, stage_name,
+)
+from stage_vector import APNEA, AWAKE, DEEP, LIGHT, REM
+
+ORIGIN = datetime(2026, 1, 1, 14, 0, tzinfo=timezone.utc)
+
+
+def _at(sec: float) -> datetime:
+    return ORIGIN + timedelta(seconds=sec)
+
+
+def _merge_into(store: dict[int, dict], pages: dict[int, dict]) -> None:
+    """set(merge=True) 흉내 - runs 는 키별로 합침"""
+    for page, fields in pages.items():
+        doc = store.setdefault(page, {})
+        for k, v in fields.items():
+            if k == "runs":
+                doc.setdefault("runs", {}).update(v)
+            else:
+                doc[k] = v
+
+
+def test_stage_codes():
+    assert stage_code("Deep") == DEEP and stage_name(DEEP) == "Deep"
+    assert stage_code("Dozing") == UNKNOWN_CODE and stage_name(UNKNOWN_CODE) == "Unknown"
+    assert closed_run("Light", _at(30), _at(90.5), ORIGIN) == [LIGHT, 30.0, 60.5]
+
+
+def test_append_pages_head_only():
+    pages = append_pages("u", "s", ORIGIN, [(0, [LIGHT, 0.0, 30.0])], [DEEP, 30.0])
+    assert list(pages) == [0]
+    head = pages[0]
+    assert head == {"runs": {"0": [LIGHT, 0.0, 30.0]}, "v": HYPNOGRAM_FORMAT_VERSION, "userId": "u",
+                    "sessionId": "s", "start_ts": ORIGIN, "open": [DEEP, 30.0]}
+
+
+def test_append_pages_without_runs_still_writes_head():
+    pages = append_pages("u", "s", ORIGIN, [], None)
+    assert list(pages) == [0] and "runs" not in pages[0] and "open" not in pages[0]
+
+
+def test_overflow_pages_round_trip():
+    last = HYPNOGRAM_RUNS_PER_DOC  # 첫 넘침 페이지의 첫 순번
+    store: dict[int, dict] = {}
+    _merge_into(store, append_pages("u", "s", ORIGIN, [(i, [i % 2, i * 30.0, 30.0]) for i in range(last)], [REM, last * 30.0]))
+    assert list(store) == [0] and "pages" not in store[0]
+
+    pages = append_pages("u", "s", ORIGIN, [(last - 1, [1, (last - 1) * 30.0, 30.0]), (last, [REM, last * 30.0, 45.0])],
+                         [AWAKE, last * 30.0 + 45.0])
+    assert sorted(pages) == [0, 1]
+    assert pages[0]["pages"] == 2 and list(pages[0]["runs"]) == [str(last - 1)]
+    assert pages[1] == {"runs": {str(last): [REM, last * 30.0, 45.0]}, "userId": "u", "sessionId": "s", "page": 1}
+    _merge_into(store, pages)
+
+    hyp = read_hypnogram(store[0], [store[1]])
+    assert len(hyp.runs) == last + 1
+    assert hyp.runs[-1] == [REM, last * 30.0, 45.0] and hyp.runs[0] == [0, 0.0, 30.0]
+    assert hyp.open == [AWAKE, last * 30.0 + 45.0]
+    assert (hyp.user_id, hyp.session_id, hyp.start_ts) == ("u", "s", ORIGIN)
+
+
+def test_read_orders_runs_numerically():
+    head = {"start_ts": ORIGIN, "runs": {"10": [DEEP, 300, 30], "2": [LIGHT, 60, 240], "1": [AWAKE, 0, 60]}}
+    assert [r[1] for r in read_hypnogram(head).runs] == [0.0, 60.0, 300.0]
+
+
+def test_until_closes_open_run():
+    hyp = read_hypnogram({"start_ts": ORIGIN, "runs": {"0": [LIGHT, 0, 60]}, "open": [DEEP, 60]})
+    assert hyp.until(_at(150)) == [[LIGHT, 0.0, 60.0], [DEEP, 60.0, 90.0]]
+    assert hyp.until(_at(30)) == [[LIGHT, 0.0, 60.0]]  # 열린 구간 시작보다 이전
+
+
+def test_resample_raw_merges_adjacent_same_stage():
+    runs = [[LIGHT, 0, 30], [LIGHT, 30, 30], [DEEP, 60, 30], [LIGHT, 100, 20]]
+    assert resample(runs, None) == [[LIGHT, 0, 60], [DEEP, 60, 30], [LIGHT, 100, 20]]
+    assert resample([], 30) == []
+    assert runs[0] == [LIGHT, 0, 30]  # 입력은 바꾸지 않음
+
+
+def test_resample_majority_per_epoch():
+    runs = [[LIGHT, 0, 40], [DEEP, 40, 60], [REM, 100, 60], [AWAKE, 160, 5]]
+    # 0-60: Light 40 / 60-120: Deep 40 / 120-165: REM 40, Awake 5 (마지막 epoch 는 165 에서 잘림)
+    assert resample(runs, 60) == [[LIGHT, 0.0, 60.0], [DEEP, 60.0, 60.0], [REM, 120.0, 45.0]]
+
+
+def test_resample_ties_pick_smaller_code_and_clip_last_epoch():
+    runs = [[LIGHT, 0, 30], [DEEP, 30, 30], [AWAKE, 60, 10]]
+    assert resample(runs, 60) == [[DEEP, 0.0, 60.0], [AWAKE, 60.0, 10.0]]
+
+
+def test_resample_keeps_origin_offset():
+    runs = [[LIGHT, 100, 30], [DEEP, 130, 90]]
+    assert resample(runs, 60) == [[DEEP, 100.0, 120.0]]
+
+
+def test_sleep_totals():
+    assert sleep_totals(read_hypnogram({"start_ts": ORIGIN})) is None
+
+    open_only = sleep_totals(read_hypnogram({"start_ts": ORIGIN, "open": [LIGHT, 0]}))
+    assert open_only == {"total_duration_sec": 0.0, "stage_durations": {}, "apnea_event_count": 0}
+
+    hyp = read_hypnogram({"start_ts": ORIGIN, "runs": {
+        "0": [LIGHT, 0, 600], "1": [APNEA, 600, 20], "2": [LIGHT, 620, 300], "3": [APNEA, 920, 15],
+        "4": [UNKNOWN_CODE, 935, 65],
+    }, "open": [DEEP, 1000]})
+    totals = sleep_totals(hyp)
+    assert totals["total_duration_sec"] == 1000.0
+    assert totals["stage_durations"] == {"Light": 900.0, "Apnea": 35.0, "Unknown": 65.0}
+    assert totals["apnea_event_count"] == 2
@@ -0,0 +1,112 @@
+# test_report_jobs.py
+# 리포트 작업 큐 상태 전이 (MemoryJobStore) - 성공, 실패 재시도, 리스 만료, 워커가 계속 죽는 작업
+
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from report_jobs import (
+    DONE, FAILED, LEASED, PENDING, REPORT_JOB_LEASE_SEC, REPORT_JOB_MAX_ATTEMPTS,
+    MemoryJobStore, enqueue_report_job, run_report_jobs,
+)
+
+T0 = datetime(2026, 1, 1, 20, 0, tzinfo=timezone.utc)
+OWNER = "instance-a"
+
+
+class _Clock:
+    def __init__(self, t: datetime):
+        self.t = t
+
+    def __call__(self) -> datetime:
+        return self.t
+
+    def advance(self, **kw) -> datetime:
+        self.t += timedelta(**kw)
+        return self.t
+
+
+@pytest.fixture
+def clock() -> _Clock:
+    return _Clock(T0)
+
+
+@pytest.fixture
+def store(clock) -> MemoryJobStore:
+    store = MemoryJobStore()
+    enqueue_report_job(store, "u1", "s1", T0, rng=random.Random(1))
+    clock.t = store.jobs["s1"]["run_after"]
+    return store
+
+
+def _run(store, clock, handler, owner=OWNER) -> dict:
+    return run_report_jobs(store, handler, owner=owner, now=clock(), clock=clock, concurrency=1)
+
+
+def test_enqueue_is_idempotent(store):
+    assert not enqueue_report_job(store, "u1", "s1", T0)
+    assert list(store.jobs) == ["s1"]
+
+
+def test_success_marks_done(store, clock):
+    seen = []
+    stats = _run(store, clock, seen.append)
+    job = store.jobs["s1"]
+    assert stats[DONE] == 1 and len(seen) == 1
+    assert job["status"] == DONE and job["attempts"] == 1 and job["lease_owner"] is None
+
+
+def test_failure_backs_off_then_fails(store, clock):
+    def boom(job):
+        raise RuntimeError("no data")
+
+    for attempt in range(1, REPORT_JOB_MAX_ATTEMPTS + 1):
+        stats = _run(store, clock, boom)
+        job = store.jobs["s1"]
+        assert stats["leased"] == 1 and job["attempts"] == attempt and job["last_error"] == "no data"
+        if attempt < REPORT_JOB_MAX_ATTEMPTS:
+            assert job["status"] == PENDING and job["run_after"] > clock()
+            assert _run(store, clock, boom)["due"] == 0  # 백오프 중에는 가져가지 않음
+            clock.t = job["run_after"]
+    assert store.jobs["s1"]["status"] == FAILED
+
+
+def test_lease_owner_is_per_claim(store, clock):
+    owners = []
+    _run(store, clock, lambda job: owners.append(job["lease_owner"]))
+    store.jobs["s1"].update(status=PENDING)
+    _run(store, clock, lambda job: owners.append(job["lease_owner"]))
+    assert len(set(owners)) == 2 and all(o.startswith(OWNER + ":") for o in owners)
+
+
+def test_expired_lease_is_taken_over_and_old_finish_is_ignored(store, clock):
+    """같은 인스턴스라도 이전 리스의 완료 처리는 반영되지 않음"""
+    results = []
+
+    def slow(job):
+        if job["attempts"] == 1:
+            clock.advance(seconds=REPORT_JOB_LEASE_SEC + 1)
+            results.append(_run(store, clock, lambda j: None))  # 리스가 끝난 사이 다음 실행이 가져가서 완료
+            raise RuntimeError("too slow")
+
+    stats = _run(store, clock, slow)
+    assert stats["lost_lease"] == 1
+    assert results[0][DONE] == 1
+    job = store.jobs["s1"]
+    assert job["status"] == DONE and job["attempts"] == 2 and job["last_error"] is None
+
+
+def test_worker_that_keeps_dying_ends_failed(store, clock):
+    """리스만 잡고 완료 처리를 못 하는 작업 (인스턴스 종료) - 최대 횟수 뒤에는 다시 빌려주지 않음"""
+    for attempt in range(1, REPORT_JOB_MAX_ATTEMPTS + 1):
+        job = store.lease("s1", f"{OWNER}:dead{attempt}", clock())
+        assert job["status"] == LEASED and job["attempts"] == attempt
+        clock.advance(seconds=REPORT_JOB_LEASE_SEC)
+
+    calls = []
+    stats = _run(store, clock, calls.append)
+    job = store.jobs["s1"]
+    assert calls == [] and stats[FAILED] == 1
+    assert job["status"] == FAILED and job["attempts"] == REPORT_JOB_MAX_ATTEMPTS and job["lease_owner"] is None
+    assert _run(store, clock, calls.append)["due"] == 0
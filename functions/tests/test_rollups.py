@@ -0,0 +1,103 @@
+# test_rollups.py
+# 리포트 + 월 롤업 쓰기 (다시 계산해서 월이 바뀌는 경우 포함), 롤업 읽기, 폴백 조회 결과로 롤업 채우기
+
+from datetime import datetime, timezone
+
+import pytest
+
+from fake_firestore import MemFirestore
+from rollups import META_DOC_ID, RollupBackfill, load_rollup_reports, month_key, write_report_with_rollup
+
+USER = "u1"
+
+
+def _report(session_id: str, created_at: datetime, score: int = 80) -> dict:
+    return {
+        "sessionId": session_id,
+        "userId": USER,
+        "total_score": score,
+        "created_at": created_at.isoformat(),
+        "summary": {"total_duration_hours": 7.5, "deep_ratio": 20.0, "rem_ratio": 22.5},
+    }
+
+
+def _rollup(db: MemFirestore, key: str) -> dict | None:
+    return db.collection("users").document(USER).collection("rollups").document(key).get().to_dict()
+
+
+@pytest.fixture
+def db() -> MemFirestore:
+    return MemFirestore()
+
+
+def test_write_sets_report_month_and_meta(db):
+    created = datetime(2026, 3, 10, 22, 0, tzinfo=timezone.utc)
+    write_report_with_rollup(db, "s1", _report("s1", created))
+
+    assert db.collection("sleep_reports").document("s1").get().to_dict()["created_at"] == created
+    entry = _rollup(db, "2026-03")["reports"]["s1"]
+    assert entry["score"] == 80 and entry["created_at"] == created and entry["weekday"] == created.weekday()
+    assert _rollup(db, META_DOC_ID) == {"complete_from": created}
+
+
+def test_recompute_across_months_moves_the_entry(db):
+    first = datetime(2026, 3, 31, 23, 30, tzinfo=timezone.utc)
+    again = datetime(2026, 4, 1, 0, 10, tzinfo=timezone.utc)
+    write_report_with_rollup(db, "s1", _report("s1", first, score=70))
+    write_report_with_rollup(db, "s1", _report("s1", again, score=75))
+
+    assert "s1" not in _rollup(db, "2026-03")["reports"]
+    assert _rollup(db, "2026-04")["reports"]["s1"]["score"] == 75
+    assert _rollup(db, META_DOC_ID) == {"complete_from": first}  # 처음 쓴 시각 그대로
+
+    rows = load_rollup_reports(db, USER, first, end=again)
+    assert [(r["sessionId"], r["total_score"]) for r in rows] == [("s1", 75)]
+
+
+def test_recompute_in_same_month_keeps_other_sessions(db):
+    t1 = datetime(2026, 3, 1, 22, 0, tzinfo=timezone.utc)
+    t2 = datetime(2026, 3, 2, 22, 0, tzinfo=timezone.utc)
+    write_report_with_rollup(db, "s1", _report("s1", t1))
+    write_report_with_rollup(db, "s2", _report("s2", t2))
+    write_report_with_rollup(db, "s1", _report("s1", t1, score=90))
+
+    reports = _rollup(db, "2026-03")["reports"]
+    assert reports["s1"]["score"] == 90 and "s2" in reports
+
+
+def test_load_returns_none_before_complete_from(db):
+    created = datetime(2026, 3, 10, tzinfo=timezone.utc)
+    write_report_with_rollup(db, "s1", _report("s1", created))
+    assert load_rollup_reports(db, USER, datetime(2026, 3, 1, tzinfo=timezone.utc), end=created) is None
+
+
+def test_backfill_flushes_each_month_and_pulls_complete_from(db):
+    start = datetime(2026, 1, 15, tzinfo=timezone.utc)
+    later = datetime(2026, 3, 5, tzinfo=timezone.utc)
+    write_report_with_rollup(db, "s3", _report("s3", later))  # 롤업이 생긴 뒤 첫 리포트 → complete_from = later
+
+    backfill = RollupBackfill(db, USER, start)
+    olds = [  # 폴백 조회 결과 = Firestore 에서 읽은 리포트 (created_at 이 datetime)
+        {**_report("s1", start, score=60), "created_at": datetime(2026, 1, 20, tzinfo=timezone.utc)},
+        {**_report("s2", start, score=65), "created_at": datetime(2026, 2, 3, tzinfo=timezone.utc)},
+    ]
+    for r in olds:
+        backfill.add(r)
+    assert _rollup(db, "2026-01")["reports"].keys() == {"s1"}  # 월이 바뀌면서 1월 내려씀
+    assert _rollup(db, "2026-02") is None  # 2월은 finish() 전까지 메모리에만
+    backfill.finish()
+
+    assert _rollup(db, META_DOC_ID) == {"complete_from": start}
+    rows = load_rollup_reports(db, USER, start, end=later)
+    assert [r["sessionId"] for r in rows] == ["s1", "s2", "s3"]
+    assert rows[0]["created_at"] == olds[0]["created_at"] and rows[0]["total_score"] == 60
+    assert month_key(rows[1]["created_at"]) == "2026-02"
+
+
+def test_backfill_without_finish_leaves_meta(db):
+    later = datetime(2026, 3, 5, tzinfo=timezone.utc)
+    write_report_with_rollup(db, "s3", _report("s3", later))
+
+    backfill = RollupBackfill(db, USER, datetime(2026, 1, 1, tzinfo=timezone.utc))
+    backfill.add(_report("s1", datetime(2026, 1, 20, tzinfo=timezone.utc)))
+    assert _rollup(db, META_DOC_ID) == {"complete_from": later}
@@ -0,0 +1,105 @@
+# test_stabilizer.py
+# legacy 설정 = 예전 규칙(단계 무관 30초 유지), 긴급 단계, 히스테리시스(표 차이 + 확인 시간), 유지 시간, 설정 파싱
+
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from stabilizer import PRESETS, StabilizerConfig, parse_config, step, vote
+
+T0 = datetime(2026, 1, 1, 14, 0, tzinfo=timezone.utc)
+STAGES = ("Deep", "Light", "REM", "Awake", "Apnea", "Snoring", "Tossing")
+
+
+def _legacy_rule(stable: str | None, since: datetime | None, raw_stage: str, now: datetime) -> str | None:
+    """stabilizer 이전 main._step_session_state 의 규칙"""
+    if raw_stage == stable:
+        return None
+    elapsed = (now - since).total_seconds() if since else 10**9
+    return raw_stage if elapsed >= 30 else None
+
+
+def _run(config: StabilizerConfig, raws, start_stable: str, *, dt: float = 1.0, since: datetime | None = T0):
+    """raw 단계를 dt 초 간격으로 넣고 각 스텝의 안정 단계 목록"""
+    stab, stable, out = None, start_stable, []
+    for i, raw in enumerate(raws, start=1):
+        now = T0 + timedelta(seconds=i * dt)
+        stab, change = step(config, stab, stable, since, raw, now)
+        if change is not None:
+            stable, since = change, now
+        out.append(stable)
+    return out, stab
+
+
+def test_legacy_matches_old_rule():
+    config = parse_config("legacy")
+    assert config.stateless
+    rng = random.Random(7)
+    stable, since, now = "Light", T0, T0
+    for _ in range(20_000):
+        now += timedelta(seconds=rng.choice((0.5, 1, 1, 1, 3, 12, 31)))
+        raw = rng.choice(STAGES[:4]) if rng.random() < 0.9 else rng.choice(STAGES)
+        stab, change = step(config, None, stable, since, raw, now)
+        assert stab is None
+        assert change == _legacy_rule(stable, since, raw, now), (stable, since, raw, now)
+        if change is not None:
+            stable, since = change, now
+
+
+def test_legacy_without_since_switches_immediately():
+    assert step(parse_config("legacy"), None, "Light", None, "Deep", T0) == (None, "Deep")
+
+
+def test_urgent_stage_skips_dwell_and_confirm():
+    config = parse_config("smoothed")
+    stable = ["Light"] * 14
+    out, _ = _run(config, stable + ["Apnea", "Apnea"], "Light", since=T0)
+    assert out[-1] == "Light"  # 창에 Apnea 2개 < urgent_votes 3
+    out, stab = _run(config, stable + ["Apnea"] * 3, "Light", since=T0)
+    assert out[-1] == "Apnea"  # 다수결로는 Light 이고 유지 시간(60초)도 안 지났지만 바로 전환
+    assert stab == {"window": (stable + ["Apnea"] * 3)[-15:], "candidate": None, "candidate_since": None}
+
+
+def test_hysteresis_needs_margin_over_stable_votes():
+    config = StabilizerConfig(window=5, vote="majority", default_dwell_sec=0, switch_margin=0.4)
+    # 창 L L L D D → 다수결 L (유지) / L L D D D → D 3표 - L 2표 = 1 < 2 / L D D D D → 3 ≥ 2 → 전환
+    out, _ = _run(config, ["Light"] * 3 + ["Deep"] * 4, "Light")
+    assert out == ["Light"] * 6 + ["Deep"]
+
+
+def test_confirm_sec_requires_a_steady_candidate():
+    config = StabilizerConfig(window=1, default_dwell_sec=0, confirm_sec=5)
+    out, stab = _run(config, ["Deep"] * 5, "Light", dt=1.0)
+    assert out == ["Light"] * 5 and stab["candidate"] == "Deep" and stab["candidate_since"] == T0 + timedelta(seconds=1)
+    out, _ = _run(config, ["Deep"] * 6, "Light", dt=1.0)
+    assert out[-1] == "Deep"  # 첫 후보 시각 + 5초
+    out, _ = _run(config, ["Deep"] * 3 + ["REM"] + ["Deep"] * 4, "Light", dt=1.0)
+    assert out == ["Light"] * 8  # 후보가 바뀌면 확인 시간을 처음부터
+
+
+def test_dwell_holds_stable_stage_and_keeps_candidate():
+    config = StabilizerConfig(window=2, dwell_sec={"Deep": 120}, default_dwell_sec=30)  # 창 2 = 후보를 기억하는 설정
+    out, stab = _run(config, ["Light"] * 100, "Deep", since=T0)
+    assert set(out) == {"Deep"} and stab["candidate"] == "Light"
+    out, _ = _run(config, ["Light"] * 120, "Deep", since=T0)
+    assert out[-1] == "Light"
+
+
+def test_vote_modes():
+    majority = StabilizerConfig(window=5, vote="majority")
+    assert vote(majority, ["Deep", "Light", "Deep", "Light"], "Light") == ("Light", 2)  # 동률 → 지금 안정 단계
+    assert vote(majority, ["Deep", "REM", "Deep", "REM"], "Light") == ("REM", 2)       # 동률 → 최근 단계
+    median = StabilizerConfig(window=5, vote="median")
+    assert vote(median, ["Awake", "Deep", "Light", "Deep", "REM"], None) == ("Light", 1)
+    assert vote(median, ["Snoring", "Snoring", "Snoring", "Deep", "Light"], None) == ("Snoring", 3)
+
+
+def test_parse_config():
+    assert parse_config(None).as_dict() == StabilizerConfig(**PRESETS["legacy"]).as_dict()
+    config = parse_config('{"preset": "smoothed", "dwell_sec": {"Deep": 180}, "confirm_sec": 20}')
+    assert config.window == 15 and config.dwell_for("Deep") == 180 and config.dwell_for("REM") == 60
+    assert config.confirm_sec == 20 and config.urgent == {"Apnea"}
+    for bad in ("nope", '{"window": 0}', '{"vote": "mean"}', '{"switch_margin": 2}'):
+        with pytest.raises(ValueError):
+            parse_config(bad)
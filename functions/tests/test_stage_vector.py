@@ -0,0 +1,51 @@
+# test_stage_vector.py
+# 스칼라 규칙(main.predict_stage_hybrid / predict_stage_ai) 과 벡터 규칙(stage_vector) 이 샘플마다 같은 단계를 내는지
+# 처리량 비교는 bench/bench_stage_vector.py
+
+import numpy as np
+import pytest
+
+from main import predict_stage_ai, predict_stage_hybrid
+from stage_vector import STAGE_CODE, predict_stage_ai_batch, predict_stage_hybrid_batch
+
+N = 20_000
+SEED = 42
+
+# 규칙/트리의 경계값 - 랜덤 입력에 섞어서 <=, < 경계가 정확히 같은지 확인
+_EDGES = {
+    "hr": [59.5, 60, 70, 85, 95],
+    "spo2": [90.0, 95.9],
+    "mic_avg": [30, 45.5, 47.0, 150],
+    "pressure_avg": [100.0, 499.5, 1000, 1504.0, 3000, 3010.5],
+}
+
+
+@pytest.fixture(scope="module")
+def cols() -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(SEED)
+    cols = {
+        "hr": rng.uniform(40, 110, N),
+        "spo2": rng.uniform(85, 100, N),
+        "mic_avg": rng.uniform(0, 200, N),
+        "pressure_avg": rng.uniform(0, 3500, N),
+    }
+    for name, edges in _EDGES.items():
+        idx = rng.choice(N, size=N // 20, replace=False)
+        cols[name][idx] = rng.choice(edges, size=idx.size)
+    # NaN 도 스칼라와 같은 분기로 가야 함
+    for col in cols.values():
+        col[rng.choice(N, size=N // 1000, replace=False)] = np.nan
+    return cols
+
+
+@pytest.mark.parametrize("scalar_fn, vector_fn", [
+    (predict_stage_hybrid, predict_stage_hybrid_batch),
+    (predict_stage_ai, predict_stage_ai_batch),
+])
+def test_vector_matches_scalar(cols, scalar_fn, vector_fn):
+    args = (cols["hr"], cols["spo2"], cols["mic_avg"], cols["pressure_avg"])
+    rows = list(zip(*(a.tolist() for a in args)))
+    expected = np.fromiter((STAGE_CODE[scalar_fn(*r)] for r in rows), dtype=np.int8, count=len(rows))
+    actual = vector_fn(*args)
+    mismatch = np.flatnonzero(expected != actual)
+    assert mismatch.size == 0, f"{mismatch.size}건 불일치, 예: {rows[mismatch[0]]} -> {expected[mismatch[0]]} vs {actual[mismatch[0]]}"
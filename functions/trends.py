@@ -0,0 +1,91 @@
+# trends.py
+# ✅ [월간 트렌드 집계기] calculate_monthly_trends 의 전체/주중·주말/요일별/주별 통계를
+# 리포트를 한 번만 훑으면서 고정 크기 누적기로 계산 (리포트 목록을 들고 있지 않음)
+#
+# ⚠️ 합계는 리포트 순서대로 0 부터 더하므로 sum(list) 와 같은 값 → 반올림 결과도 같음
+
+from datetime import datetime, timedelta, timezone
+
+WEEKDAY_NAMES = ["월요일", "화요일", "수요일", "목요일", "금요일", "토요일", "일요일"]
+TREND_WEEKS = 4
+
+
+class _Bucket:
+    __slots__ = ("count", "score", "hours")
+
+    def __init__(self):
+        self.count = 0
+        self.score = 0
+        self.hours = 0
+
+    def add(self, score, hours) -> None:
+        self.count += 1
+        self.score += score
+        self.hours += hours
+
+
+class MonthlyTrendAggregator:
+    """리포트 1건씩 add() → overall / weekday_vs_weekend / by_weekday / weekly_trends"""
+
+    def __init__(self, now: datetime | None = None):
+        now = now or datetime.now(timezone.utc)
+        # 주별 구간 [now-(w+1)주, now-w주), w=0 이 최근 1주
+        self._week_bounds = [
+            (now - timedelta(days=(week + 1) * 7), now - timedelta(days=week * 7)) for week in range(TREND_WEEKS)
+        ]
+        self.count = 0
+        self._score = 0
+        self._hours = 0
+        self._deep = 0
+        self._rem = 0
+        self._weekday = _Bucket()
+        self._weekend = _Bucket()
+        self._by_day = [_Bucket() for _ in range(7)]
+        self._by_week = [_Bucket() for _ in range(TREND_WEEKS)]
+
+    def add(self, score, hours, deep_ratio, rem_ratio, created_at: datetime) -> None:
+        self.count += 1
+        self._score += score
+        self._hours += hours
+        self._deep += deep_ratio
+        self._rem += rem_ratio
+
+        day = created_at.weekday()
+        (self._weekday if day < 5 else self._weekend).add(score, hours)  # 0=월 ~ 4=금 / 5=토, 6=일
+        self._by_day[day].add(score, hours)
+        for week, (week_start, week_end) in enumerate(self._week_bounds):
+            if week_start <= created_at < week_end:
+                self._by_week[week].add(score, 0)
+
+    def overall_average(self) -> dict:
+        n = self.count
+        return {
+            "score": round(self._score / n, 1),
+            "sleep_hours": round(self._hours / n, 2),
+            "deep_ratio": round(self._deep / n, 1),
+            "rem_ratio": round(self._rem / n, 1),
+        }
+
+    @staticmethod
+    def _summary(bucket: _Bucket) -> dict:
+        return {
+            "count": bucket.count,
+            "avg_score": round(bucket.score / bucket.count, 1),
+            "avg_hours": round(bucket.hours / bucket.count, 2),
+        }
+
+    def weekday_vs_weekend(self) -> dict:
+        result = {}
+        if self._weekday.count: result["weekday"] = self._summary(self._weekday)
+        if self._weekend.count: result["weekend"] = self._summary(self._weekend)
+        return result
+
+    def by_weekday(self) -> dict:
+        return {WEEKDAY_NAMES[i]: self._summary(b) for i, b in enumerate(self._by_day) if b.count}
+
+    def weekly_trends(self) -> list[dict]:
+        """오래된 주 → 최근 주 순서 (리포트가 없는 주는 빠짐)"""
+        return [
+            {"week": f"{week+1}주 전", "avg_score": round(b.score / b.count, 1), "count": b.count}
+            for week, b in reversed(list(enumerate(self._by_week))) if b.count
+        ]
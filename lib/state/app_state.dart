@@ -42,6 +42,8 @@ class AppState extends ChangeNotifier {
   // ✅ "새 뇌" (서버 뇌)를 위한 상태 변수
   // ----------------------------------------------------
   StreamSubscription? _commandSubscription;
+  final Map<String, int> _appliedCommandSeq = {}; // 구동부 키 -> 마지막으로 실행한 seq (성공했을 때만 올림)
+  final Map<String, int> _runningCommandSeq = {}; // 구동부 키 -> 지금 실행 중인 seq (스냅샷이 또 와도 겹쳐 실행하지 않게)
   String _currentSessionId = "";
   final String _currentUserId = "demoUser";
 
@@ -503,23 +505,20 @@ class AppState extends ChangeNotifier {
   // ----------------------------------------------------
 
   void _startCommandListener(String userId, String sessionId) {
-    print("✅ [Real Mode] '뇌'의 명령을 구독합니다... (userId: $userId)");
+    print("✅ [Real Mode] '뇌'의 명령 수신함을 구독합니다... (userId: $userId)");
 
+    // 기기 수신함 문서 하나만 구독 (command_inbox/{userId}) - 구동부(셀)마다 최신 명령만 들어 있음
+    _appliedCommandSeq.clear();
+    _runningCommandSeq.clear();
     _commandSubscription = FirebaseFirestore.instance
-        .collection('commands')
-        .where('userId', isEqualTo: userId)
-        .where('sessionId', isEqualTo: sessionId)
-        .where('status', isEqualTo: 'PENDING')
-        .orderBy('ts', descending: true)
-        .limit(1)
+        .collection('command_inbox')
+        .doc(userId)
         .snapshots()
         .listen(
       (snapshot) {
-        if (snapshot.docs.isNotEmpty) {
-          var commandDoc = snapshot.docs.first;
-          print("🧠 [뇌 명령 수신] type: ${commandDoc.data()['type']}");
-          _executePillowCommand(commandDoc);
-        }
+        final data = snapshot.data();
+        if (data == null) return;
+        _applyInbox(snapshot.reference, data, sessionId);
       },
       onError: (error) {
         print("❌ [Listen Error] $error");
@@ -527,12 +526,71 @@ class AppState extends ChangeNotifier {
     );
   }
 
-  void _executePillowCommand(DocumentSnapshot commandDoc) async {
-    String commandId = commandDoc.id;
-    Map<String, dynamic> data = commandDoc.data() as Map<String, dynamic>;
-    String type = data['type'];
-    Map<String, dynamic> payload = data['payload'];
+  Future<void> _applyInbox(DocumentReference inboxRef, Map<String, dynamic> data, String sessionId) async {
+    final cells = Map<String, dynamic>.from(data['cells'] ?? {});
+    final applied = Map<String, dynamic>.from(data['applied'] ?? {});
+    final now = DateTime.now();
+
+    for (final entry in cells.entries) {
+      final key = entry.key;
+      final cmd = Map<String, dynamic>.from(entry.value as Map);
+      final int seq = (cmd['seq'] as num?)?.toInt() ?? 0;
+      final int lastApplied = _appliedCommandSeq[key] ?? (applied[key] as num?)?.toInt() ?? 0;
+
+      // 이미 실행했거나 더 새 명령으로 덮어써진 것 / 지금 실행 중인 것은 건너뜀
+      if (seq <= lastApplied || _runningCommandSeq[key] == seq) continue;
+      final expiresAt = (cmd['expires_at'] as Timestamp?)?.toDate();
+      if (cmd['sessionId'] != sessionId || (expiresAt != null && expiresAt.isBefore(now))) {
+        // 다른 세션 것 / 만료된 것은 실행하지 않고 처리한 것으로 기록
+        print("⏭️ [명령 건너뜀] $key seq=$seq (만료 또는 다른 세션)");
+        _appliedCommandSeq[key] = seq;
+        await _markInboxApplied(inboxRef, key, seq);
+        continue;
+      }
+
+      print("🧠 [뇌 명령 수신] $key seq=$seq type: ${cmd['type']}");
+      _runningCommandSeq[key] = seq;
+      bool success = false;
+      try {
+        success = await _executePillowCommand(
+            cmd['type'] as String, Map<String, dynamic>.from(cmd['payload'] ?? {}));
+      } catch (e) {
+        print("❌ [명령 실행 실패] $key seq=$seq $e");
+      } finally {
+        if (_runningCommandSeq[key] == seq) _runningCommandSeq.remove(key);
+      }
+
+      // 실패하면 seq 를 올리지 않음 → 다음 스냅샷에서 다시 시도 (만료되면 위에서 건너뜀)
+      if (success) {
+        if (seq > (_appliedCommandSeq[key] ?? 0)) _appliedCommandSeq[key] = seq;
+        await _markInboxApplied(inboxRef, key, seq);
+        await _markCommandDone(cmd['id'] as String?);
+      }
+    }
+  }
+
+  Future<void> _markInboxApplied(DocumentReference inboxRef, String key, int seq) async {
+    try {
+      await inboxRef.update({'applied.$key': seq});
+    } catch (e) {
+      print("❌ [수신함 보고 실패] $e");
+    }
+  }
+
+  Future<void> _markCommandDone(String? commandId) async {
+    if (commandId == null) return;
+    try {
+      await FirebaseFirestore.instance.collection('commands').doc(commandId).update({
+        'status': 'DONE',
+        'doneTs': FieldValue.serverTimestamp(),
+      });
+      print("✅ [완료 보고] $commandId");
+    } catch (e) {
+      print("❌ [완료 보고 실패] $e");
+    }
+  }
 
+  Future<bool> _executePillowCommand(String type, Map<String, dynamic> payload) async {
     bool success = false;
     print("💪 [몸이 명령 수행] $type");
 
@@ -555,18 +613,7 @@ class AppState extends ChangeNotifier {
       print("⚠️ [Warning] 베개 미연결. 시뮬레이션 로그만 출력.");
       success = true; // 테스트용으로 성공 처리
     }
-
-    if (success) {
-      try {
-        await commandDoc.reference.update({
-          'status': 'DONE',
-          'doneTs': FieldValue.serverTimestamp(),
-        });
-        print("✅ [완료 보고] $commandId");
-      } catch (e) {
-        print("❌ [완료 보고 실패] $e");
-      }
-    }
+    return success;
   }
 
   @override